@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""
+Benchmark loading and querying a store with synthetic flowcells.
+
+Flowcell directories and cram.stats files are generated in the work directory, then
+loaded from the local filesystem or, with --s3, from a local S3 stand-in.  Ingest
+throughput and the latency of dashboard style queries are written as JSON to the
+results directory, named by time and git commit, so that runs can be compared with
+--compare.
+
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import pathlib as P
+import shutil
+import statistics
+import subprocess
+import time
+
+import pigeon.store
+from pigeon.cache import DiskCache
+from pigeon.cramstats_dir import LocalCramStatsDir, RemoteCramStatsDir
+from pigeon.flowcell_dir import LocalFlowcellDir, RemoteFlowcellDir
+from pigeon.listing import S3Listing
+from pigeon.local_s3 import LocalS3
+from pigeon.rollups import ROLLUPS
+from pigeon.synthetic import Flowcell, write_cramstats, write_flowcell
+
+log = logging.getLogger('benchmark_store')
+
+BUCKET = 'synthetic'
+
+
+def generate(data_path, flowcells, reads, cramstats_fraction):
+    """Write the synthetic data unless already generated with the same parameters"""
+    params = {'flowcells': flowcells, 'reads': reads, 'cramstats_fraction': cramstats_fraction}
+    params_path = data_path / 'params.json'
+    if params_path.exists() and json.loads(params_path.read_text()) == params:
+        log.info(f'Reusing synthetic data in {data_path}')
+        return
+
+    shutil.rmtree(data_path, ignore_errors=True)
+    for i in range(flowcells):
+        fc = Flowcell(i)
+        log.info(f'Generating {fc.name} with {reads} reads')
+        write_flowcell(data_path / BUCKET / 'flowcells', fc, reads)
+        write_cramstats(data_path / BUCKET / 'cramstats', fc, int(reads * cramstats_fraction))
+    params_path.write_text(json.dumps(params))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=P.Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def latency(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+
+    return {'min': min(times), 'median': statistics.median(times), 'max': max(times)}
+
+
+def ingest(store, sources, count_sql):
+    """Load each source, returning throughput and per source latency"""
+    times = []
+    rows = -store._conn.sql(count_sql).fetchone()[0]
+    size = sum(x[1] for x in sources)
+    for insert, _ in sources:
+        t0 = time.perf_counter()
+        insert()
+        times.append(time.perf_counter() - t0)
+    rows += store._conn.sql(count_sql).fetchone()[0]
+
+    total = sum(times)
+    return {
+        'sources': len(sources), 'rows': rows, 'bytes': size, 'seconds': total,
+        'rows_per_second': rows / total, 'mb_per_second': size / total / 1e6,
+        'latency': {'min': min(times), 'median': statistics.median(times), 'max': max(times)},
+    }
+
+
+def run_queries(store, repeats):
+    conn = store._conn
+    run_id = Flowcell(0).run_id
+    sample = 'select read_id from sequencing_summary using sample 100 rows (reservoir, 1)'
+    read_ids = [x[0] for x in conn.sql(sample).fetchall()]
+
+    queries = {}
+    for name, rollup in ROLLUPS.items():
+        # The query each dashboard chart made before rollups, and the rollup replacing it
+        queries[f'{name}.source'] = lambda q=rollup.select.format(rows=rollup.source): conn.sql(q).fetchall()
+        queries[f'{name}.rollup'] = lambda q=f'select * from {name}': conn.sql(q).fetchall()
+    queries['pore_activity.run'] = lambda: conn.execute('select * from pore_activity where run_id = ?', [run_id]).fetchall()
+    queries['get_reads.100'] = lambda: store.get_reads(read_ids)
+    queries['reads_in_window.1h'] = lambda: store.reads_in_window(run_id, 36000.0, 39600.0)
+
+    return {name: latency(fn, repeats) for (name, fn) in queries.items()}
+
+
+def benchmark(args, data_path, s3=None):
+    db_path = args.workdir / 'benchmark.duckdb'
+    db_path.unlink(missing_ok=True)
+    lake_path = None
+    if args.lake:
+        lake_path = args.workdir / 'lake'
+        shutil.rmtree(lake_path, ignore_errors=True)
+    store = pigeon.store.Store(str(db_path), lake_path=lake_path and str(lake_path), compact_schema=args.compact_schema,
+                               s3_config=s3 and s3.config)
+
+    root = data_path / BUCKET
+    fc_paths = sorted((root / 'flowcells').iterdir())
+    cram_paths = sorted((root / 'cramstats').iterdir())
+    dir_size = lambda p: sum(x.stat().st_size for x in p.iterdir())
+    if s3 is None:
+        fc_dirs = [LocalFlowcellDir(p) for p in fc_paths]
+        cram_dirs = [LocalCramStatsDir(p) for p in cram_paths]
+    else:
+        # By default through the disk cache, as duckdb's httpfs extension may not be available
+        client = s3.client()
+        listing = S3Listing(client)
+        cache = None
+        if not args.s3_direct:
+            cache = DiskCache(str(args.workdir / 'cache'), max_bytes=1 << 40)
+            cache.clear()
+        fc_dirs = [RemoteFlowcellDir(f's3://{BUCKET}/flowcells/{p.name}', client, listing, cache) for p in fc_paths]
+        cram_dirs = [RemoteCramStatsDir(f's3://{BUCKET}/cramstats/{p.name}', client, listing, cache) for p in cram_paths]
+
+    results = {
+        'insert_flowcell': ingest(store, [(lambda d=d: store.insert_flowcell(d), dir_size(p))
+                                          for (d, p) in zip(fc_dirs, fc_paths)],
+                                  'select count(*) from sequencing_summary'),
+        'insert_cramstats': ingest(store, [(lambda d=d: store.insert_cramstats(d), p.stat().st_size)
+                                           for (d, p) in zip(cram_dirs, cram_paths)],
+                                   'select count(*) from cramstats'),
+    }
+    results['queries'] = run_queries(store, args.repeats)
+    store.close()
+    results['db_bytes'] = db_path.stat().st_size
+
+    return results
+
+
+def compare(results, baseline):
+    """Print the ratio of each timing to the baseline's.  Below 1 is faster."""
+    print(f"{'benchmark':40} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for stage in ['insert_flowcell', 'insert_cramstats']:
+        if stage in baseline:
+            old, new = baseline[stage]['seconds'], results[stage]['seconds']
+            print(f'{stage:40} {old:10.3f} {new:10.3f} {new / old:7.2f}')
+    for name, timing in results['queries'].items():
+        if name in baseline.get('queries', {}):
+            old, new = baseline['queries'][name]['median'], timing['median']
+            print(f'{name:40} {old:10.4f} {new:10.4f} {new / old:7.2f}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workdir', type=P.Path, default=P.Path('benchmark_work'),
+                        help='directory for synthetic data and the benchmark store')
+    parser.add_argument('--results-dir', type=P.Path, default=P.Path('benchmark_results'),
+                        help='directory results are saved in')
+    parser.add_argument('--flowcells', type=int, default=4, help='number of flowcells')
+    parser.add_argument('--reads', type=int, default=1_000_000, help='reads per flowcell')
+    parser.add_argument('--cramstats-fraction', type=float, default=0.5,
+                        help='fraction of the reads of each flowcell in its cram.stats file')
+    parser.add_argument('--repeats', type=int, default=5, help='times each query is run')
+    parser.add_argument('--s3', action='store_true', help='load from a local S3 stand-in')
+    parser.add_argument('--s3-direct', action='store_true',
+                        help="with --s3, read files with duckdb's httpfs rather than through a disk cache")
+    parser.add_argument('--lake', action='store_true', help='benchmark a store with a parquet lake')
+    parser.add_argument('--compact-schema', action='store_true', help='benchmark a store with the compact schema')
+    parser.add_argument('--compare', type=P.Path, help='earlier results file to compare with')
+    args = parser.parse_args()
+
+    args.workdir.mkdir(parents=True, exist_ok=True)
+    data_path = args.workdir / 'data'
+    generate(data_path, args.flowcells, args.reads, args.cramstats_fraction)
+
+    if args.s3:
+        with LocalS3(str(data_path)) as s3:
+            results = benchmark(args, data_path, s3)
+    else:
+        results = benchmark(args, data_path)
+
+    commit = git_commit()
+    now = datetime.datetime.now()
+    results = {
+        'commit': commit, 'timestamp': now.isoformat(timespec='seconds'),
+        'params': {k: str(v) if isinstance(v, P.Path) else v for (k, v) in vars(args).items()},
+        **results,
+    }
+    args.results_dir.mkdir(parents=True, exist_ok=True)
+    results_path = args.results_dir / f"{now.strftime('%Y%m%dT%H%M%S')}-{commit}.json"
+    results_path.write_text(json.dumps(results, indent=2))
+    log.info(f'Results saved to {results_path}')
+
+    for stage in ['insert_flowcell', 'insert_cramstats']:
+        r = results[stage]
+        log.info(f"{stage}: {r['rows_per_second']:,.0f} rows/s, {r['mb_per_second']:.1f} MB/s, "
+                 f"median {r['latency']['median']:.2f}s per source")
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text()))
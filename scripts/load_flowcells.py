@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Load MinKNOW output directories, cram.stats files and alignment stats from a local or
+network filesystem.
+
+"""
+
+import argparse
+import logging
+
+import pigeon.cramstats_dir
+import pigeon.flowcell_dir
+import pigeon.store
+
+log = logging.getLogger('load_flowcells')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('db_path', help='path of the duckdb database to create or update')
+    parser.add_argument('flowcell_dirs', nargs='*', help='MinKNOW output directories')
+    parser.add_argument('--cramstats', nargs='*', default=[], help='cram.stats files')
+    parser.add_argument('--alignments', nargs='*', default=[],
+                        help='indexed CRAM or BAM files to compute cramstats from')
+    parser.add_argument('--reference', help='reference FASTA for decoding CRAM files')
+    parser.add_argument('--index-alignments', action='store_true',
+                        help='also index the records of --alignments files by read_id')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of flowcells to read concurrently')
+    parser.add_argument('--compact-schema', action='store_true',
+                        help='store tables with compact column types, migrating an existing store')
+    parser.add_argument('--lake-path',
+                        help='keep sequencing_summary and cramstats as partitioned parquet in this directory')
+    parser.add_argument('--memory-limit',
+                        help="limit duckdb's memory, e.g. 4GB, loading large sources in chunks and spilling to disk")
+    parser.add_argument('--threads', type=int, help='number of duckdb threads')
+    parser.add_argument('--temp-dir', help='directory duckdb spills to when over its memory limit')
+    parser.add_argument('--profile-ingest', action='store_true',
+                        help="keep duckdb's query profile of each table loaded in ingest_metrics")
+    parser.add_argument('--publish',
+                        help='when loading is done, publish a snapshot of the database here for readers')
+    parser.add_argument('--decompress-workers', type=int, default=0,
+                        help='decompress bgzip-compressed files to temporary copies, using this many threads')
+    parser.add_argument('--force', action='store_true',
+                        help='reload all sources, even if unchanged since they were loaded')
+    args = parser.parse_args()
+
+    resources = None
+    if args.memory_limit or args.threads or args.temp_dir:
+        resources = pigeon.store.ResourceProfile(memory_limit=args.memory_limit, threads=args.threads,
+                                                 temp_directory=args.temp_dir, preserve_insertion_order=False)
+    store = pigeon.store.Store(args.db_path, lake_path=args.lake_path, compact_schema=args.compact_schema,
+                               profile_ingest=args.profile_ingest, resources=resources)
+
+    flowcell_dirs = [pigeon.flowcell_dir.LocalFlowcellDir(path, args.decompress_workers)
+                     for path in args.flowcell_dirs]
+    failures = store.insert_flowcells(flowcell_dirs, workers=args.workers, force=args.force)
+    for fdir, error in failures:
+        log.error(f'Failed to process {fdir}: {error}')
+
+    for path in args.cramstats:
+        log.info(f'Processing {path}')
+        store.insert_cramstats(pigeon.cramstats_dir.LocalCramStatsDir(path, args.decompress_workers), force=args.force)
+
+    for path in args.alignments:
+        log.info(f'Processing {path}')
+        cdir = pigeon.cramstats_dir.AlignmentCramStatsDir(path, reference_filename=args.reference)
+        store.insert_cramstats(cdir, force=args.force)
+        if args.index_alignments:
+            store.index_alignments(path, args.reference, force=args.force)
+
+    if args.publish:
+        store.publish(args.publish)
+    store.close()
@@ -4,10 +4,13 @@ Create a duckdb database for data in the ONT Genome in a bottle (GIAB) dataset.
 
 """
 
-import sys
+import argparse
 import logging
 
+import pigeon.cache
+import pigeon.compression
 import pigeon.flowcell_dir
+import pigeon.listing
 import pigeon.store
 import pigeon.cramstats_dir
 
@@ -18,17 +21,16 @@ cramstats_path = 'giab_2023.05/analysis/stats'
 log = logging.getLogger('make_giab_db')
 
 
-def get_flowcell_paths(s3_client):
-    genome_prefixes = [x['Prefix'] for x in s3_client.list_objects(Bucket=bucket, Prefix=flowcell_path, Delimiter='/')['CommonPrefixes']]
+def get_flowcell_paths(listing):
+    genome_prefixes = listing.list(bucket, flowcell_path).prefixes
 
     for prefix in genome_prefixes:
-        for x in s3_client.list_objects(Bucket=bucket, Prefix=prefix, Delimiter='/')['CommonPrefixes']:
-            yield x['Prefix']
+        yield from listing.list(bucket, prefix).prefixes
 
 
-def get_cramstats_paths(s3_client):
-    for path in (x['Key'] for x in s3_client.list_objects(Bucket=bucket, Prefix=cramstats_path)['Contents']):
-        if path.endswith('cram.stats'):
+def get_cramstats_paths(listing):
+    for path in (x.key for x in listing.list(bucket, cramstats_path, recursive=True).objects):
+        if pigeon.compression.strip_compression(path).endswith('cram.stats'):
             yield path
 
 
@@ -39,20 +41,70 @@ if __name__ == '__main__':
         datefmt='%Y-%m-%d %H:%M:%S'
     )
 
-    # TODO : better argument handling
-    (db_path, ) = sys.argv[1:]
-
-    s3_client = pigeon.make_unsigned_s3()
-    store = pigeon.store.Store(db_path)
-
-    for path in get_flowcell_paths(s3_client):
-        log.info(f'Processing {path}')
-        fdir = pigeon.flowcell_dir.RemoteFlowcellDir(f's3://{bucket}/{path}', s3_client)
-        store.insert_flowcell(fdir)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('db_path', help='path of the duckdb database to create or update')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of flowcells to fetch and parse concurrently')
+    parser.add_argument('--prefetch-listing', action='store_true',
+                        help='list all flowcells with one recursive listing rather than one per flowcell')
+    parser.add_argument('--commit-every', type=int, default=1,
+                        help='number of flowcells to write per transaction')
+    parser.add_argument('--publish',
+                        help='when loading is done, publish a snapshot of the database here for readers')
+    parser.add_argument('--force', action='store_true',
+                        help='reload all sources, even if unchanged since they were loaded')
+    parser.add_argument('--compact-schema', action='store_true',
+                        help='store tables with compact column types, migrating an existing store')
+    parser.add_argument('--lake-path',
+                        help='keep sequencing_summary and cramstats as partitioned parquet in this directory')
+    parser.add_argument('--memory-limit',
+                        help="limit duckdb's memory, e.g. 4GB, loading large sources in chunks and spilling to disk")
+    parser.add_argument('--threads', type=int, help='number of duckdb threads')
+    parser.add_argument('--temp-dir', help='directory duckdb spills to when over its memory limit')
+    parser.add_argument('--endpoint-url', help='read the bucket from this S3 compatible endpoint rather than AWS')
+    parser.add_argument('--cache-dir', help='cache downloaded table files in this directory')
+    parser.add_argument('--cache-size', type=float, default=100.0,
+                        help='maximum size of the download cache in GB')
+    parser.add_argument('--decompress-workers', type=int, default=0,
+                        help='cache bgzip-compressed files decompressed, using this many threads')
+    args = parser.parse_args()
+
+    s3_config = pigeon.S3Config(endpoint_url=args.endpoint_url, unsigned=True,
+                                path_style=bool(args.endpoint_url)).for_workers(args.workers)
+    s3_client = s3_config.client()
+    # The bucket doesn't change during a build so listings never need refreshing
+    listing = pigeon.listing.S3Listing(s3_client, ttl=None)
+    if args.prefetch_listing:
+        listing.list(bucket, flowcell_path, recursive=True)
+
+    cache = None
+    if args.cache_dir:
+        cache = pigeon.cache.DiskCache(args.cache_dir, int(args.cache_size * 1e9), args.decompress_workers)
+
+    resources = None
+    if args.memory_limit or args.threads or args.temp_dir:
+        resources = pigeon.store.ResourceProfile(memory_limit=args.memory_limit, threads=args.threads,
+                                                 temp_directory=args.temp_dir, preserve_insertion_order=False)
+    store = pigeon.store.Store(args.db_path, lake_path=args.lake_path, compact_schema=args.compact_schema,
+                               resources=resources, s3_config=s3_config)
+
+    flowcell_dirs = (
+        pigeon.flowcell_dir.RemoteFlowcellDir(f's3://{bucket}/{path}', s3_client, listing, cache)
+        for path in get_flowcell_paths(listing)
+    )
+    failures = store.insert_flowcells(flowcell_dirs, workers=args.workers, force=args.force,
+                                      commit_every=args.commit_every)
+    for fdir, error in failures:
+        log.error(f'Failed to process {fdir}: {error}')
 
-    for path in get_cramstats_paths(s3_client):
+    for path in get_cramstats_paths(listing):
         log.info(f'Processing {path}')
-        cdir = pigeon.cramstats_dir.RemoteCramStatsDir(f's3://{bucket}/{path}', s3_client)
-        store.insert_cramstats(cdir)
+        cdir = pigeon.cramstats_dir.RemoteCramStatsDir(f's3://{bucket}/{path}', s3_client, listing, cache)
+        store.insert_cramstats(cdir, force=args.force)
 
+    if args.publish:
+        store.publish(args.publish)
     store.close()
+
+    if cache is not None:
+        log.info(f'Cache statistics: {cache.stats()}')
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+"""
+Rebuild the rollup tables used by the dashboards from the tables they aggregate.
+
+"""
+
+import argparse
+import logging
+
+import pigeon.store
+
+log = logging.getLogger('rebuild_rollups')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('db_path', help='path of the duckdb database')
+    args = parser.parse_args()
+
+    store = pigeon.store.Store(args.db_path)
+    store.rebuild_rollups()
+    store.close()
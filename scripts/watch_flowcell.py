@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""
+Load a MinKNOW output directory while its run is in progress, appending the rows
+written since the last poll, until the run completes.
+
+"""
+
+import argparse
+import logging
+
+import pigeon
+import pigeon.flowcell_dir
+import pigeon.store
+
+log = logging.getLogger('watch_flowcell')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('db_path', help='path of the duckdb database to create or update')
+    parser.add_argument('flowcell_dir', help='MinKNOW output directory, local or an s3:// URL')
+    parser.add_argument('--interval', type=float, default=60.0, help='seconds between polls')
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint to use rather than AWS')
+    parser.add_argument('--unsigned', action='store_true', help='make anonymous requests to S3')
+    args = parser.parse_args()
+
+    s3_config = pigeon.S3Config(endpoint_url=args.endpoint_url, unsigned=args.unsigned,
+                                path_style=bool(args.endpoint_url))
+    if args.flowcell_dir.startswith('s3://'):
+        flowcell_dir = pigeon.flowcell_dir.RemoteFlowcellDir(args.flowcell_dir, s3_config=s3_config)
+    else:
+        flowcell_dir = pigeon.flowcell_dir.LocalFlowcellDir(args.flowcell_dir)
+
+    store = pigeon.store.Store(args.db_path, s3_config=s3_config)
+    try:
+        store.watch_flowcell(flowcell_dir, interval=args.interval)
+        log.info(f'Run of {flowcell_dir} complete')
+    finally:
+        store.close()
@@ -3,16 +3,16 @@ Pigeon, an OLAP engine for Oxford Nanopore data.
 
 """
 
-from typing import Optional, Tuple
+from typing import NamedTuple, Optional, Tuple
 import pathlib as P
 from urllib.parse import urlparse
 
 import boto3
-from botocore import UNSIGNED
-from botocore.config import Config
 
 import logging
 
+from pigeon.s3_config import S3Config
+
 # --------
 
 log = logging.getLogger(__name__)
@@ -20,17 +20,34 @@ log = logging.getLogger(__name__)
 
 # --------
 
-def make_unsigned_s3(session: Optional[boto3.Session]=None):
+class SourceInfo(NamedTuple):
+    """
+    Identity of a source file, used to detect whether it changed since it was loaded.
+
+    """
+    path: str
+    etag: str
+    size: int
+
+
+def local_source_info(path: str) -> SourceInfo:
+    """
+    Return the SourceInfo of a file on a local or network filesystem.
+
     """
-    Create a boto3 session for making unsigned calls to S3.
+    stat = P.Path(path).stat()
+    # Local files have no ETag so identify versions by modification time and size
+    return SourceInfo(str(path), f'{stat.st_mtime_ns:x}-{stat.st_size:x}', stat.st_size)
 
+
+def make_unsigned_s3(session: Optional[boto3.Session]=None):
     """
-    if not session:
-        session = boto3.Session()
+    Create a boto3 client for making unsigned calls to S3.
 
-    client = session.client('s3', config=Config(signature_version=UNSIGNED))
+    Without a session, the client is shared with other users of S3Config(unsigned=True).
 
-    return client
+    """
+    return S3Config(unsigned=True).client(session)
 
 
 def split_bucket(url: str) -> Tuple[str, P.Path]:
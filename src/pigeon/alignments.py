@@ -0,0 +1,117 @@
+"""
+Locating and retrieving individual records of CRAM and BAM files.
+
+A BAM record is located by the BGZF virtual offset it starts at.  pysam can't seek
+within CRAM files, so a CRAM record is located by the byte offset of its container,
+used to group lookups, and its position, used to fetch it through the CRAM index.
+
+"""
+
+import itertools
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+import pyarrow as pa
+import pysam
+
+# Columns of the alignment_index table apart from the source file
+OFFSET_SCHEMA = pa.schema([
+    ('read_id', pa.string()),
+    ('file_offset', pa.int64()),
+    ('ref', pa.string()),
+    ('rstart', pa.int64()),
+])
+
+# Fields needed to locate a CRAM record: QNAME, FLAG, RNAME and POS
+CRAM_LOCATION_FIELDS = 0x1 | 0x2 | 0x4 | 0x8
+
+
+class Location(NamedTuple):
+    read_id: str
+    file_offset: int
+    ref: str
+    rstart: int
+
+
+def open_alignments(path: str, reference_filename: Optional[str]=None,
+                    required_fields: Optional[int]=None) -> pysam.AlignmentFile:
+    """
+    Open a CRAM or BAM file.
+
+    :param required_fields: if given, CRAM decoding is limited to these fields
+
+    """
+    format_options = [f'required_fields={required_fields:#x}'.encode()] if required_fields else None
+    return pysam.AlignmentFile(path, reference_filename=reference_filename, format_options=format_options)
+
+
+def iter_offsets(path: str, reference_filename: Optional[str]=None,
+                 batch_size: int=100_000) -> Iterator[pa.RecordBatch]:
+    """
+    Yield batches of the location of every mapped record of a file, in file order.
+
+    """
+    with open_alignments(path, reference_filename, CRAM_LOCATION_FIELDS) as bam:
+        batch = {name: [] for name in OFFSET_SCHEMA.names}
+        while True:
+            offset = bam.tell()
+            rec = next(bam, None)
+            if rec is None:
+                break
+            if rec.is_unmapped:
+                continue
+
+            batch['read_id'].append(rec.query_name)
+            batch['file_offset'].append(offset)
+            batch['ref'].append(rec.reference_name)
+            batch['rstart'].append(rec.reference_start)
+            if len(batch['read_id']) >= batch_size:
+                yield pa.RecordBatch.from_pydict(batch, schema=OFFSET_SCHEMA)
+                batch = {name: [] for name in OFFSET_SCHEMA.names}
+
+        if batch['read_id']:
+            yield pa.RecordBatch.from_pydict(batch, schema=OFFSET_SCHEMA)
+
+
+def fetch_records(path: str, locations: Iterable[Location],
+                  reference_filename: Optional[str]=None) -> Iterator[pysam.AlignedSegment]:
+    """
+    Yield the records at locations found by iter_offsets, in file order.
+
+    """
+    locations = sorted(locations, key=lambda x: (x.file_offset, x.rstart))
+    with open_alignments(path, reference_filename) as bam:
+        if bam.is_cram:
+            yield from _fetch_cram(bam, locations)
+        else:
+            yield from _fetch_bam(bam, locations)
+
+
+def _fetch_bam(bam: pysam.AlignmentFile, locations: Iterable[Location]) -> Iterator[pysam.AlignedSegment]:
+    position = None
+    for offset, group in itertools.groupby(locations, key=lambda x: x.file_offset):
+        read_ids = {x.read_id for x in group}
+        # Read on rather than seek if the record is later in the current BGZF block
+        if position is None or offset >> 16 != position >> 16 or offset < position:
+            bam.seek(offset)
+            position = offset
+        while position < offset:
+            next(bam)
+            position = bam.tell()
+
+        rec = next(bam)
+        position = bam.tell()
+        if rec.query_name in read_ids:
+            yield rec
+
+
+def _fetch_cram(bam: pysam.AlignmentFile, locations: Iterable[Location]) -> Iterator[pysam.AlignedSegment]:
+    # Decode each container once for all the records wanted from it
+    for (offset, ref), group in itertools.groupby(locations, key=lambda x: (x.file_offset, x.ref)):
+        group = list(group)
+        wanted = {(x.read_id, x.rstart) for x in group}
+        end = max(x.rstart for x in group)
+        for rec in bam.fetch(ref, min(x.rstart for x in group), end + 1):
+            if rec.reference_start > end:
+                break
+            if (rec.query_name, rec.reference_start) in wanted:
+                yield rec
@@ -0,0 +1,190 @@
+"""
+Local disk cache for remote table files.
+
+Objects are stored under a name derived from their bucket, key and ETag so a
+changed object is never served stale.  The cache is bounded in size and evicts
+the least recently used files first.  Files held for a load are pinned until it
+releases them, as duckdb relations read them lazily.
+
+bgzip-compressed objects may be decompressed in parallel as they are cached, so
+duckdb can read them with its parallel CSV reader rather than inflate them on
+one thread.
+
+"""
+
+import hashlib
+import os
+import pathlib as P
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import logging
+
+from .compression import compression_of, decompress_bgzf, is_bgzf, strip_compression
+
+log = logging.getLogger(__name__)
+
+
+class DiskCache:
+    """
+    A size-bounded, content-addressed cache of S3 objects on local disk.
+
+    The cache directory may be reused between processes.  Recency is persisted as
+    file modification times.
+
+    """
+
+    def __init__(self, path: str, max_bytes: int, decompress_workers: int=0):
+        """
+        :param path: directory to hold cached files.  Created if it doesn't exist.
+        :param max_bytes: size cap of the cache.  Least recently used files are evicted
+            once it is exceeded.
+        :param decompress_workers: if non-zero, bgzip files are cached decompressed,
+            inflating blocks on this many threads
+
+        """
+        self._path = P.Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._decompress_workers = decompress_workers
+
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._pins: Dict[str, int] = {}
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_downloaded = 0
+
+        # Restore existing entries, oldest first
+        files = [x for x in self._path.iterdir() if x.is_file() and not x.name.startswith('.')]
+        for f in sorted(files, key=lambda x: x.stat().st_mtime):
+            size = f.stat().st_size
+            self._entries[f.name] = size
+            self._size += size
+
+    def __repr__(self):
+        return f"DiskCache('{self._path}', max_bytes={self._max_bytes})"
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'bytes_downloaded': self.bytes_downloaded,
+            'size': self._size,
+            'files': len(self._entries),
+        }
+
+    def get(self, s3_client: 'botocore.client.S3', bucket: str, key: str, etag: str, pin: bool=False) -> str:
+        """
+        Return the local path of an object, downloading it if not already cached.
+        Decompressed objects are returned without their compression suffix.
+
+        :param pin: keep the file from being evicted until it is released with `release`
+
+        """
+        name = self._entry_name(bucket, key, etag)
+        names = [name]
+        if self._decompress_workers and compression_of(name) == 'gzip':
+            names.insert(0, strip_compression(name))
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(name, threading.Lock())
+
+        # Concurrent requests for the same object wait for a single download
+        try:
+            with key_lock:
+                return str(self._path / self._get(s3_client, bucket, key, names, pin))
+        finally:
+            with self._lock:
+                if self._key_locks.get(name) is key_lock:
+                    del self._key_locks[name]
+
+    def release(self, path: str) -> None:
+        """Unpin a file returned by `get` with pin=True"""
+        name = P.Path(path).name
+        with self._lock:
+            self._pins[name] -= 1
+            if not self._pins[name]:
+                del self._pins[name]
+                self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            for name in list(self._entries):
+                (self._path / name).unlink(missing_ok=True)
+            self._entries.clear()
+            self._size = 0
+
+    # --------
+
+    def _get(self, s3_client: 'botocore.client.S3', bucket: str, key: str, names: List[str], pin: bool) -> str:
+        """Return the name of the entry of an object, downloading it if necessary"""
+        with self._lock:
+            for name in names:
+                if name in self._entries and (self._path / name).exists():
+                    self.hits += 1
+                    self._entries.move_to_end(name)
+                    os.utime(self._path / name)
+                    if pin:
+                        self._pins[name] = self._pins.get(name, 0) + 1
+                    return name
+            self.misses += 1
+
+        log.info(f'Caching s3://{bucket}/{key}')
+        tmp_path = self._path / f'.tmp-{uuid.uuid4().hex}'
+        inflated_path = self._path / f'.tmp-{uuid.uuid4().hex}'
+        try:
+            s3_client.download_file(bucket, key, str(tmp_path))
+            downloaded = tmp_path.stat().st_size
+            if len(names) > 1 and is_bgzf(str(tmp_path)):
+                log.info(f'Decompressing s3://{bucket}/{key}')
+                decompress_bgzf(str(tmp_path), str(inflated_path), self._decompress_workers)
+                name = names[0]
+                os.replace(inflated_path, self._path / name)
+            else:
+                name = names[-1]
+                os.replace(tmp_path, self._path / name)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+            inflated_path.unlink(missing_ok=True)
+
+        size = (self._path / name).stat().st_size
+        with self._lock:
+            self.bytes_downloaded += downloaded
+            self._size += size - self._entries.get(name, 0)
+            self._entries[name] = size
+            self._entries.move_to_end(name)
+            if pin:
+                self._pins[name] = self._pins.get(name, 0) + 1
+            self._evict(keep=name)
+
+        return name
+
+    @staticmethod
+    def _entry_name(bucket: str, key: str, etag: str) -> str:
+        digest = hashlib.sha256(f'{bucket}/{key}/{etag}'.encode()).hexdigest()
+        # Keep suffixes so readers can still detect the file type
+        return digest + ''.join(P.PurePosixPath(key).suffixes)
+
+    def _evict(self, keep: Optional[str]=None) -> None:
+        """Evict least recently used files beyond the size cap, other than keep and those pinned"""
+        for name, size in list(self._entries.items()):
+            if self._size <= self._max_bytes:
+                break
+            if name == keep or name in self._pins:
+                continue
+            del self._entries[name]
+            self._size -= size
+            self.evictions += 1
+            log.debug(f'Evicting {name} from cache')
+            (self._path / name).unlink(missing_ok=True)
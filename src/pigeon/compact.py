@@ -0,0 +1,118 @@
+"""
+Compact physical schema for stores which opt into it.
+
+Columns with a fixed set of values become ENUMs, integers and measurements are
+narrowed to the widths their values need, and the run columns repeated on every read
+of sequencing_summary are replaced by a key into a ``runs`` dimension table.  A view
+with the table's usual name joins the runs back, so queries are unchanged.
+
+Other text columns, such as read ids, refs and filenames, are left as VARCHAR.  duckdb
+already dictionary compresses repetitive strings when it stores them.  So are
+end_reason, as new versions of MinKNOW add end reasons which an ENUM would reject, and
+the basecalling model of cramstats, which may name a version, e.g. sup@v5.
+
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+def enum(values: Sequence[str]) -> str:
+    return 'ENUM(' + ', '.join(f"'{x}'" for x in values) + ')'
+
+
+# Dimension table of the runs of reads.  run_key is assigned by the store.
+RUNS_SCHEMA = [
+    ('run_key', 'UINTEGER', 'YES', None, None, None),
+    ('run_id', 'VARCHAR', 'YES', None, None, None),
+    ('experiment_id', 'VARCHAR', 'YES', None, None, None),
+    ('sample_id', 'VARCHAR', 'YES', None, None, None)
+]
+RUN_COLUMNS = [x[0] for x in RUNS_SCHEMA if x[0] != 'run_key']
+
+# Columns which were ENUMs in stores compacted by earlier versions, by table
+WIDENED_COLUMNS = {
+    'sequencing_summary': ['end_reason'],
+    'cramstats': ['model'],
+}
+
+# Tables stored as <table_name>_data with run_key in place of RUN_COLUMNS
+RUN_KEYED_TABLES = ['sequencing_summary']
+
+# Types which differ from FC_SCHEMAS and SEQ_SCHEMAS, besides HUGEINT which always
+# becomes BIGINT
+COMPACT_TYPES = {
+    'pore_activity': {
+        'experiment_time': 'INTEGER',
+    },
+    'pore_activity_states': {
+        'experiment_time': 'INTEGER',
+    },
+    'throughput': {
+        'experiment_time': 'INTEGER',
+    },
+    'sequencing_summary': {
+        'channel': 'USMALLINT',
+        'mux': 'UTINYINT',
+        'minknow_events': 'UINTEGER',
+        'duration': 'FLOAT',
+        'num_events_template': 'UINTEGER',
+        'template_duration': 'FLOAT',
+        'sequence_length_template': 'UINTEGER',
+        'mean_qscore_template': 'FLOAT',
+        'strand_score_template': 'FLOAT',
+        'median_template': 'FLOAT',
+        'mad_template': 'FLOAT',
+    },
+    'cramstats': {
+        'coverage': 'FLOAT',
+        'ref_coverage': 'FLOAT',
+        'qstart': 'UINTEGER',
+        'qend': 'UINTEGER',
+        'rstart': 'UINTEGER',
+        'rend': 'UINTEGER',
+        'aligned_ref_len': 'UINTEGER',
+        'direction': enum(['+', '-']),
+        'length': 'UINTEGER',
+        'read_length': 'UINTEGER',
+        'match': 'UINTEGER',
+        'ins': 'UINTEGER',
+        'del': 'UINTEGER',
+        'sub': 'UINTEGER',
+        'iden': 'FLOAT',
+        'acc': 'FLOAT',
+    },
+}
+
+
+def physical_name(table_name: str) -> str:
+    """Name of the table holding the rows of a table in the compact schema"""
+    return f'{table_name}_data' if table_name in RUN_KEYED_TABLES else table_name
+
+
+def physical_schema(table_name: str, schema: Sequence[Tuple]) -> List[Tuple]:
+    """
+    Return the compact schema of a table's physical table, given its schema.
+
+    """
+    types = COMPACT_TYPES.get(table_name, {})
+    compact = []
+    if table_name in RUN_KEYED_TABLES:
+        compact.append(RUNS_SCHEMA[0])
+    for col in schema:
+        if table_name in RUN_KEYED_TABLES and col[0] in RUN_COLUMNS:
+            continue
+        type_ = types.get(col[0], 'BIGINT' if col[1] == 'HUGEINT' else col[1])
+        compact.append((col[0], type_) + tuple(col[2:]))
+
+    return compact
+
+
+def view_sql(table_name: str, schema: Sequence[Tuple], database: Optional[str]=None) -> str:
+    """
+    Return the query of the view presenting a run keyed table with its usual columns.
+
+    :param database: name of the attached database holding the tables, if not the default
+
+    """
+    prefix = f'{database}.' if database else ''
+    columns = ', '.join(f'r.{col[0]}' if col[0] in RUN_COLUMNS else f'd.{col[0]}' for col in schema)
+    return f'select {columns} from {prefix}{physical_name(table_name)} d join {prefix}runs r using (run_key)'
@@ -0,0 +1,183 @@
+"""
+Compressed table files.
+
+Table files may be compressed with gzip, bgzip or zstd, recognised by their suffix,
+which is otherwise ignored when naming tables.  duckdb decompresses all three as it
+parses them, on one thread per file.
+
+bgzip files are a series of independently deflated blocks of at most 64KB, so they can
+also be decompressed in parallel.  `DiskCache` does so when caching remote files, so
+only the compressed bytes cross the network, and `InflatedFiles` does so for local files.
+
+"""
+
+import concurrent.futures
+import os
+import pathlib as P
+import struct
+import tempfile
+import threading
+import zlib
+from typing import BinaryIO, Iterator, List, Optional
+import logging
+
+log = logging.getLogger(__name__)
+
+# duckdb's name for the compression of each suffix.  bgzip is readable as gzip.
+COMPRESSION_SUFFIXES = {
+    '.gz': 'gzip',
+    '.bgz': 'gzip',
+    '.zst': 'zstd',
+}
+
+# gzip magic, deflate and the FEXTRA flag which bgzip always sets
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+
+# Blocks decompressed per worker at a time
+BGZF_BLOCKS_PER_TASK = 64
+
+
+class CompressionError(ValueError):
+    pass
+
+
+def compression_suffix(path: str) -> Optional[str]:
+    """Return the compression suffix of a path, e.g. '.gz', or None"""
+    _, ext = os.path.splitext(path)
+    return ext if ext in COMPRESSION_SUFFIXES else None
+
+
+def compression_of(path: str) -> Optional[str]:
+    """Return duckdb's name for the compression of a file, from its suffix, or None"""
+    suffix = compression_suffix(path)
+    return COMPRESSION_SUFFIXES[suffix] if suffix else None
+
+
+def strip_compression(path: str) -> str:
+    """Return a path without its compression suffix"""
+    suffix = compression_suffix(path)
+    return path[:-len(suffix)] if suffix else path
+
+
+def is_bgzf(path: str) -> bool:
+    """Whether a file is bgzip compressed, judged by its first block header"""
+    with open(path, 'rb') as f:
+        header = f.read(18)
+
+    return len(header) == 18 and header[:4] == BGZF_MAGIC and header[12:16] == b'BC\x02\x00'
+
+
+def iter_bgzf_blocks(f: BinaryIO) -> Iterator[bytes]:
+    """Yield each block of a bgzip file"""
+    while header := f.read(12):
+        if len(header) < 12 or header[:4] != BGZF_MAGIC:
+            raise CompressionError(f'Invalid bgzip block header at offset {f.tell() - len(header)}')
+        extra = f.read(struct.unpack('<H', header[10:12])[0])
+        bsize = _bgzf_block_size(extra)
+        rest = f.read(bsize + 1 - 12 - len(extra))
+        if len(rest) != bsize + 1 - 12 - len(extra):
+            raise CompressionError('Truncated bgzip block')
+        yield header + extra + rest
+
+
+def decompress_bgzf(src: str, dst: str, workers: Optional[int]=None) -> int:
+    """
+    Decompress a bgzip file, decompressing blocks on a pool of threads.
+
+    zlib releases the GIL, so this scales with the number of cores.
+
+    :param workers: number of threads, by default the number of CPUs
+    :return: size of the decompressed file
+
+    """
+    workers = workers or os.cpu_count() or 1
+    size = 0
+
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout, \
+            concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='pigeon-bgzf') as pool:
+        blocks = iter_bgzf_blocks(fin)
+        pending = []
+        while True:
+            # Keep a couple of tasks per worker in flight and write them in order
+            while len(pending) < 2 * workers:
+                task = [block for (_, block) in zip(range(BGZF_BLOCKS_PER_TASK), blocks)]
+                if not task:
+                    break
+                pending.append(pool.submit(_inflate_blocks, task))
+            if not pending:
+                break
+            data = pending.pop(0).result()
+            fout.write(data)
+            size += len(data)
+
+    return size
+
+
+class InflatedFiles:
+    """
+    Decompressed copies of local bgzip files, inflated in parallel so duckdb can read
+    them with its parallel CSV reader.  Copies are deleted when released.
+
+    """
+    def __init__(self, workers: int, tmp_dir: Optional[str]=None):
+        """
+        :param workers: number of threads inflating the blocks of a file
+        :param tmp_dir: directory of the copies, by default the system's temporary directory
+
+        """
+        self._workers = workers
+        self._tmp_dir = tmp_dir
+        self._lock = threading.Lock()
+        self._paths: List[str] = []
+
+    def path(self, path: str) -> str:
+        """
+        Return the path duckdb should read a file from: a decompressed copy of a bgzip
+        file, otherwise the file itself.
+
+        """
+        if compression_of(path) != 'gzip' or not is_bgzf(path):
+            return path
+
+        # Keep the suffix of the contents, which is that of the table file
+        fd, copy = tempfile.mkstemp(suffix=P.Path(strip_compression(path)).suffix, prefix='pigeon-', dir=self._tmp_dir)
+        os.close(fd)
+        with self._lock:
+            self._paths.append(copy)
+
+        log.info(f'Decompressing {path}')
+        decompress_bgzf(path, copy, self._workers)
+        return copy
+
+    def release(self) -> None:
+        """Delete the copies returned so far"""
+        with self._lock:
+            paths, self._paths = self._paths, []
+        for path in paths:
+            P.Path(path).unlink(missing_ok=True)
+
+
+def _bgzf_block_size(extra: bytes) -> int:
+    """Return BSIZE, the total block size minus one, from the extra field of a block"""
+    offset = 0
+    while offset + 4 <= len(extra):
+        si1, si2, slen = struct.unpack('<BBH', extra[offset:offset + 4])
+        if (si1, si2, slen) == (66, 67, 2):
+            return struct.unpack('<H', extra[offset + 4:offset + 6])[0]
+        offset += 4 + slen
+
+    raise CompressionError('bgzip block has no BC subfield')
+
+
+def _inflate_blocks(blocks) -> bytes:
+    return b''.join(_inflate_block(block) for block in blocks)
+
+
+def _inflate_block(block: bytes) -> bytes:
+    header_size = 12 + struct.unpack('<H', block[10:12])[0]
+    crc, isize = struct.unpack('<II', block[-8:])
+    data = zlib.decompress(block[header_size:-8], wbits=-15)
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise CompressionError('bgzip block failed its CRC check')
+
+    return data
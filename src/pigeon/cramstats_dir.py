@@ -1,12 +1,24 @@
 from abc import ABC, abstractmethod
-from typing import Optional
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, List, Optional, Tuple
 from urllib.parse import urlparse
+import logging
+import multiprocessing
+import os
 import pathlib as P
 
 import duckdb
-import boto3
+import pyarrow as pa
+import pysam
 
-from . import split_bucket
+from . import SourceInfo, local_source_info, split_bucket
+from .cache import DiskCache
+from .compression import InflatedFiles
+from .listing import S3Listing
+from .s3_config import S3Config
+from .schema import TAB, header_columns, read_csv_sql, schema_columns
+
+log = logging.getLogger(__name__)
 
 SEQ_SCHEMAS = {
     'cramstats': [
@@ -50,22 +62,267 @@ class CramStatsDir(ABC):
         """
         raise NotImplementedError
 
+    def get_source_info(self) -> Optional[SourceInfo]:
+        """
+        Return the identity of the file the stats are read from, or None if unknown.
+
+        """
+        return None
+
+    def release(self) -> None:
+        """
+        Release the files held for the relations returned so far, once they have
+        been read.
+
+        """
+        pass
+
+    # --------
+
+    @staticmethod
+    def _make_relation(csv_path: str, connection: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+        """
+        Return a relation reading a cram.stats file with column types pinned to SEQ_SCHEMAS.
+
+        """
+        columns = header_columns(connection, csv_path, TAB, schema_columns(SEQ_SCHEMAS['cramstats'], ['model']))
+        return connection.sql(f"select * from {read_csv_sql(csv_path, columns, TAB, True)}")
+
+    @staticmethod
+    def _model_from_name(name: str) -> str:
+        """Deduce the model from a filename such as hac_PAO83395.cram.stats"""
+        model = name.split('_')[0]
+        assert model in ['fast', 'hac', 'sup']
+
+        return model
+
 
 class RemoteCramStatsDir(CramStatsDir):
-    def __init__(self, url: str, s3_client: Optional['botocore.client.S3']=None):
+    def __init__(self, url: str, s3_client: Optional['botocore.client.S3']=None,
+                 listing: Optional[S3Listing]=None, cache: Optional[DiskCache]=None,
+                 s3_config: Optional[S3Config]=None):
+        """
+        :param url: s3 URL of the cram.stats file
+        :param s3_client: client to use for S3 requests
+        :param listing: listing cache used to look up the object's ETag
+        :param cache: if given, the stats file is read through this local disk cache
+        :param s3_config: configuration of the client used if s3_client isn't given.
+            duckdb reads s3:// paths with the configuration of the store.
+
+        """
         if not s3_client:
-            s3_client = boto3.client('s3')
+            s3_client = (s3_config or S3Config()).client()
         self._s3 = s3_client
+        self._listing = listing or S3Listing(s3_client)
+        self._cache = cache
+        # Cached files pinned for relations not yet released
+        self._pinned: List[str] = []
 
         self._bucket, self._prefix = split_bucket(url)
 
+    def __repr__(self):
+        return f"{type(self).__name__}('s3://{self._bucket}/{self._prefix}')"
+
     def get_model(self) -> str:
-        model = self._prefix.name.split('_')[0]
-        assert model in ['fast', 'hac', 'sup']
+        return self._model_from_name(self._prefix.name)
 
-        return model
+    def get_source_info(self) -> Optional[SourceInfo]:
+        key = self._prefix.as_posix()
+        info = self._listing.head(self._bucket, key)
+        if info is None:
+            return None
+
+        return SourceInfo(f's3://{self._bucket}/{key}', info.etag, info.size)
 
     def make_table_relation(self, connection: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
-        csv_path = f's3://{self._bucket}/{self._prefix}'
+        return self._make_relation(self._table_path(), connection)
+
+    def release(self) -> None:
+        for path in self._pinned:
+            self._cache.release(path)
+        self._pinned = []
+
+    # --------
+
+    def _table_path(self) -> str:
+        """Return the path duckdb should read the stats from"""
+        key = self._prefix.as_posix()
+        if self._cache is None:
+            return f's3://{self._bucket}/{key}'
+
+        info = self._listing.head(self._bucket, key)
+        if info is None:
+            raise FileNotFoundError(f's3://{self._bucket}/{key}')
+        path = self._cache.get(self._s3, self._bucket, key, info.etag, pin=True)
+        self._pinned.append(path)
+        return path
+
+
+class LocalCramStatsDir(CramStatsDir):
+    """
+    A cram.stats file on a local or network filesystem, read in place.
+    """
+    def __init__(self, path: str, decompress_workers: int=0, tmp_dir: Optional[str]=None):
+        """
+        :param path: path of the cram.stats file
+        :param decompress_workers: if non-zero, a bgzip file is decompressed to a
+            temporary copy on this many threads before it is read
+        :param tmp_dir: directory of the decompressed copy
+
+        """
+        self._path = P.Path(path).absolute()
+        self._inflated = InflatedFiles(decompress_workers, tmp_dir) if decompress_workers else None
+
+    def __repr__(self):
+        return f"{type(self).__name__}('{self._path}')"
+
+    def get_model(self) -> str:
+        return self._model_from_name(self._path.name)
+
+    def get_source_info(self) -> Optional[SourceInfo]:
+        return local_source_info(str(self._path))
+
+    def make_table_relation(self, connection: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+        path = str(self._path)
+        if self._inflated is not None:
+            path = self._inflated.path(path)
+
+        return self._make_relation(path, connection)
+
+    def release(self) -> None:
+        if self._inflated is not None:
+            self._inflated.release()
+
+
+class AlignmentCramStatsDir(CramStatsDir):
+    """
+    Computes the cramstats of an indexed CRAM or BAM file, as pomoxis' stats_from_bam would.
+
+    Regions of the reference are processed in a pool of worker processes and the
+    stats streamed to duckdb as arrow record batches, one per region.
+    """
+    def __init__(self, path: str, model: Optional[str]=None, reference_filename: Optional[str]=None,
+                 processes: Optional[int]=None, region_size: int=10_000_000, all_alignments: bool=False):
+        """
+        :param path: path of a CRAM or BAM file with an index
+        :param model: basecalling model.  Defaults to the prefix of the filename, e.g. hac_PAO83395.cram
+        :param reference_filename: reference FASTA for decoding CRAM, if not found through the header
+        :param processes: number of worker processes.  Defaults to the number of CPUs.
+        :param region_size: maximum length of reference processed by one task
+        :param all_alignments: include secondary and supplementary alignments
+
+        """
+        self._path = P.Path(path).absolute()
+        self._model = model
+        self._reference_filename = reference_filename
+        self._processes = processes or os.cpu_count()
+        self._region_size = region_size
+        self._all_alignments = all_alignments
+
+    def __repr__(self):
+        return f"{type(self).__name__}('{self._path}')"
+
+    def get_model(self) -> str:
+        return self._model or self._model_from_name(self._path.name)
+
+    def get_source_info(self) -> Optional[SourceInfo]:
+        return local_source_info(str(self._path))
+
+    def make_table_relation(self, connection: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+        reader = pa.RecordBatchReader.from_batches(ALIGNMENT_STATS_SCHEMA, self.iter_batches())
+        return connection.from_arrow(reader)
+
+    def iter_batches(self) -> Iterator[pa.RecordBatch]:
+        """
+        Yield a record batch of stats per region as workers complete them.  At most two
+        regions per worker are in flight at once.
+
+        """
+        regions = self._regions()
+        args = (str(self._path), self._reference_filename, self._all_alignments)
+        if self._processes <= 1:
+            for region in regions:
+                yield _region_stats(*args, *region)
+            return
+
+        # Worker processes shouldn't inherit the threads of duckdb or the caller
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(self._processes, mp_context=context) as executor:
+            regions = iter(regions)
+            pending = set()
+            while True:
+                while len(pending) < 2 * self._processes and (region := next(regions, None)):
+                    pending.add(executor.submit(_region_stats, *args, *region))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    # --------
+
+    def _regions(self) -> List[Tuple[str, int, int]]:
+        """Split the reference sequences into (contig, start, end) regions of at most region_size"""
+        with pysam.AlignmentFile(str(self._path), reference_filename=self._reference_filename) as bam:
+            lengths = list(zip(bam.references, bam.lengths))
+
+        return [(contig, start, min(start + self._region_size, length))
+                for (contig, length) in lengths
+                for start in range(0, length, self._region_size)]
+
+
+ALIGNMENT_STATS_SCHEMA = pa.schema([
+    (name, {'VARCHAR': pa.string(), 'DOUBLE': pa.float64(), 'BIGINT': pa.int64()}[type_])
+    for (name, type_) in schema_columns(SEQ_SCHEMAS['cramstats'], ['model']).items()
+])
+
+
+def _region_stats(path: str, reference_filename: Optional[str], all_alignments: bool,
+                  contig: str, start: int, end: int) -> pa.RecordBatch:
+    """
+    Return the stats of alignments starting in a region.  Runs in a worker process.
+
+    Alignments overlapping the start of the region are left to the region they start in.
+    Those without an NM tag, from which substitutions are counted, are skipped.
+
+    """
+    rows = {name: [] for name in ALIGNMENT_STATS_SCHEMA.names}
+    skipped = 0
+    with pysam.AlignmentFile(path, reference_filename=reference_filename) as bam:
+        ref_length = bam.get_reference_length(contig)
+        for rec in bam.fetch(contig, start, end):
+            if rec.reference_start < start or rec.is_unmapped:
+                continue
+            if not all_alignments and (rec.is_secondary or rec.is_supplementary):
+                continue
+            if not rec.has_tag('NM'):
+                skipped += 1
+                continue
+
+            cigar_stats = rec.get_cigar_stats()[0]
+            ins = int(cigar_stats[1])
+            dele = int(cigar_stats[2])
+            sub = rec.get_tag('NM') - ins - dele
+            length = rec.query_alignment_length
+            read_length = rec.infer_read_length()
+            match = length - ins - sub
+
+            row = {
+                'name': rec.query_name, 'ref': contig,
+                'coverage': 100 * length / read_length,
+                'ref_coverage': 100 * rec.reference_length / ref_length,
+                'qstart': rec.query_alignment_start, 'qend': rec.query_alignment_end,
+                'rstart': rec.reference_start, 'rend': rec.reference_end,
+                'aligned_ref_len': rec.reference_length, 'direction': '-' if rec.is_reverse else '+',
+                'length': length, 'read_length': read_length,
+                'match': match, 'ins': ins, 'del': dele, 'sub': sub,
+                'iden': round(100 * match / (match + sub), 2),
+                'acc': round(100 * match / (match + sub + ins + dele), 2),
+            }
+            for name, value in row.items():
+                rows[name].append(value)
+
+    if skipped:
+        log.warning(f'Skipped {skipped} alignments without an NM tag in {path} {contig}:{start}-{end}')
 
-        return connection.read_csv(csv_path)
+    return pa.RecordBatch.from_pydict(rows, schema=ALIGNMENT_STATS_SCHEMA)
@@ -0,0 +1,227 @@
+"""
+Querying many stores as one.
+
+A single store can only be written by one process, so to spread ingest over several
+machines each loads its own shard, e.g. the runs of one experiment, into a store of
+its own and publishes snapshots of it with `Store.publish`.  A `FederatedStore`
+attaches the snapshots read-only and presents each table as a view of the union of
+its rows in every shard, so the query methods of Store work unchanged.  Adding a
+shard never rewrites the others.
+
+Each shard's part of a view is filtered on the runs, experiments, basecalling models
+and alignment files the shard holds, so duckdb skips the shards of others entirely
+when a query filters on run_id, experiment_id, model or source.  Views of a shard name
+the tables they read without the shard's name, so the union reads the tables under
+them, e.g. the sequencing_summary_data and runs of a shard with the compact schema,
+and views such as pore_activity are created again over the union.  The groups of
+rollups found in several shards, e.g. alignment totals by reference, are merged.
+Samples are unioned, each shard's rows keeping the sample fraction of its stratum.
+
+Alignments are matched to runs through the read index of their own shard, so
+cram.stats files should be loaded into the shard of the runs they align.
+
+"""
+
+from typing import Dict, Iterable, List, Optional
+import logging
+
+from .compact import RUN_KEYED_TABLES, physical_name, view_sql
+from .flowcell_dir import FC_SCHEMAS
+from .cramstats_dir import SEQ_SCHEMAS
+from .pore_activity import STATES_TABLE, wide_view_sql
+from .rollups import ROLLUPS
+from .s3_config import S3Config
+from .samples import DEFAULT_SAMPLE_SIZE, SAMPLES
+from .store import RUN_ID_COLUMNS, ResourceProfile, Store
+
+log = logging.getLogger(__name__)
+
+# Views created over the union of the table they read, as (table, query) by name
+DERIVED_VIEWS = {'pore_activity': (STATES_TABLE, wide_view_sql())}
+
+# Tables presented as the union of the shards
+FEDERATED_TABLES = ([x for x in FC_SCHEMAS if x not in DERIVED_VIEWS] + [STATES_TABLE] + list(SEQ_SCHEMAS)
+                    + ['read_index', 'alignment_index', 'load_manifest', 'ingest_metrics']
+                    + list(ROLLUPS) + list(SAMPLES))
+
+# Column identifying the run of each row, in tables where it is never null
+RUN_COLUMNS = dict(RUN_ID_COLUMNS)
+RUN_COLUMNS.update({STATES_TABLE: 'run_id', 'read_index': 'run_id'})
+RUN_COLUMNS.update({name: 'run_id' for (name, rollup) in ROLLUPS.items() if rollup.source in RUN_ID_COLUMNS})
+RUN_COLUMNS.update({name: sample.stratum for (name, sample) in SAMPLES.items() if sample.source in RUN_ID_COLUMNS})
+
+# Column identifying the experiment of each row, which may be null.  Rows are assumed
+# to belong to the experiment of their run.
+EXPERIMENT_COLUMNS = {'final_summary': 'protocol_group_id'}
+EXPERIMENT_COLUMNS.update({table_name: 'experiment_id' for (table_name, schema) in FC_SCHEMAS.items()
+                           if 'experiment_id' in (col[0] for col in schema)})
+EXPERIMENT_COLUMNS.update({STATES_TABLE: 'experiment_id', 'sample_sequencing_summary': 'experiment_id'})
+
+# Column of the basecalling model of each row of alignment stats
+MODEL_COLUMNS = {'cramstats': 'model'}
+MODEL_COLUMNS.update({name: 'model' for (name, rollup) in ROLLUPS.items() if 'model' in rollup.keys})
+MODEL_COLUMNS.update({name: 'model' for (name, sample) in SAMPLES.items() if sample.source == 'cramstats'})
+
+# Columns on which each shard's part of a view is filtered, by the kind of key
+SHARD_KEY_COLUMNS = {
+    'run': RUN_COLUMNS,
+    'experiment': EXPERIMENT_COLUMNS,
+    'model': MODEL_COLUMNS,
+    'alignments': {'alignment_index': 'source'},
+}
+
+
+class FederatedStore(Store):
+    """
+    A read-only store querying the union of many shards, each a store written independently.
+
+    """
+
+    def __init__(self, shards: Iterable[str], resources: Optional[ResourceProfile]=None,
+                 s3_config: Optional[S3Config]=None):
+        """
+        :param shards: paths of the databases of the shards, typically snapshots
+            written by Store.publish
+        :param resources: limits on the memory, threads and spill directory of duckdb
+        :param s3_config: configuration with which duckdb reads s3:// paths
+
+        """
+        self._connect(':memory:', False, resources, s3_config)
+        self.lake_path = None
+        self.compact_schema = False
+        self.sample_size = DEFAULT_SAMPLE_SIZE
+
+        #: Path of each shard by the name it is attached as
+        self.shards: Dict[str, str] = {}
+        for path in shards:
+            self._attach(path)
+        self._create_views()
+
+    def add_shard(self, path: str) -> None:
+        """Add a shard, e.g. of a new experiment"""
+        self._attach(path)
+        self._create_views()
+
+    def refresh(self) -> None:
+        """
+        Reattach the shards so that snapshots published since they were attached are
+        read.  Queries already running keep reading the previous snapshots.
+
+        """
+        paths = list(self.shards.values())
+        for name in list(self.shards):
+            self._conn.execute(f'detach {name}')
+        self.shards = {}
+        for path in paths:
+            self._attach(path)
+        self._create_views()
+
+    def _read_only(self, *args, **kwargs):
+        raise ValueError('A FederatedStore is read-only, load into one of its shards instead')
+
+    insert_flowcell = insert_flowcells = insert_cramstats = tail_flowcell = watch_flowcell = _read_only
+    index_alignments = compact = rebuild_rollups = rebuild_samples = publish = _read_only
+
+    # --------
+
+    def _attach(self, path: str) -> None:
+        name = f'shard_{len(self.shards)}'
+        while name in self.shards:
+            name += '_'
+        self._conn.execute(f"attach {_sql_literal(path)} as {name} (read_only)")
+        self.shards[name] = path
+        log.info(f'Attached shard {path} as {name}')
+
+    def _create_views(self) -> None:
+        tables = {name: self._shard_tables(name) for name in self.shards}
+        keys = {name: self._shard_keys(name, tables[name]) for name in self.shards}
+        for table_name in FEDERATED_TABLES:
+            parts = [self._shard_select(name, table_name, keys[name], tables[name]) for name in self.shards
+                     if table_name in tables[name]]
+            if not parts:
+                self._conn.execute(f'drop view if exists {table_name}')
+                continue
+            select = '\nunion all by name\n'.join(parts)
+            if table_name in ROLLUPS:
+                select = _merge_rollup(table_name, select)
+            self._conn.execute(f'create or replace view {table_name} as {select}')
+
+        for view_name, (table_name, select) in DERIVED_VIEWS.items():
+            if any(table_name in x for x in tables.values()):
+                self._conn.execute(f'create or replace view {view_name} as {select}')
+            else:
+                self._conn.execute(f'drop view if exists {view_name}')
+
+    def _shard_tables(self, name: str) -> List[str]:
+        """Return the tables and views of a shard"""
+        return [x[0] for x in self._conn.execute("""
+            select table_name from duckdb_tables() where database_name = ?
+            union
+            select view_name from duckdb_views() where database_name = ? and not internal
+            """, [name, name]).fetchall()]
+
+    def _shard_keys(self, name: str, tables: List[str]) -> Dict[str, Optional[List[str]]]:
+        """
+        Return the runs, experiments, models and alignment files of which a shard holds
+        rows, by the kinds of SHARD_KEY_COLUMNS.  Kinds which can't be found cheaply are None.
+
+        """
+        runs = [f'select acquisition_run_id from {name}.final_summary',
+                f'select run_id from {name}.load_manifest where run_id is not null']
+        experiments = [f'select protocol_group_id from {name}.final_summary']
+        if 'tail_offsets' in tables:
+            # Runs still being tailed have no final_summary
+            runs.append(f'select run_id from {name}.tail_offsets')
+            experiments.append(f'select experiment_id from {name}.tail_offsets')
+        selects = {
+            'run': runs,
+            'experiment': experiments,
+            'alignments': [f"select source from {name}.load_manifest where table_name = 'alignment_index'"],
+        }
+        # Every model with alignments has rows in their sample
+        if 'sample_cramstats' in tables:
+            selects['model'] = [f'select model::VARCHAR from {name}.sample_cramstats']
+
+        keys = {kind: None for kind in SHARD_KEY_COLUMNS}
+        for kind, parts in selects.items():
+            rows = self._conn.execute(' union '.join(parts)).fetchall()
+            keys[kind] = sorted({x[0] for x in rows if x[0] is not None})
+        return keys
+
+    def _shard_select(self, name: str, table_name: str, keys: Dict[str, Optional[List[str]]],
+                      tables: List[str]) -> str:
+        # Constant filters let duckdb skip the shard when a query filters on other values
+        conditions = []
+        for kind, columns in SHARD_KEY_COLUMNS.items():
+            if table_name not in columns or keys[kind] is None:
+                continue
+            column = columns[table_name]
+            if not keys[kind]:
+                condition = 'false'
+            else:
+                condition = f"{column} in ({', '.join(_sql_literal(x) for x in keys[kind])})"
+            if kind == 'experiment':
+                condition = f'({condition} or {column} is null)'
+            conditions.append(condition)
+
+        if table_name in RUN_KEYED_TABLES and physical_name(table_name) in tables:
+            # A shard with the compact schema
+            select = f'select * from ({view_sql(table_name, FC_SCHEMAS[table_name], name)})'
+        else:
+            select = f'select * from {name}.{table_name}'
+        if conditions:
+            select += ' where ' + ' and '.join(conditions)
+        return select
+
+
+def _merge_rollup(table_name: str, select: str) -> str:
+    """Merge the groups of a rollup found in several shards"""
+    rollup = ROLLUPS[table_name]
+    keys = ', '.join(rollup.keys)
+    merged = ', '.join(f'{rollup.merge.get(v, "sum")}({v})::{t} as {v}'
+                       for (v, t) in ((col[0], col[1]) for col in rollup.schema if col[0] not in rollup.keys))
+    return f'select {keys}, {merged} from ({select}) group by {keys}'
+
+
+def _sql_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
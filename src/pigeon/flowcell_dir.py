@@ -1,14 +1,20 @@
+import functools
+import os
 import pathlib as P
 import re
 from abc import ABC, abstractmethod
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from urllib.parse import urlparse
 import logging
 
-import boto3
 import duckdb
 
-from . import split_bucket
+from . import SourceInfo, local_source_info, split_bucket
+from .cache import DiskCache
+from .compression import InflatedFiles, strip_compression
+from .listing import S3Listing
+from .s3_config import S3Config
+from .schema import TAB, header_columns, read_csv_sql, schema_columns
 
 log = logging.getLogger(__name__)
 
@@ -99,6 +105,12 @@ FC_SCHEMAS = {
         ]
     }
 
+# Channel states pivoted into columns of pore_activity
+CHANNEL_STATES = [x[0] for x in FC_SCHEMAS['pore_activity'] if x[0] not in ['experiment_id', 'run_id', 'experiment_time']]
+
+# Columns of pore_activity files, a row per minute and channel state
+PORE_ACTIVITY_COLUMNS = {'channel_state': 'VARCHAR', 'experiment_time': 'BIGINT', 'state_time': 'BIGINT'}
+
 class FlowcellDirError(Exception):
     pass
 
@@ -123,65 +135,75 @@ class FlowcellDir(ABC):
         """
         raise NotImplementedError
 
+    def get_source_info(self, table_name: str) -> Optional[SourceInfo]:
+        """
+        Return the identity of the file a table is read from, or None if unknown.
 
-class RemoteFlowcellDir(FlowcellDir):
-    def __init__(self, url: str, s3_client: Optional['botocore.client.S3']=None):
-        if not s3_client:
-            s3_client = boto3.client('s3')
-        self._s3 = s3_client
+        """
+        return None
 
-        self._bucket, self._prefix = split_bucket(url)
+    def read_range(self, table_name: str, start: int, end: int) -> bytes:
+        """
+        Return bytes [start, end) of the file of a table, e.g. those appended to it
+        since it was last read.
 
-    def get_available_tables(self) -> Dict[str, P.Path]:
-        tables = {}
+        """
+        raise NotImplementedError
 
-        resp = self._s3.list_objects(
-            Bucket=self._bucket, Prefix=self._prefix.as_posix()+'/', Delimiter='/'
-        )
-        if 'Contents' in resp:
-            for path in (x['Key'] for x in resp['Contents']):
-                if table_name := self._table_name_from_path(path):
-                    tables[table_name] = P.Path(path).relative_to(self._prefix)
+    def refresh(self) -> None:
+        """
+        Forget anything cached about the files of the directory, so that files still
+        being written are seen at their current size.
 
-        return tables
+        """
+        pass
 
-    def make_table_relation(self, table_name: str, connection: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
-        tables = self.get_available_tables()
-        if table_name not in tables:
-            raise TableNotPresent(f"Table {table_name} not present for this flowcell")
+    def release(self) -> None:
+        """
+        Release the files held for the relations returned so far, once they have
+        been read.
+
+        """
+        pass
+
+    # --------
+
+    @staticmethod
+    def _make_relation(table_name: str, csv_path: str, connection: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+        """
+        Return a relation reading a table file in the layout MinKNOW writes it.
 
-        csv_path = f's3://{self._bucket}/{self._prefix}/{tables[table_name]}'
+        Column types and dialect are pinned to FC_SCHEMAS so files are parsed in a
+        single pass without sniffing.  Files which don't match raise SchemaMismatch,
+        either here or when the relation is executed.
 
+        pore_activity is returned as written, a row per minute and channel state, and
+        is pivoted by the store's pore_activity view.
+
+        """
         match table_name:
             case 'final_summary':
-                rel = connection.sql(f"pivot read_csv('{csv_path}', header=false, delim='=', names=['key', 'value']) on key using any_value(value)")
+                source = read_csv_sql(csv_path, {'key': 'VARCHAR', 'value': 'VARCHAR'}, '=', False, quote="''")
+                keys = ', '.join(f"'{x}'" for x in schema_columns(FC_SCHEMAS['final_summary']))
+                rel = connection.sql(f"pivot {source} on key in ({keys}) using any_value(value)")
             case 'pore_activity':
-                rel = connection.sql(f"""
-                    pivot read_csv('{csv_path}', 
-                                names=['channel_state', 'experiment_time', 'state_time']
-                            )
-                    on channel_state
-                    using sum(state_time)
-                    group by experiment_time
-                    order by experiment_time
-                """)
+                rel = connection.sql(f"select * from {read_csv_sql(csv_path, PORE_ACTIVITY_COLUMNS, ',', True)}")
             case 'throughput':
-                rel = connection.read_csv(csv_path,
-                        names=['experiment_time', 'reads', 'basecalled_reads_passed', 'basecalled_reads_failed', 'basecalled_reads_skipped', 'selected_raw_samples',
-                        'selected_events', 'estimated_bases', 'basecalled_bases',  'basecalled_samples']
-                )
+                columns = schema_columns(FC_SCHEMAS['throughput'], ['experiment_id', 'run_id'])
+                rel = connection.sql(f"select * from {read_csv_sql(csv_path, columns, ',', True)}")
             case 'sequencing_summary':
-                rel = connection.read_csv(csv_path)
+                columns = header_columns(connection, csv_path, TAB, schema_columns(FC_SCHEMAS['sequencing_summary']))
+                rel = connection.sql(f"select * from {read_csv_sql(csv_path, columns, TAB, True)}")
             case _:
                 raise ValueError(f'unhandled table name {table_name}')
 
         return rel
 
-    # --------
-
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def _table_name_from_path(path: str) -> Optional[str]:
-        p = P.Path(path)
+        # Compressed files are named as their contents with a compression suffix
+        p = P.Path(strip_compression(path))
         if p.suffix not in ['.tsv', '.txt', '.csv']:
             return None
 
@@ -195,3 +217,153 @@ class RemoteFlowcellDir(FlowcellDir):
             # TODO : GIAB dataset contains extra tables: "full_ss_every_17.txt"
             log.warning(f'Potential table file not recognised {p}')
             return None
+
+
+class RemoteFlowcellDir(FlowcellDir):
+    def __init__(self, url: str, s3_client: Optional['botocore.client.S3']=None,
+                 listing: Optional[S3Listing]=None, cache: Optional[DiskCache]=None,
+                 s3_config: Optional[S3Config]=None):
+        """
+        :param url: s3 URL of the flowcell directory
+        :param s3_client: client to use for S3 requests
+        :param listing: listing cache to use.  Share one between flowcells to avoid
+            repeated listing of the same prefixes.
+        :param cache: if given, table files are read through this local disk cache
+        :param s3_config: configuration of the client used if s3_client isn't given.
+            duckdb reads s3:// paths with the configuration of the store.
+
+        """
+        if not s3_client:
+            s3_client = (s3_config or S3Config()).client()
+        self._s3 = s3_client
+        self._listing = listing or S3Listing(s3_client)
+        self._cache = cache
+        # Cached files pinned for relations not yet released
+        self._pinned: List[str] = []
+
+        self._bucket, self._prefix = split_bucket(url)
+
+    def __repr__(self):
+        return f"{type(self).__name__}('s3://{self._bucket}/{self._prefix}')"
+
+    def get_available_tables(self) -> Dict[str, P.Path]:
+        tables = {}
+
+        listing = self._listing.list(self._bucket, self._prefix.as_posix()+'/')
+        for path in (x.key for x in listing.objects):
+            if table_name := self._table_name_from_path(path):
+                tables[table_name] = P.Path(path).relative_to(self._prefix)
+
+        return tables
+
+    def get_source_info(self, table_name: str) -> Optional[SourceInfo]:
+        tables = self.get_available_tables()
+        if table_name not in tables:
+            return None
+
+        key = (self._prefix / tables[table_name]).as_posix()
+        info = self._listing.head(self._bucket, key)
+        return SourceInfo(f's3://{self._bucket}/{key}', info.etag, info.size)
+
+    def make_table_relation(self, table_name: str, connection: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+        return self._make_relation(table_name, self._table_path(table_name), connection)
+
+    def read_range(self, table_name: str, start: int, end: int) -> bytes:
+        tables = self.get_available_tables()
+        if table_name not in tables:
+            raise TableNotPresent(f"Table {table_name} not present for this flowcell")
+        if end <= start:
+            return b''
+
+        # Read from S3 rather than the cache, as the object may still be growing
+        key = (self._prefix / tables[table_name]).as_posix()
+        response = self._s3.get_object(Bucket=self._bucket, Key=key, Range=f'bytes={start}-{end - 1}')
+        return response['Body'].read()
+
+    def release(self) -> None:
+        for path in self._pinned:
+            self._cache.release(path)
+        self._pinned = []
+
+    def refresh(self) -> None:
+        self._listing.invalidate(self._bucket, self._prefix.as_posix() + '/')
+
+    # --------
+
+    def _table_path(self, table_name: str) -> str:
+        """Return the path duckdb should read a table from"""
+        tables = self.get_available_tables()
+        if table_name not in tables:
+            raise TableNotPresent(f"Table {table_name} not present for this flowcell")
+
+        key = (self._prefix / tables[table_name]).as_posix()
+        if self._cache is None:
+            return f's3://{self._bucket}/{key}'
+
+        info = self._listing.head(self._bucket, key)
+        path = self._cache.get(self._s3, self._bucket, key, info.etag, pin=True)
+        self._pinned.append(path)
+        return path
+
+
+class LocalFlowcellDir(FlowcellDir):
+    """
+    A flowcell directory on a local or network filesystem, e.g. MinKNOW's output volume.
+
+    Files are read in place by duckdb's parallel CSV reader without copying.
+    """
+    def __init__(self, path: str, decompress_workers: int=0, tmp_dir: Optional[str]=None):
+        """
+        :param path: path of the flowcell directory
+        :param decompress_workers: if non-zero, bgzip files are decompressed to a
+            temporary copy on this many threads before they are read, rather than
+            inflated by duckdb on one thread
+        :param tmp_dir: directory of decompressed copies
+
+        """
+        self._path = P.Path(path).absolute()
+        self._inflated = InflatedFiles(decompress_workers, tmp_dir) if decompress_workers else None
+
+    def __repr__(self):
+        return f"{type(self).__name__}('{self._path}')"
+
+    def get_available_tables(self) -> Dict[str, P.Path]:
+        tables = {}
+
+        with os.scandir(self._path) as entries:
+            for entry in sorted(entries, key=lambda x: x.name):
+                if entry.is_file() and (table_name := self._table_name_from_path(entry.path)):
+                    tables[table_name] = P.Path(entry.name)
+
+        return tables
+
+    def get_source_info(self, table_name: str) -> Optional[SourceInfo]:
+        tables = self.get_available_tables()
+        if table_name not in tables:
+            return None
+
+        return local_source_info(str(self._path / tables[table_name]))
+
+    def make_table_relation(self, table_name: str, connection: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+        tables = self.get_available_tables()
+        if table_name not in tables:
+            raise TableNotPresent(f"Table {table_name} not present for this flowcell")
+
+        path = str(self._path / tables[table_name])
+        if self._inflated is not None:
+            path = self._inflated.path(path)
+
+        return self._make_relation(table_name, path, connection)
+
+    def read_range(self, table_name: str, start: int, end: int) -> bytes:
+        tables = self.get_available_tables()
+        if table_name not in tables:
+            raise TableNotPresent(f"Table {table_name} not present for this flowcell")
+
+        with open(self._path / tables[table_name], 'rb') as f:
+            f.seek(start)
+            return f.read(max(end - start, 0))
+
+    def release(self) -> None:
+        if self._inflated is not None:
+            self._inflated.release()
@@ -0,0 +1,139 @@
+"""
+Cached, paginated listings of S3 prefixes.
+
+Listing a prefix is a round-trip to S3 and each response is limited to 1000 keys.
+`S3Listing` pages through complete listings and caches them so that repeated
+lookups, e.g. each table of a flowcell, are served locally.  A recursive listing
+of a parent prefix can serve lookups of any prefix below it.
+
+"""
+
+import datetime
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class ObjectInfo(NamedTuple):
+    key: str
+    etag: str
+    size: int
+    last_modified: Optional[datetime.datetime]
+
+
+class Listing(NamedTuple):
+    objects: List[ObjectInfo]
+    prefixes: List[str]
+
+
+class S3Listing:
+    """
+    Cache of S3 listings shared between flowcell directories.
+
+    """
+
+    def __init__(self, s3_client: 'botocore.client.S3', ttl: Optional[float]=300.0):
+        """
+        :param s3_client: client used for listing
+        :param ttl: seconds before a cached listing is refreshed.  None never expires.
+
+        """
+        self._s3 = s3_client
+        self._ttl = ttl
+        self._cache: Dict[Tuple[str, str, bool], Tuple[float, Listing]] = {}
+        self._lock = threading.Lock()
+
+    def list(self, bucket: str, prefix: str, recursive: bool=False) -> Listing:
+        """
+        List objects and common prefixes under prefix.
+
+        :param recursive: If False list only the immediate children of prefix, as if
+            using a '/' delimiter.
+
+        """
+        cached = self._lookup(bucket, prefix, recursive)
+        if cached is not None:
+            return cached
+
+        listing = self._fetch(bucket, prefix, recursive)
+        with self._lock:
+            self._cache[(bucket, prefix, recursive)] = (time.monotonic(), listing)
+
+        return listing
+
+    def head(self, bucket: str, key: str) -> Optional[ObjectInfo]:
+        """
+        Return information on a single object from the listing of its parent prefix.
+
+        """
+        parent = key.rsplit('/', 1)[0] + '/' if '/' in key else ''
+        for obj in self.list(bucket, parent).objects:
+            if obj.key == key:
+                return obj
+
+        return None
+
+    def invalidate(self, bucket: Optional[str]=None, prefix: str='') -> None:
+        """
+        Drop cached listings of bucket under prefix, or all listings.
+
+        """
+        with self._lock:
+            for k in list(self._cache):
+                if bucket is None or (k[0] == bucket and k[1].startswith(prefix)):
+                    del self._cache[k]
+
+    # --------
+
+    def _lookup(self, bucket: str, prefix: str, recursive: bool) -> Optional[Listing]:
+        now = time.monotonic()
+        with self._lock:
+            for (b, p, r), (fetched, listing) in list(self._cache.items()):
+                if self._ttl is not None and now - fetched > self._ttl:
+                    del self._cache[(b, p, r)]
+                    continue
+                if b != bucket:
+                    continue
+                if p == prefix and r == recursive:
+                    return listing
+                if r and prefix.startswith(p):
+                    return self._derive(listing, prefix, recursive)
+
+        return None
+
+    @staticmethod
+    def _derive(listing: Listing, prefix: str, recursive: bool) -> Listing:
+        """Derive a listing of prefix from a recursive listing of one of its parents"""
+        objects = []
+        prefixes = []
+        for obj in listing.objects:
+            if not obj.key.startswith(prefix):
+                continue
+            rest = obj.key[len(prefix):]
+            if recursive or '/' not in rest:
+                objects.append(obj)
+            else:
+                child = prefix + rest.split('/', 1)[0] + '/'
+                if not prefixes or prefixes[-1] != child:
+                    prefixes.append(child)
+
+        return Listing(objects, prefixes)
+
+    def _fetch(self, bucket: str, prefix: str, recursive: bool) -> Listing:
+        log.debug(f'Listing s3://{bucket}/{prefix}')
+        kwargs = {'Bucket': bucket, 'Prefix': prefix}
+        if not recursive:
+            kwargs['Delimiter'] = '/'
+
+        objects = []
+        prefixes = []
+        paginator = self._s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(**kwargs):
+            for x in page.get('Contents', []):
+                objects.append(ObjectInfo(x['Key'], x.get('ETag', '').strip('"'), x.get('Size', 0), x.get('LastModified')))
+            prefixes.extend(x['Prefix'] for x in page.get('CommonPrefixes', []))
+
+        return Listing(objects, prefixes)
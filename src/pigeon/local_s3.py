@@ -0,0 +1,207 @@
+"""
+A local, read-only stand-in for S3 serving the files of a directory.
+
+Each subdirectory of the root is served as a bucket.  Only the requests pigeon makes are
+supported: ListObjectsV2, HeadObject and GetObject, with ranged reads.  It is intended
+for benchmarks and tests, so requests are not authenticated.
+
+    with LocalS3(root) as s3:
+        store = Store(path, s3_config=s3.config)
+        RemoteFlowcellDir('s3://bucket/prefix', s3_config=s3.config)
+
+"""
+
+import email.utils
+import hashlib
+import http.server
+import pathlib as P
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import escape
+import logging
+
+import boto3
+
+from .s3_config import S3Config
+
+log = logging.getLogger(__name__)
+
+
+def _etag(path: P.Path) -> str:
+    stat = path.stat()
+    return hashlib.md5(f'{path}:{stat.st_mtime_ns}:{stat.st_size}'.encode()).hexdigest()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    root: P.Path
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+    def do_GET(self):
+        self._object_or_listing(body=True)
+
+    def do_HEAD(self):
+        self._object_or_listing(body=False)
+
+    # --------
+
+    def _object_or_listing(self, body: bool):
+        url = urlparse(self.path)
+        bucket, _, key = unquote(url.path).lstrip('/').partition('/')
+        bucket_path = self.root / bucket
+        if not bucket or not bucket_path.is_dir():
+            return self._error(404, 'NoSuchBucket')
+        if not key:
+            return self._list(bucket_path, parse_qs(url.query), body)
+
+        path = bucket_path / key
+        if not path.is_file() or bucket_path.resolve() not in path.resolve().parents:
+            return self._error(404, 'NoSuchKey')
+        self._object(path, body)
+
+    def _list(self, bucket_path: P.Path, query: Dict[str, List[str]], body: bool):
+        arg = lambda name, default=None: query.get(name, [default])[0]
+        prefix = arg('prefix', '')
+        delimiter = arg('delimiter')
+        max_keys = int(arg('max-keys', '1000'))
+        start = arg('continuation-token') or arg('start-after') or ''
+
+        keys = sorted(x.relative_to(bucket_path).as_posix() for x in bucket_path.rglob('*') if x.is_file())
+        entries = []
+        for key in keys:
+            if not key.startswith(prefix):
+                continue
+            rest = key[len(prefix):]
+            if delimiter and delimiter in rest:
+                common = prefix + rest.split(delimiter, 1)[0] + delimiter
+                if not entries or entries[-1] != ('prefix', common):
+                    entries.append(('prefix', common))
+            else:
+                entries.append(('key', key))
+        entries = [x for x in entries if x[1] > start]
+        page, truncated = entries[:max_keys], len(entries) > max_keys
+
+        parts = [f'<Name>{escape(bucket_path.name)}</Name><Prefix>{escape(prefix)}</Prefix>',
+                 f'<KeyCount>{len(page)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>',
+                 f'<IsTruncated>{str(truncated).lower()}</IsTruncated>']
+        if truncated:
+            parts.append(f'<NextContinuationToken>{escape(page[-1][1])}</NextContinuationToken>')
+        for kind, name in page:
+            if kind == 'prefix':
+                parts.append(f'<CommonPrefixes><Prefix>{escape(name)}</Prefix></CommonPrefixes>')
+                continue
+            path = bucket_path / name
+            stat = path.stat()
+            modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+            parts.append(f'<Contents><Key>{escape(name)}</Key><LastModified>{modified}</LastModified>'
+                         f'<ETag>"{_etag(path)}"</ETag><Size>{stat.st_size}</Size>'
+                         '<StorageClass>STANDARD</StorageClass></Contents>')
+
+        data = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                + ''.join(parts) + '</ListBucketResult>').encode()
+        self._respond(200, {'Content-Type': 'application/xml'}, data if body else None, len(data))
+
+    def _object(self, path: P.Path, body: bool):
+        stat = path.stat()
+        start, end = 0, stat.st_size - 1
+        status = 200
+        headers = {
+            'ETag': f'"{_etag(path)}"',
+            'Last-Modified': email.utils.formatdate(stat.st_mtime, usegmt=True),
+            'Accept-Ranges': 'bytes',
+            'Content-Type': 'application/octet-stream',
+        }
+        if range_ := self.headers.get('Range'):
+            first, _, last = range_.removeprefix('bytes=').partition('-')
+            if first:
+                start, end = int(first), min(int(last) if last else end, end)
+            else:
+                start = max(0, stat.st_size - int(last))
+            if start > end:
+                return self._error(416, 'InvalidRange')
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+
+        length = end - start + 1
+        if not body:
+            return self._respond(status, headers, None, length)
+
+        self._respond(status, headers, None, length)
+        with path.open('rb') as f:
+            f.seek(start)
+            while length > 0:
+                chunk = f.read(min(length, 1 << 20))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                length -= len(chunk)
+
+    def _error(self, status: int, code: str):
+        data = f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code></Error>'.encode()
+        self._respond(status, {'Content-Type': 'application/xml'}, data if self.command != 'HEAD' else None, len(data))
+
+    def _respond(self, status: int, headers: Dict[str, str], data: Optional[bytes], length: int):
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        if data is not None:
+            self.wfile.write(data)
+
+
+class LocalS3:
+    """
+    Serve a directory as S3 buckets over HTTP from a background thread.
+
+    """
+
+    def __init__(self, root: str, host: str='127.0.0.1', port: int=0):
+        """
+        :param root: directory whose subdirectories are buckets
+        :param port: port to listen on.  By default a free port is chosen.
+
+        """
+        handler = type('Handler', (_Handler,), {'root': P.Path(root).resolve()})
+        self._server = http.server.ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'LocalS3':
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def endpoint_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        log.info(f'Serving local S3 at {self.endpoint_url}')
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    @property
+    def config(self) -> S3Config:
+        """Configuration of boto3 and duckdb for this endpoint"""
+        return S3Config.local(self.endpoint_url)
+
+    def client(self, session: Optional[boto3.Session]=None) -> 'botocore.client.S3':
+        """
+        Return a boto3 S3 client for this endpoint.
+
+        """
+        return self.config.client(session)
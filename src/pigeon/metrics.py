@@ -0,0 +1,95 @@
+"""
+Instrumentation of the stages of loading a source into the store.
+
+Each call to load a flowcell or cram.stats file is timed by an `IngestTimer`.  Its
+metrics are stored in the ``ingest_metrics`` table and passed to any hooks registered
+with `Store.add_ingest_hook`.
+
+"""
+
+import contextlib
+import datetime
+import time
+import uuid
+from typing import Iterator, List, NamedTuple, Optional
+
+# Columns of the ingest_metrics table
+INGEST_METRICS_SCHEMA = [
+    ('load_id', 'VARCHAR', 'YES', None, None, None),
+    ('source', 'VARCHAR', 'YES', None, None, None),
+    ('run_id', 'VARCHAR', 'YES', None, None, None),
+    ('table_name', 'VARCHAR', 'YES', None, None, None),
+    ('stage', 'VARCHAR', 'YES', None, None, None),
+    ('started_at', 'TIMESTAMP', 'YES', None, None, None),
+    ('seconds', 'DOUBLE', 'YES', None, None, None),
+    ('rows', 'BIGINT', 'YES', None, None, None),
+    ('bytes', 'BIGINT', 'YES', None, None, None),
+    ('profile', 'VARCHAR', 'YES', None, None, None),
+    ('error', 'VARCHAR', 'YES', None, None, None)
+]
+
+
+class IngestMetric(NamedTuple):
+    #: Identifies the metrics of one load of a source
+    load_id: str
+    #: Flowcell directory or cram.stats file being loaded
+    source: str
+    run_id: Optional[str]
+    #: Table the stage applies to, or None for stages of the whole source
+    table_name: Optional[str]
+    #: One of list, open, fetch, delete, insert or commit
+    stage: str
+    started_at: datetime.datetime
+    seconds: float
+    rows: Optional[int] = None
+    #: Size of the source file read by the stage
+    bytes: Optional[int] = None
+    #: duckdb's JSON query profile of the statement reading the source, if enabled
+    profile: Optional[str] = None
+    #: The exception raised by the stage, if it failed
+    error: Optional[str] = None
+
+
+class _Stage:
+    """Values of a stage set from within its block"""
+    rows: Optional[int] = None
+    profile: Optional[str] = None
+
+
+class IngestTimer:
+    """
+    Collects the metrics of each stage of loading one source.
+
+    """
+
+    def __init__(self, source: str):
+        self.load_id = uuid.uuid4().hex
+        self.source = source
+        #: Set once known, for stages recorded before it was
+        self.run_id: Optional[str] = None
+        self._metrics: List[IngestMetric] = []
+
+    @property
+    def metrics(self) -> List[IngestMetric]:
+        return [m._replace(run_id=m.run_id or self.run_id) for m in self._metrics]
+
+    @contextlib.contextmanager
+    def stage(self, stage: str, table_name: Optional[str]=None, bytes: Optional[int]=None) -> Iterator[_Stage]:
+        """
+        Time a block as a stage.  The metric is recorded with the error if the block raises.
+
+        """
+        started_at = datetime.datetime.now()
+        t0 = time.perf_counter()
+        values = _Stage()
+        error = None
+        try:
+            yield values
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            self._metrics.append(IngestMetric(
+                self.load_id, self.source, self.run_id, table_name, stage, started_at,
+                time.perf_counter() - t0, values.rows, bytes, values.profile, error
+            ))
@@ -0,0 +1,48 @@
+"""
+pore_activity stored in long form.
+
+MinKNOW writes pore_activity as a row per minute and channel state.  The store keeps
+those rows as they are in ``pore_activity_states``, so loading pore_activity is a
+plain append, and channel states added by newer versions of MinKNOW are kept rather
+than failing the load.  The ``pore_activity`` view pivots them on demand into a column
+per state in CHANNEL_STATES, the layout the table used to be stored in.
+
+"""
+
+from typing import Sequence, Tuple
+
+from .flowcell_dir import CHANNEL_STATES, FC_SCHEMAS
+
+STATES_TABLE = 'pore_activity_states'
+
+STATES_SCHEMA = [
+    ('experiment_id', 'VARCHAR', 'YES', None, None, None),
+    ('run_id', 'VARCHAR', 'YES', None, None, None),
+    ('experiment_time', 'BIGINT', 'YES', None, None, None),
+    ('channel_state', 'VARCHAR', 'YES', None, None, None),
+    ('state_time', 'BIGINT', 'YES', None, None, None)
+]
+
+
+def wide_view_sql(schema: Sequence[Tuple]=FC_SCHEMAS['pore_activity']) -> str:
+    """
+    Return the query of the view pivoting the states table into the columns of schema.
+
+    """
+    types = {col[0]: col[1] for col in schema}
+    states = ', '.join(f"(sum(state_time) filter (where channel_state = '{x}'))::{types[x]} as {x}"
+                       for x in CHANNEL_STATES)
+    return f"""
+        select experiment_id, run_id, experiment_time, {states}
+        from {STATES_TABLE}
+        group by experiment_id, run_id, experiment_time
+        """
+
+
+def unpivot_sql(table_name: str) -> str:
+    """Return a query of the rows of a table in the wide layout in long form"""
+    states = ', '.join(CHANNEL_STATES)
+    return f"""
+        select experiment_id, run_id, experiment_time, channel_state, state_time
+        from (unpivot {table_name} on {states} into name channel_state value state_time)
+        """
@@ -0,0 +1,43 @@
+"""
+Helpers for consuming the streaming results of `Store.query` with numpy.
+
+Numeric columns without nulls are returned as numpy views of the arrow buffers, so
+iterating over a large result costs only the memory of one batch at a time:
+
+    for cols in iter_numpy(store.run_reads(run_id, ['start_time', 'sequence_length_template'])):
+        ...
+
+"""
+
+from typing import Dict, Iterable, Iterator, Optional
+
+import numpy as np
+import pyarrow as pa
+
+# Rows per batch of query results, about 10MB per double column
+DEFAULT_BATCH_SIZE = 1_000_000
+
+
+def numpy_columns(batch: pa.RecordBatch, columns: Optional[Iterable[str]]=None,
+                  zero_copy_only: bool=True) -> Dict[str, np.ndarray]:
+    """
+    Return columns of a record batch as numpy arrays.
+
+    :param columns: names of the columns, or all columns if None
+    :param zero_copy_only: raise pyarrow.ArrowInvalid rather than copy a column which
+        can't be viewed in place, e.g. one with nulls or of strings or booleans
+
+    """
+    names = batch.schema.names if columns is None else list(columns)
+    return {name: batch.column(name).to_numpy(zero_copy_only=zero_copy_only) for name in names}
+
+
+def iter_numpy(reader: pa.RecordBatchReader, columns: Optional[Iterable[str]]=None,
+               zero_copy_only: bool=True) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Yield the columns of each batch of a reader as numpy arrays.
+
+    """
+    columns = None if columns is None else list(columns)
+    for batch in reader:
+        yield numpy_columns(batch, columns, zero_copy_only)
@@ -0,0 +1,181 @@
+"""
+Pre-aggregated tables for dashboards, maintained by the store as rows are inserted.
+
+Each rollup is grouped by its key columns.  Value columns are merged across inserts
+with their merge function, so a rollup can be updated from just the rows being
+inserted or removed rather than by scanning its source table.
+
+"""
+
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+from .sketches import bucket_sql
+
+
+class Rollup(NamedTuple):
+    #: Table aggregated by the rollup
+    source: str
+    #: Columns the rollup is grouped by
+    keys: List[str]
+    #: Columns of the rollup table in the same format as FC_SCHEMAS
+    schema: Sequence[Tuple]
+    #: Query aggregating the rows of ``{rows}`` to the rollup's columns
+    select: str
+    #: Function merging each value column, 'sum' unless given.  Only rollups whose
+    #: values are all summed can have rows removed.
+    merge: Dict[str, str] = {}
+    #: The rollup looks up the run of each row in read_index.  As the run may not have
+    #: been loaded when a row was added, rows can't be removed; the groups they were in
+    #: are rebuilt instead.
+    by_read_index: bool = False
+
+    @property
+    def values(self) -> List[str]:
+        return [col[0] for col in self.schema if col[0] not in self.keys]
+
+    @property
+    def removable(self) -> bool:
+        """Whether rows can be removed by subtracting their rollup"""
+        return not self.merge and not self.by_read_index
+
+
+ROLLUPS = {
+    # Yield, pass/fail counts and mean qscore per run and hour of the run
+    'rollup_reads_hourly': Rollup(
+        source='sequencing_summary',
+        keys=['run_id', 'passes_filtering', 'time_hours'],
+        schema=[
+            ('run_id', 'VARCHAR', 'YES', None, None, None),
+            ('passes_filtering', 'BOOLEAN', 'YES', None, None, None),
+            ('time_hours', 'BIGINT', 'YES', None, None, None),
+            ('reads', 'BIGINT', 'YES', None, None, None),
+            ('bases', 'BIGINT', 'YES', None, None, None),
+            ('sum_qscore', 'DOUBLE', 'YES', None, None, None)
+        ],
+        select="""
+            select run_id, passes_filtering, floor(start_time / 3600)::BIGINT as time_hours,
+                   count(*) as reads, sum(sequence_length_template) as bases,
+                   sum(mean_qscore_template) as sum_qscore
+            from {rows}
+            group by all
+            """
+    ),
+    # Read length distribution per run in 1kbp bins
+    'rollup_read_lengths': Rollup(
+        source='sequencing_summary',
+        keys=['run_id', 'passes_filtering', 'kbp'],
+        schema=[
+            ('run_id', 'VARCHAR', 'YES', None, None, None),
+            ('passes_filtering', 'BOOLEAN', 'YES', None, None, None),
+            ('kbp', 'BIGINT', 'YES', None, None, None),
+            ('reads', 'BIGINT', 'YES', None, None, None),
+            ('bases', 'BIGINT', 'YES', None, None, None)
+        ],
+        select="""
+            select run_id, passes_filtering, sequence_length_template // 1000 as kbp,
+                   count(*) as reads, sum(sequence_length_template) as bases
+            from {rows}
+            group by all
+            """
+    ),
+    # MinKNOW's cumulative throughput counters at the end of each hour of a run
+    'rollup_throughput_hourly': Rollup(
+        source='throughput',
+        keys=['run_id', 'time_hours'],
+        schema=[
+            ('run_id', 'VARCHAR', 'YES', None, None, None),
+            ('time_hours', 'BIGINT', 'YES', None, None, None),
+            ('reads', 'BIGINT', 'YES', None, None, None),
+            ('basecalled_reads_passed', 'BIGINT', 'YES', None, None, None),
+            ('basecalled_reads_failed', 'BIGINT', 'YES', None, None, None),
+            ('estimated_bases', 'BIGINT', 'YES', None, None, None),
+            ('basecalled_bases', 'BIGINT', 'YES', None, None, None)
+        ],
+        select="""
+            select run_id, experiment_time // 60 as time_hours,
+                   max(reads) as reads, max(basecalled_reads_passed) as basecalled_reads_passed,
+                   max(basecalled_reads_failed) as basecalled_reads_failed,
+                   max(estimated_bases) as estimated_bases, max(basecalled_bases) as basecalled_bases
+            from {rows}
+            group by all
+            """,
+        merge={'reads': 'max', 'basecalled_reads_passed': 'max', 'basecalled_reads_failed': 'max',
+               'estimated_bases': 'max', 'basecalled_bases': 'max'}
+    ),
+    # Alignment totals per basecalling model and reference sequence
+    'rollup_cramstats': Rollup(
+        source='cramstats',
+        keys=['model', 'ref'],
+        schema=[
+            ('model', 'VARCHAR', 'YES', None, None, None),
+            ('ref', 'VARCHAR', 'YES', None, None, None),
+            ('reads', 'BIGINT', 'YES', None, None, None),
+            ('sum_length', 'BIGINT', 'YES', None, None, None),
+            ('sum_aligned_ref_len', 'BIGINT', 'YES', None, None, None),
+            ('sum_coverage', 'DOUBLE', 'YES', None, None, None),
+            ('sum_iden', 'DOUBLE', 'YES', None, None, None),
+            ('sum_acc', 'DOUBLE', 'YES', None, None, None)
+        ],
+        select="""
+            select model, ref, count(*) as reads, sum(length) as sum_length,
+                   sum(aligned_ref_len) as sum_aligned_ref_len, sum(coverage) as sum_coverage,
+                   sum(iden) as sum_iden, sum(acc) as sum_acc
+            from {rows}
+            group by all
+            """
+    ),
+    # Quantile sketches of pigeon.sketches, per run and metric
+    'sketch_reads': Rollup(
+        source='sequencing_summary',
+        keys=['run_id', 'passes_filtering', 'metric', 'bucket'],
+        schema=[
+            ('run_id', 'VARCHAR', 'YES', None, None, None),
+            ('passes_filtering', 'BOOLEAN', 'YES', None, None, None),
+            ('metric', 'VARCHAR', 'YES', None, None, None),
+            ('bucket', 'INTEGER', 'YES', None, None, None),
+            ('count', 'BIGINT', 'YES', None, None, None),
+            ('total', 'DOUBLE', 'YES', None, None, None)
+        ],
+        select=f"""
+            select run_id, passes_filtering, metric, {bucket_sql('value')} as bucket,
+                   count(*) as count, sum(value) as total
+            from (unpivot (select run_id, passes_filtering,
+                                  sequence_length_template::DOUBLE as sequence_length_template,
+                                  mean_qscore_template::DOUBLE as mean_qscore_template
+                           from {{rows}})
+                  on sequence_length_template, mean_qscore_template
+                  into name metric value value)
+            group by all
+            """
+    ),
+    # Alignments are matched to runs by read name.  Those of reads not yet loaded have a
+    # null run_id until the rollups are rebuilt.
+    'sketch_alignments': Rollup(
+        source='cramstats',
+        keys=['model', 'run_id', 'metric', 'bucket'],
+        schema=[
+            ('model', 'VARCHAR', 'YES', None, None, None),
+            ('run_id', 'VARCHAR', 'YES', None, None, None),
+            ('metric', 'VARCHAR', 'YES', None, None, None),
+            ('bucket', 'INTEGER', 'YES', None, None, None),
+            ('count', 'BIGINT', 'YES', None, None, None),
+            ('total', 'DOUBLE', 'YES', None, None, None)
+        ],
+        select=f"""
+            select a.model, r.run_id, a.metric, {bucket_sql('a.value')} as bucket,
+                   count(*) as count, sum(a.value) as total
+            from (unpivot (select model::VARCHAR as model, name, iden::DOUBLE as iden, acc::DOUBLE as acc
+                           from {{rows}})
+                  on iden, acc
+                  into name metric value value) a
+            left join read_index r on a.name = r.read_id
+            group by all
+            """,
+        by_read_index=True
+    ),
+}
+
+
+def rollups_of(table_name: str) -> Dict[str, Rollup]:
+    """Return the rollups aggregating a table"""
+    return {name: rollup for (name, rollup) in ROLLUPS.items() if rollup.source == table_name}
@@ -0,0 +1,184 @@
+"""
+S3 configuration shared by boto3 and duckdb.
+
+pigeon lists and downloads objects with boto3, and duckdb reads s3:// paths itself
+with its httpfs extension.  An `S3Config` gives both the same endpoint, region,
+addressing style and credentials, so a store can be pointed at another S3
+implementation, such as `pigeon.local_s3.LocalS3`, in one place.
+
+boto3 clients are thread safe and keep a pool of connections, so one client is shared
+by everything using an equal configuration.  `S3Config.for_workers` sizes the pool for
+a number of ingest workers.  duckdb is set to keep connections alive, cache object
+metadata and, in versions which have the setting, the contents of files read more than
+once, and prefetch the byte ranges of parquet files it will read in parallel.  Its secret finds credentials through the
+AWS credential chain, as boto3 does, and refreshes them when they expire.
+
+"""
+
+import threading
+from typing import Dict, NamedTuple, Optional
+from urllib.parse import urlparse
+import logging
+
+import boto3
+import duckdb
+from botocore import UNSIGNED
+from botocore.config import Config
+
+log = logging.getLogger(__name__)
+
+# Name of the duckdb secret holding the configuration
+SECRET_NAME = 'pigeon_s3'
+
+# Connections used by each worker, as boto3 downloads a file over up to 10 at once
+CONNECTIONS_PER_WORKER = 10
+
+# Clients shared by equal configurations
+_clients: Dict['S3Config', 'botocore.client.S3'] = {}
+_clients_lock = threading.Lock()
+
+
+class S3Config(NamedTuple):
+    #: URL of an S3 compatible service to use instead of AWS, e.g. http://localhost:9000
+    endpoint_url: Optional[str] = None
+    #: Region of the buckets, by default that of the boto3 session
+    region: Optional[str] = None
+    #: Make anonymous requests, e.g. for public buckets
+    unsigned: bool = False
+    #: Address buckets as http://host/bucket rather than http://bucket.host
+    path_style: bool = False
+    #: Connections kept open by the boto3 client, see for_workers
+    max_connections: int = 32
+    #: Attempts at each request before failing
+    retries: int = 5
+
+    @classmethod
+    def local(cls, endpoint_url: str) -> 'S3Config':
+        """Configuration for a local stand-in for S3 such as LocalS3"""
+        return cls(endpoint_url=endpoint_url, region='us-east-1', unsigned=True, path_style=True)
+
+    def for_workers(self, workers: int) -> 'S3Config':
+        """Return this configuration with a connection pool large enough for workers concurrent loads"""
+        return self._replace(max_connections=max(self.max_connections, CONNECTIONS_PER_WORKER * workers))
+
+    def client(self, session: Optional[boto3.Session]=None) -> 'botocore.client.S3':
+        """
+        Return a boto3 client with this configuration.
+
+        Without a session, one client is created for each configuration and shared.
+
+        """
+        if session is not None:
+            return self._make_client(session)
+
+        with _clients_lock:
+            if self not in _clients:
+                _clients[self] = self._make_client(boto3.Session())
+            return _clients[self]
+
+    def duckdb_settings(self) -> Dict[str, object]:
+        """
+        Settings of duckdb for reading remote files, which don't need httpfs.  Those
+        unknown to the running version of duckdb are skipped by configure.
+
+        """
+        return {
+            'enable_http_metadata_cache': True,
+            'enable_external_file_cache': True,
+            'parquet_metadata_cache': True,
+            # The parquet metadata cache in duckdb before 1.2
+            'enable_object_cache': True,
+            'prefetch_all_parquet_files': True,
+        }
+
+    def httpfs_settings(self) -> Dict[str, object]:
+        """Settings of the httpfs extension"""
+        return {
+            'http_keep_alive': True,
+            'http_retries': self.retries,
+        }
+
+    def secret_sql(self, session: Optional[boto3.Session]=None, credential_chain: bool=True) -> str:
+        """
+        Return the statement creating the duckdb secret for this configuration.
+
+        Unless unsigned, duckdb finds credentials through the AWS credential chain, from
+        the profile of session if it has one, and refreshes them when they expire.
+
+        :param credential_chain: if False, use the current credentials boto3 finds for
+            session instead, e.g. where duckdb's aws extension isn't available.  These
+            aren't refreshed, so temporary credentials will expire.
+
+        """
+        session = session or boto3.Session()
+        options = {'type': 's3', 'provider': 'config'}
+        if not self.unsigned and credential_chain:
+            options.update({'provider': 'credential_chain', 'refresh': 'auto'})
+            if session.profile_name != 'default':
+                options['profile'] = session.profile_name
+        if region := self.region or session.region_name:
+            options['region'] = region
+        if self.endpoint_url:
+            url = urlparse(self.endpoint_url)
+            options['endpoint'] = url.netloc
+            options['use_ssl'] = url.scheme == 'https'
+        if self.path_style:
+            options['url_style'] = 'path'
+        if not self.unsigned and not credential_chain and (credentials := session.get_credentials()):
+            credentials = credentials.get_frozen_credentials()
+            options['key_id'] = credentials.access_key
+            options['secret'] = credentials.secret_key
+            if credentials.token:
+                options['session_token'] = credentials.token
+
+        values = ', '.join(f'{k} {_sql_literal(v)}' for (k, v) in options.items())
+        return f'create or replace secret {SECRET_NAME} ({values})'
+
+    def configure(self, conn: duckdb.DuckDBPyConnection) -> None:
+        """
+        Configure a duckdb connection to read s3:// paths with this configuration.
+
+        If httpfs can't be loaded, e.g. offline, a warning is logged and s3:// paths
+        can then only be read through a DiskCache.
+
+        """
+        known = {x[0] for x in conn.execute('select name from duckdb_settings()').fetchall()}
+        for name, value in self.duckdb_settings().items():
+            if name not in known:
+                log.debug(f'Skipping setting {name}, which this version of duckdb does not have')
+                continue
+            conn.execute(f'set {name} = {_sql_literal(value)}')
+
+        try:
+            conn.execute('load httpfs')
+        except duckdb.Error as e:
+            log.warning(f'Unable to load httpfs, s3:// paths are not readable by duckdb: {e}')
+            return
+
+        for name, value in self.httpfs_settings().items():
+            conn.execute(f'set {name} = {_sql_literal(value)}')
+        try:
+            conn.execute(self.secret_sql())
+        except duckdb.Error as e:
+            log.warning(f'Unable to use the AWS credential chain, the current credentials of boto3 '
+                        f'are used and will not be refreshed: {e}')
+            conn.execute(self.secret_sql(credential_chain=False))
+
+    # --------
+
+    def _make_client(self, session: boto3.Session) -> 'botocore.client.S3':
+        config = Config(
+            signature_version=UNSIGNED if self.unsigned else None,
+            s3={'addressing_style': 'path'} if self.path_style else None,
+            max_pool_connections=self.max_connections,
+            retries={'max_attempts': self.retries, 'mode': 'standard'},
+        )
+        return session.client('s3', endpoint_url=self.endpoint_url, region_name=self.region, config=config)
+
+
+def _sql_literal(value: object) -> str:
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, int):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
@@ -0,0 +1,55 @@
+"""
+Fixed-size samples of large tables, stratified by run or model, for approximate queries.
+
+Each stratum of a sample keeps the rows of its source with the smallest
+``sample_key``, a hash of the columns identifying a row.  This is a bottom-k sample:
+as rows are inserted the sample is updated from just the sampled rows and the new
+ones, and the same rows are chosen however and in whatever order they were loaded.
+
+Besides the columns of the source, each sample row has ``stratum_rows``, the number of
+rows of its stratum in the source, and ``sample_fraction``, the fraction of them
+sampled.  A count over a sample is estimated as ``sum(1 / sample_fraction)``.
+
+"""
+
+from typing import Dict, List, NamedTuple, Tuple
+
+# Rows kept per stratum unless the store is opened with another sample size
+DEFAULT_SAMPLE_SIZE = 10_000
+
+# Hashed with the key columns so samples are independent of other uses of hash()
+SAMPLE_SEED = 'pigeon-sample'
+
+SAMPLE_COLUMNS = [
+    ('sample_key', 'UBIGINT', 'YES', None, None, None),
+    ('stratum_rows', 'BIGINT', 'YES', None, None, None),
+    ('sample_fraction', 'DOUBLE', 'YES', None, None, None)
+]
+
+
+class Sample(NamedTuple):
+    #: Table sampled
+    source: str
+    #: Column whose values are sampled separately
+    stratum: str
+    #: Columns identifying a row of the source
+    key: List[str]
+
+    def key_sql(self) -> str:
+        return f"hash({', '.join(self.key)}, '{SAMPLE_SEED}')"
+
+
+SAMPLES = {
+    'sample_sequencing_summary': Sample(source='sequencing_summary', stratum='run_id', key=['read_id']),
+    # A read may have several alignments
+    'sample_cramstats': Sample(source='cramstats', stratum='model', key=['name', 'ref', 'rstart']),
+}
+
+
+def samples_of(table_name: str) -> Dict[str, Sample]:
+    """Return the samples of a table"""
+    return {name: sample for (name, sample) in SAMPLES.items() if sample.source == table_name}
+
+
+def sample_schema(source_schema: List[Tuple]) -> List[Tuple]:
+    return list(source_schema) + SAMPLE_COLUMNS
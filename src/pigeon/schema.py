@@ -0,0 +1,87 @@
+"""
+Helpers for reading table files with column types pinned to Pigeon's schemas.
+
+Reading with explicit columns and dialect avoids duckdb's sniffer, which samples
+each file before parsing it, and keeps parsed types identical to the store's tables.
+Files with a compression suffix of pigeon.compression are decompressed as they are read.
+
+"""
+
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import duckdb
+
+from .compression import compression_of
+
+# Larger than any header line we expect to read
+HEADER_BUFFER_SIZE = 1 << 16
+
+TAB = '\t'
+
+
+class SchemaMismatch(ValueError):
+    """A source file's columns don't match the expected schema"""
+    pass
+
+
+def schema_columns(schema: Sequence[Tuple], exclude: Iterable[str]=()) -> Dict[str, str]:
+    """
+    Return an ordered mapping of column name to type from a schema list.
+
+    :param schema: list of column descriptions as in FC_SCHEMAS
+    :param exclude: columns to leave out, e.g. those added by the store on insert
+
+    """
+    exclude = set(exclude)
+    return {col[0]: col[1] for col in schema if col[0] not in exclude}
+
+
+def quote_path(path: str) -> str:
+    """Quote a path as an SQL string literal"""
+    return "'" + path.replace("'", "''") + "'"
+
+
+def read_csv_sql(path: str, columns: Dict[str, str], delim: str, header: bool, **options) -> str:
+    """
+    Return a read_csv table function call with explicit columns and dialect.
+
+    """
+    if compression := compression_of(path):
+        options.setdefault('compression', f"'{compression}'")
+    columns_sql = ', '.join(f"'{name}': '{type_}'" for (name, type_) in columns.items())
+    options_sql = ''.join(f", {k}={v}" for (k, v) in options.items())
+
+    return (f"read_csv({quote_path(path)}, auto_detect=false, header={str(header).lower()}, "
+            f"delim='{delim}', columns={{{columns_sql}}}{options_sql})")
+
+
+def read_header(connection: duckdb.DuckDBPyConnection, path: str, delim: str) -> List[str]:
+    """
+    Return the column names from the first line of a file, reading as little as possible.
+
+    """
+    source = read_csv_sql(path, {'line': 'VARCHAR'}, '\x01', False, quote="''", escape="''",
+                          buffer_size=HEADER_BUFFER_SIZE, max_line_size=HEADER_BUFFER_SIZE)
+    row = connection.sql(f'select * from {source} limit 1').fetchone()
+    if row is None or row[0] is None:
+        raise SchemaMismatch(f'{path} is empty')
+
+    return row[0].rstrip('\r').split(delim)
+
+
+def header_columns(connection: duckdb.DuckDBPyConnection, path: str, delim: str,
+                   columns: Dict[str, str]) -> Dict[str, str]:
+    """
+    Return columns in the order they appear in a file's header, with types from columns.
+
+    Raises SchemaMismatch if the header has different columns to those expected.
+
+    """
+    names = read_header(connection, path, delim)
+
+    unexpected = [x for x in names if x not in columns]
+    missing = [x for x in columns if x not in names]
+    if unexpected or missing:
+        raise SchemaMismatch(f'{path} does not match schema: unexpected columns {unexpected}, missing columns {missing}')
+
+    return {name: columns[name] for name in names}
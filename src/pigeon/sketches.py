@@ -0,0 +1,138 @@
+"""
+Mergeable quantile sketches of read and alignment metrics.
+
+Values are counted in logarithmic buckets, as in DDSketch: bucket i holds values in
+(GAMMA^(i-1), GAMMA^i], so any quantile is estimated within a relative error of ALPHA.
+Sketches of different runs are merged by adding their counts, so summaries of any
+selection of runs cost as much as the number of buckets, not the number of reads.
+Values of zero or less are counted in a bucket of their own, with a null index.
+
+Each bucket also holds the total of its values, e.g. the bases of reads binned by
+length, which gives weighted quantiles such as N50.
+
+"""
+
+import math
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Relative accuracy of quantiles
+ALPHA = 0.001
+GAMMA = (1 + ALPHA) / (1 - ALPHA)
+
+# Sketch rollup holding each metric
+METRICS = {
+    'sequence_length_template': 'sketch_reads',
+    'mean_qscore_template': 'sketch_reads',
+    'iden': 'sketch_alignments',
+    'acc': 'sketch_alignments',
+}
+
+
+def bucket_sql(value: str) -> str:
+    """Expression for the bucket of a value"""
+    return f'if({value} > 0, ceil(ln({value}) / {math.log(GAMMA)!r})::INTEGER, null)'
+
+
+def bucket_value(bucket: Optional[int]) -> float:
+    """The value representing a bucket, within ALPHA of all its values"""
+    if bucket is None:
+        return 0.0
+    return 2 * GAMMA ** bucket / (GAMMA + 1)
+
+
+class Bucket(NamedTuple):
+    lower: float
+    upper: float
+    count: int
+    total: float
+
+
+class Sketch:
+    """
+    Counts and totals of values by bucket.
+
+    """
+
+    def __init__(self, buckets: Optional[Dict[Optional[int], Tuple[int, float]]]=None):
+        """
+        :param buckets: (count, total) of the values of each bucket
+
+        """
+        self.buckets = dict(buckets or {})
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[Optional[int], int, float]]) -> 'Sketch':
+        """Create a sketch from (bucket, count, total) rows"""
+        return cls({bucket: (count, total) for (bucket, count, total) in rows})
+
+    def __repr__(self):
+        return f'Sketch(count={self.count}, buckets={len(self.buckets)})'
+
+    def merge(self, other: 'Sketch') -> 'Sketch':
+        buckets = dict(self.buckets)
+        for bucket, (count, total) in other.buckets.items():
+            c, t = buckets.get(bucket, (0, 0.0))
+            buckets[bucket] = (c + count, t + total)
+
+        return Sketch(buckets)
+
+    @property
+    def count(self) -> int:
+        return sum(c for (c, _) in self.buckets.values())
+
+    @property
+    def total(self) -> float:
+        return sum(t for (_, t) in self.buckets.values())
+
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q: float, weighted: bool=False) -> Optional[float]:
+        """
+        Estimate the q quantile of the values.
+
+        :param weighted: weight values by themselves, e.g. to find the read length
+            below which q of the bases are
+
+        """
+        return self.quantiles([q], weighted)[0]
+
+    def quantiles(self, qs: List[float], weighted: bool=False) -> List[Optional[float]]:
+        rows = self._sorted()
+        weights = [t if weighted else c for (_, c, t) in rows]
+        whole = sum(weights)
+        if not whole:
+            return [None for _ in qs]
+
+        results = []
+        for q in qs:
+            target = q * whole
+            cumulative = 0
+            for (bucket, _, _), weight in zip(rows, weights):
+                cumulative += weight
+                if cumulative >= target and weight:
+                    break
+            results.append(bucket_value(bucket))
+
+        return results
+
+    def n50(self) -> Optional[float]:
+        """The length such that reads at least as long hold half of the bases"""
+        half = self.total / 2
+        cumulative = 0
+        for bucket, _, total in reversed(self._sorted()):
+            cumulative += total
+            if cumulative >= half and total:
+                return bucket_value(bucket)
+
+        return None
+
+    def histogram(self) -> List[Bucket]:
+        """The bounds, count and total of each non-empty bucket in order"""
+        return [Bucket(0.0 if b is None else GAMMA ** (b - 1), 0.0 if b is None else GAMMA ** b, c, t)
+                for (b, c, t) in self._sorted() if c]
+
+    def _sorted(self) -> List[Tuple[Optional[int], int, float]]:
+        # The bucket of values <= 0 comes first
+        return sorted(((b, c, t) for (b, (c, t)) in self.buckets.items()),
+                      key=lambda x: -math.inf if x[0] is None else x[0])
@@ -1,96 +1,1652 @@
+import contextlib
+import hashlib
 import itertools
 import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import uuid
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
 
 import duckdb
+import pyarrow as pa
+import pysam
 
-from pigeon.cramstats_dir import SEQ_SCHEMAS, RemoteCramStatsDir
+from pigeon import SourceInfo, local_source_info
+from pigeon.alignments import OFFSET_SCHEMA, Location, fetch_records, iter_offsets
+from pigeon.compact import RUN_COLUMNS, RUN_KEYED_TABLES, RUNS_SCHEMA, WIDENED_COLUMNS, physical_name, physical_schema, view_sql
+from pigeon.compression import compression_of
+from pigeon.cramstats_dir import SEQ_SCHEMAS, CramStatsDir
 from pigeon.flowcell_dir import FC_SCHEMAS, FlowcellDir, TableNotPresent
+from pigeon.metrics import INGEST_METRICS_SCHEMA, IngestMetric, IngestTimer
+from pigeon.pore_activity import STATES_SCHEMA, STATES_TABLE, unpivot_sql, wide_view_sql
+from pigeon.query import DEFAULT_BATCH_SIZE
+from pigeon.rollups import ROLLUPS, rollups_of
+from pigeon.s3_config import S3Config
+from pigeon.sketches import METRICS, Sketch
+from pigeon.samples import DEFAULT_SAMPLE_SIZE, SAMPLES, Sample, sample_schema, samples_of
+from pigeon.schema import quote_path
 
 log = logging.getLogger(__name__)
 
+# Tables maintained by the store itself rather than loaded from source files
+
+STORE_SCHEMAS = {
+    'load_manifest': [
+        ('source', 'VARCHAR', 'YES', None, None, None),
+        ('etag', 'VARCHAR', 'YES', None, None, None),
+        ('size', 'BIGINT', 'YES', None, None, None),
+        ('table_name', 'VARCHAR', 'YES', None, None, None),
+        ('run_id', 'VARCHAR', 'YES', None, None, None),
+        ('rows', 'BIGINT', 'YES', None, None, None),
+        ('loaded_at', 'TIMESTAMP', 'YES', None, None, None)
+    ],
+    'store_settings': [
+        ('name', 'VARCHAR', 'YES', None, None, None),
+        ('value', 'VARCHAR', 'YES', None, None, None)
+    ],
+    # Location of each mapped record of the CRAM and BAM files indexed by the store
+    'alignment_index': [
+        ('source', 'VARCHAR', 'YES', None, None, None),
+        ('read_id', 'VARCHAR', 'YES', None, None, None),
+        ('file_offset', 'BIGINT', 'YES', None, None, None),
+        ('ref', 'VARCHAR', 'YES', None, None, None),
+        ('rstart', 'BIGINT', 'YES', None, None, None)
+    ],
+    # Timings of each stage of loading each source
+    'ingest_metrics': INGEST_METRICS_SCHEMA,
+    # Parquet files of the tables kept in the lake, recorded in the transaction writing them
+    'lake_files': [
+        ('table_name', 'VARCHAR', 'YES', None, None, None),
+        ('path', 'VARCHAR', 'YES', None, None, None)
+    ],
+    # Lake files read by each snapshot published, which are kept after the store replaces them
+    'lake_snapshots': [
+        ('snapshot', 'VARCHAR', 'YES', None, None, None),
+        ('version', 'VARCHAR', 'YES', None, None, None),
+        ('published_at', 'TIMESTAMP', 'YES', None, None, None),
+        ('path', 'VARCHAR', 'YES', None, None, None)
+    ],
+    # How much of each growing source file tail_flowcell has loaded
+    'tail_offsets': [
+        ('source', 'VARCHAR', 'YES', None, None, None),
+        ('table_name', 'VARCHAR', 'YES', None, None, None),
+        ('run_id', 'VARCHAR', 'YES', None, None, None),
+        ('experiment_id', 'VARCHAR', 'YES', None, None, None),
+        ('bytes_read', 'BIGINT', 'YES', None, None, None),
+        ('header', 'VARCHAR', 'YES', None, None, None),
+        ('rows', 'BIGINT', 'YES', None, None, None),
+        ('updated_at', 'TIMESTAMP', 'YES', None, None, None)
+    ]
+}
+
+# Tables of a flowcell which MinKNOW appends to while the run is in progress
+TAILED_TABLES = ['sequencing_summary', 'throughput', 'pore_activity']
+
+# Column identifying the run of each flowcell table
+RUN_ID_COLUMNS = {table_name: 'run_id' for table_name in FC_SCHEMAS}
+RUN_ID_COLUMNS['final_summary'] = 'acquisition_run_id'
+
+# Tables stored as hive-partitioned parquet datasets when the store has a lake path
+LAKE_PARTITIONS = {
+    'sequencing_summary': ['experiment_id', 'run_id'],
+    'cramstats': ['model'],
+}
+
+# Columns by which compaction orders the rows of a table, so that zone maps can skip
+# row groups of queries filtering on them
+CLUSTER_COLUMNS = {
+    'sequencing_summary': ['run_id', 'start_time'],
+}
+
+# Side table locating each read in the clustered sequencing_summary table.  It is
+# sorted by read_id on compaction, and has an ART index on read_id.
+READ_INDEX_SCHEMA = [
+    ('read_id', 'VARCHAR', 'YES', None, None, None),
+    ('run_id', 'VARCHAR', 'YES', None, None, None),
+    ('start_time', 'DOUBLE', 'YES', None, None, None)
+]
+
+# Read ids looked up in read_index or alignment_index per query.  duckdb probes the
+# index for constant lists up to its index_scan_max_count, rather than scanning the table.
+READ_LOOKUP_BATCH_SIZE = 1000
+
+# Partition value of the empty file which lets a view bind before any rows are written
+EMPTY_PARTITION = '__empty__'
+
+
+class ResourceProfile(NamedTuple):
+    """
+    Resources duckdb may use while loading.  Fields left as None keep duckdb's defaults.
+
+    """
+    #: e.g. '2GB'.  Operators and temporary tables spill to temp_directory beyond it.
+    memory_limit: Optional[str] = None
+    threads: Optional[int] = None
+    #: Directory for spilled data, by default next to the database
+    temp_directory: Optional[str] = None
+    #: False lets duckdb reorder rows, so large inserts and copies stream with less memory
+    preserve_insertion_order: Optional[bool] = None
+    #: Rows of a source processed at a time when updating rollups, samples and the lake
+    chunk_rows: int = 1_000_000
+    #: e.g. '16MB'.  duckdb's allocator keeps memory it frees beyond memory_limit, up to
+    #: 128MB per task and 512MB freed at once by default, unless given a lower threshold.
+    allocator_flush_threshold: Optional[str] = None
+
+    def config(self) -> Dict[str, object]:
+        """The duckdb configuration options of the profile"""
+        options = {'memory_limit': self.memory_limit, 'threads': self.threads,
+                   'temp_directory': self.temp_directory,
+                   'preserve_insertion_order': self.preserve_insertion_order,
+                   'allocator_flush_threshold': self.allocator_flush_threshold,
+                   'allocator_bulk_deallocation_flush_threshold': self.allocator_flush_threshold}
+        return {name: value for (name, value) in options.items() if value is not None}
+
+
+class TailResult(NamedTuple):
+    #: Rows appended to each table
+    rows: Dict[str, int]
+    #: Whether the run has completed and all of it is loaded
+    complete: bool
+
+
+class _TailState(NamedTuple):
+    run_id: str
+    experiment_id: str
+    bytes_read: int
+    header: str
+    rows: int
+
+
+class _FlowcellLoad(NamedTuple):
+    run_id: str
+    experiment_id: str
+    #: Relation or arrow table per table, or None for a table to be opened when inserted
+    tables: Dict[str, object]
+    sources: Dict[str, Optional[SourceInfo]]
+    timer: IngestTimer
+    flowcell_dir: FlowcellDir
+
+
 class Store:
     """
     A store is your one-stop-shop for querying signal, reads and alignments.
 
     """
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, lake_path: Optional[str]=None, compact_schema: bool=False,
+                 profile_ingest: bool=False, read_only: bool=False, sample_size: Optional[int]=None,
+                 resources: Optional[ResourceProfile]=None, s3_config: Optional[S3Config]=None):
         """
         :param path: path to underlying duckdb database
-        :param boto_session: Session to use for connecting to S3
+        :param lake_path: directory in which to keep the tables in LAKE_PARTITIONS as
+            zstd-compressed, hive-partitioned parquet datasets.  They are queried through
+            views with the usual table names.  The path is recorded in the database so
+            it only needs to be given when the lake is first created.
+        :param compact_schema: store tables with the narrower types of pigeon.compact,
+            migrating an existing store.  Once migrated a store stays compact.
+        :param profile_ingest: keep duckdb's query profile of reading each source table
+            in ingest_metrics
+        :param read_only: open the database, typically a snapshot written by publish,
+            for querying only.  Any number of processes can read it.
+        :param sample_size: rows per stratum of the sample tables of pigeon.samples.
+            The size is recorded in the database and the samples are rebuilt if it changes.
+        :param resources: limits on the memory, threads and spill directory of duckdb.
+            Sources are then staged in temporary tables which spill to disk and are
+            processed ``resources.chunk_rows`` at a time, so the memory used to load a
+            source doesn't grow with its size.
+        :param s3_config: endpoint, credentials and connection settings with which
+            duckdb reads s3:// paths, usually that of the flowcell directories loaded
 
         """
-        self._conn = duckdb.connect(path)
+        self._connect(path, read_only, resources, s3_config, profile_ingest)
+        if read_only:
+            self.lake_path = self._get_setting('lake_path')
+            self.compact_schema = self._get_setting('schema') == 'compact'
+            self.sample_size = int(self._get_setting('sample_size') or DEFAULT_SAMPLE_SIZE)
+            return
+
         if not self._has_schema():
             self._init_schema()
+        self._init_store_schema()
+
+        stored_lake_path = self._get_setting('lake_path')
+        if lake_path is not None:
+            lake_path = os.path.abspath(lake_path)
+            if stored_lake_path is not None and stored_lake_path != lake_path:
+                raise ValueError(f'Store {path} already keeps its lake at {stored_lake_path}')
+        else:
+            lake_path = stored_lake_path
+
+        self.lake_path = lake_path
+        self.compact_schema = compact_schema or self._get_setting('schema') == 'compact'
+        if self.compact_schema:
+            self._init_compact_schema()
+        self._init_pore_activity()
+        if lake_path is not None:
+            self._init_lake()
+        # Rollups may look runs up in the read index
+        self._init_read_index()
+        self._init_rollups()
+        self._init_samples(sample_size)
 
     def close(self):
         self._conn.close()
 
+    def publish(self, path: str, keep: int=2) -> None:
+        """
+        Publish a snapshot of the store to path for readers such as dashboards.
+
+        The database is checkpointed, copied next to path and renamed over it.  Readers
+        connecting to path see either the previous snapshot or the new one, and those
+        already connected keep reading the previous one until they reconnect.
+
+        Tables kept in the lake are not copied.  The views of a snapshot read the files
+        the store had when it was published, and files the store replaces afterwards
+        are kept until they are no longer read by any of the latest snapshots of path.
+
+        :param keep: number of the latest snapshots of path whose lake files are kept,
+            by default the new one and the one readers may still be connected to
+
+        """
+        path = os.path.abspath(path)
+        if path == os.path.abspath(self.path):
+            raise ValueError(f'Cannot publish store {self.path} over itself')
+
+        if self.lake_path is not None:
+            with self._transaction():
+                self._conn.execute('insert into lake_snapshots select ?, ?, now(), path from lake_files',
+                                   [path, uuid.uuid4().hex])
+        self._conn.execute('checkpoint')
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            shutil.copyfile(self.path, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            _remove_files([tmp_path])
+        log.info(f'Published {self.path} to {path}')
+
+        if self.lake_path is not None:
+            with self._transaction():
+                self._conn.execute("""
+                    delete from lake_snapshots
+                    where snapshot = ? and version not in (
+                        select version from lake_snapshots where snapshot = ?
+                        group by version order by max(published_at) desc limit ?)
+                    """, [path, path, keep])
+            self._remove_unreferenced_files()
+
+    def add_ingest_hook(self, hook: Callable[[List[IngestMetric]], None]) -> None:
+        """
+        Call hook with the metrics of each load of a flowcell or cram.stats file,
+        once they are stored in ingest_metrics.  Exceptions raised by hooks are logged.
+
+        """
+        self._ingest_hooks.append(hook)
+
+    def get_reads(self, read_ids: Iterable[str]) -> pa.Table:
+        """
+        Return the sequencing_summary rows of reads.  Reads which aren't in the store
+        are ignored.
+
+        """
+        located = {}
+        for (read_id, run_id, start_time) in self._locate_reads(list(read_ids)):
+            located.setdefault(run_id, []).append((start_time, read_id))
+
+        # Filtering each run on constants lets zone maps or partitions skip the rest of the table.
+        # Results are fetched through relations, as only they have to_arrow_table in all
+        # versions of duckdb
+        tables = [self._conn.sql("""
+            select * from sequencing_summary
+            where run_id = ? and start_time between ? and ? and read_id in (select unnest(?))
+            """, params=[run_id, min(reads)[0], max(reads)[0], [x[1] for x in reads]]).to_arrow_table()
+            for (run_id, reads) in located.items()]
+        if not tables:
+            return self._conn.sql('select * from sequencing_summary limit 0').to_arrow_table()
+
+        return pa.concat_tables(tables)
+
+    def reads_in_window(self, run_id: str, t0: float, t1: float) -> pa.Table:
+        """
+        Return the sequencing_summary rows of a run's reads starting in [t0, t1), ordered by start_time.
+
+        :param t0: start of the window in seconds since the start of the run
+        :param t1: end of the window in seconds since the start of the run
+
+        """
+        return self._conn.sql("""
+            select * from sequencing_summary
+            where run_id = ? and start_time >= ? and start_time < ?
+            order by start_time
+            """, params=[run_id, t0, t1]).to_arrow_table()
+
+    def sketch(self, metric: str, run_ids: Optional[Iterable[str]]=None,
+               experiment_ids: Optional[Iterable[str]]=None, passes_filtering: Optional[bool]=None,
+               model: Optional[str]=None) -> Sketch:
+        """
+        Merge the quantile sketches of a metric across a selection of runs.
+
+        :param metric: one of pigeon.sketches.METRICS
+        :param run_ids: runs to include, or all if None
+        :param experiment_ids: only include runs of these experiments
+        :param passes_filtering: only include passed or failed reads
+        :param model: only include alignments of this basecalling model
+
+        """
+        rows = self._sketch_rows(metric, False, run_ids, experiment_ids, passes_filtering, model)
+        return Sketch.from_rows(rows)
+
+    def run_sketches(self, metric: str, run_ids: Optional[Iterable[str]]=None,
+                     experiment_ids: Optional[Iterable[str]]=None, passes_filtering: Optional[bool]=None,
+                     model: Optional[str]=None) -> Dict[str, Sketch]:
+        """
+        Return the quantile sketch of a metric of each run, taking the same arguments as sketch.
+
+        """
+        rows = self._sketch_rows(metric, True, run_ids, experiment_ids, passes_filtering, model)
+        return {run_id: Sketch.from_rows(x[1:] for x in group)
+                for run_id, group in itertools.groupby(rows, key=lambda x: x[0])}
+
+    def query(self, sql: str, params: Optional[list]=None, batch_size: int=DEFAULT_BATCH_SIZE) -> pa.RecordBatchReader:
+        """
+        Run a query, streaming its result in batches of at most batch_size rows.
+
+        The query runs on its own cursor, so the result can be consumed while the store
+        is used for other queries.  See pigeon.query for reading batches as numpy arrays.
+
+        """
+        cursor = self._conn.cursor()
+        try:
+            result = cursor.execute(sql, params or [])
+            # to_arrow_reader replaced fetch_record_batch in later versions of duckdb
+            reader = getattr(result, 'to_arrow_reader', result.fetch_record_batch)(batch_size)
+        except Exception:
+            cursor.close()
+            raise
+
+        def batches():
+            try:
+                yield from reader
+            finally:
+                cursor.close()
+
+        return pa.RecordBatchReader.from_batches(reader.schema, batches())
+
+    def run_reads(self, run_id: str, columns: Optional[List[str]]=None,
+                  batch_size: int=DEFAULT_BATCH_SIZE, ordered: bool=False) -> pa.RecordBatchReader:
+        """
+        Stream the sequencing_summary rows of a run.
+
+        :param columns: columns to return, or all if None
+        :param ordered: order the rows by start_time.  Otherwise they are streamed in
+            storage order, which avoids sorting the run before the first batch.
+
+        """
+        select = self._select_columns('sequencing_summary', columns)
+        order = ' order by start_time' if ordered else ''
+        return self.query(f'select {select} from sequencing_summary where run_id = ?{order}', [run_id], batch_size)
+
+    def run_alignments(self, run_id: str, model: Optional[str]=None, columns: Optional[List[str]]=None,
+                       batch_size: int=DEFAULT_BATCH_SIZE) -> pa.RecordBatchReader:
+        """
+        Stream the cramstats rows of the reads of a run.
+
+        :param model: only return alignments of this basecalling model
+        :param columns: columns to return, or all if None
+
+        """
+        select = self._select_columns('cramstats', columns)
+        return self.query(f"""
+            select {select} from cramstats
+            where name in (select read_id from read_index where run_id = ?) and (? is null or model = ?)
+            """, [run_id, model, model], batch_size)
+
+    def index_alignments(self, path: str, reference_filename: Optional[str]=None, force: bool=False) -> None:
+        """
+        Record the location of each mapped record of a CRAM or BAM file, replacing any
+        previous index of the file, so that fetch_alignments can retrieve them.
+
+        :param path: path of a CRAM or BAM file with an index
+        :param reference_filename: reference FASTA for decoding CRAM, if not found through the header
+        :param force: index the file even if it is unchanged since it was last indexed
+
+        """
+        source = local_source_info(os.path.abspath(path))
+        if not force and self._loaded_etags([source], self._conn).get(source.path) == source.etag:
+            log.info(f'Skipping unchanged alignments {source.path}')
+            return
+
+        log.info(f'Indexing alignments {source.path}')
+        reader = pa.RecordBatchReader.from_batches(OFFSET_SCHEMA, iter_offsets(source.path, reference_filename))
+        with self._transaction():
+            self._conn.execute('delete from alignment_index where source = ?', [source.path])
+            rows = self._conn.execute('insert into alignment_index by name (select ? as source, * from reader)',
+                                      [source.path]).fetchone()[0]
+            self._record_source(source, 'alignment_index', None, rows)
+
+    def fetch_alignments(self, read_ids: Iterable[str],
+                         reference_filename: Optional[str]=None) -> Iterator[pysam.AlignedSegment]:
+        """
+        Yield the alignment records of reads from the files indexed by index_alignments.
+
+        Records are read in file order, seeking directly to each one or, for CRAM, to
+        each container holding them.
+
+        :param reference_filename: reference FASTA for decoding CRAM, if not found through the header
+
+        """
+        rows = self._select_reads('select source, read_id, file_offset, ref, rstart from alignment_index',
+                                  list(read_ids))
+
+        for source, group in itertools.groupby(sorted(rows, key=lambda x: x[0]), key=lambda x: x[0]):
+            yield from fetch_records(source, [Location(*x[1:]) for x in group], reference_filename)
+
+    def compact(self) -> None:
+        """
+        Rewrite sequencing_summary ordered by CLUSTER_COLUMNS and the read index ordered
+        by read_id.
+
+        Queries on a run's time window or on read ids can then skip most of the table.
+        Rows inserted afterwards are appended in arrival order until the next compaction.
+
+        """
+        order = ', '.join(CLUSTER_COLUMNS['sequencing_summary'])
+        with self._transaction():
+            if self._is_lake_table('sequencing_summary'):
+                # Runs are written to the lake already sorted so only runs split across
+                # several files need rewriting
+                runs = self._conn.execute(f"""
+                    select run_id, list(distinct filename)
+                    from {self._lake_scan('sequencing_summary', filename=True)}
+                    group by run_id
+                    having count(distinct filename) > 1
+                    """).fetchall()
+                for run_id, files in runs:
+                    log.info(f'Compacting {len(files)} files of {run_id}')
+                    select = f"select * from {self._lake_scan('sequencing_summary', files=files)} order by {order}"
+                    self._write_lake('sequencing_summary', select, [], uuid.uuid4().hex)
+                    self._drop_lake_files('sequencing_summary', files)
+            else:
+                log.info('Compacting sequencing_summary')
+                if self._is_run_keyed('sequencing_summary'):
+                    order = order.replace('run_id', 'run_key')
+                self._rewrite_table(self._physical_name('sequencing_summary'), order)
+
+            log.info('Compacting read_index')
+            self._rewrite_table('read_index', 'read_id')
+            self._conn.execute('create index read_index_read_id on read_index (read_id)')
+
+        # Release the space of the old tables
+        self._conn.execute('checkpoint')
+
+    def rebuild_rollups(self) -> None:
+        """
+        Recreate the rollup tables from the tables they aggregate.
+
+        Rollups are kept up to date as rows are inserted so this is only needed if
+        their definitions change or the tables were modified outside the store.
+
+        """
+        self._rebuild_rollups(list(ROLLUPS))
+
+    def rebuild_samples(self) -> None:
+        """
+        Recreate the sample tables from the tables they sample.
+
+        """
+        self._rebuild_samples(list(SAMPLES))
+
     # --------
 
+    def _connect(self, path: str, read_only: bool, resources: Optional[ResourceProfile],
+                 s3_config: Optional[S3Config], profile_ingest: bool=False) -> None:
+        """Open the database and set the attributes every kind of store has"""
+        self.path = path
+        self.resources = resources
+        self._conn = duckdb.connect(path, read_only=read_only, config=resources.config() if resources else {})
+        self.s3_config = s3_config
+        if s3_config is not None:
+            s3_config.configure(self._conn)
+        self.profile_ingest = profile_ingest
+        self._ingest_hooks: List[Callable[[List[IngestMetric]], None]] = []
+        # Query profile of the last source read by _insert
+        self._last_profile = None
+        # Files written and made obsolete by the current transaction
+        self._lake_files = None
+
     def _has_schema(self):
         tables = [x[0] for x in self._conn.sql('show tables').fetchall()]
         return 'final_summary' in tables
 
     def _init_schema(self):
         for table_name, schema in itertools.chain(FC_SCHEMAS.items(), SEQ_SCHEMAS.items()):
-            col_expr = []
-            for col in schema:
-                # TODO : Add nullable option
-                col_expr.append(f'{col[0]} {col[1]}')
-            col_expr_str = ', '.join(col_expr)
-            sql = f'create or replace table {table_name} ({col_expr_str})'
-            log.info(f'Creating table {table_name}')
-            log.debug(sql)
-            self._conn.sql(sql)
-
-    def insert_flowcell(self, flowcell_dir: FlowcellDir) -> None:
+            # A view created by _init_pore_activity
+            if table_name == 'pore_activity':
+                continue
+            self._create_table(table_name, schema, 'create or replace table')
+
+    def _init_store_schema(self):
+        # Stores created before these tables existed get them on first open
+        for table_name, schema in STORE_SCHEMAS.items():
+            self._create_table(table_name, schema, 'create table if not exists')
+        self._conn.execute('create index if not exists alignment_index_read_id on alignment_index (read_id)')
+
+    def _init_pore_activity(self):
+        tables = {x[0] for x in self._conn.sql('select table_name from duckdb_tables()').fetchall()}
+        schema = physical_schema(STATES_TABLE, STATES_SCHEMA) if self.compact_schema else STATES_SCHEMA
+        with self._transaction():
+            self._create_table(STATES_TABLE, schema, 'create table if not exists')
+            if 'pore_activity' in tables:
+                # Stores created before pore_activity was kept in long form
+                log.info(f'Moving pore_activity to {STATES_TABLE}')
+                self._conn.execute(f"insert into {STATES_TABLE} by name ({unpivot_sql('pore_activity')})")
+                self._conn.execute('drop table pore_activity')
+            schema = self._schema('pore_activity')
+            if self.compact_schema:
+                schema = physical_schema('pore_activity', schema)
+            self._conn.execute(f'create or replace view pore_activity as {wide_view_sql(schema)}')
+
+    def _init_lake(self):
+        if self._get_setting('lake_path') is None:
+            self._set_setting('lake_path', self.lake_path)
+            self._set_setting('lake_files', 'recorded')
+        elif self._get_setting('lake_files') is None:
+            # Lakes created before their files were recorded keep every file in them
+            with self._transaction():
+                for table_name in LAKE_PARTITIONS:
+                    self._conn.execute('insert into lake_files select ?, file from glob(?) where file not like ?',
+                                       [table_name, self._lake_glob(table_name), f'%={EMPTY_PARTITION}%'])
+                self._set_setting('lake_files', 'recorded')
+        # Files written by transactions which never committed, or made obsolete by ones
+        # which committed before they were removed
+        self._remove_unreferenced_files()
+
+        tables = {x[0] for x in self._conn.sql('select table_name from duckdb_tables()').fetchall()}
+        for table_name, partitions in LAKE_PARTITIONS.items():
+            path = os.path.join(self.lake_path, table_name)
+            empty_path = os.path.join(path, *(f'{col}={EMPTY_PARTITION}' for col in partitions))
+            if not os.path.exists(empty_path):
+                os.makedirs(empty_path)
+                columns = ', '.join(f'null::{col[1]} as {col[0]}' for col in self._schema(table_name)
+                                    if col[0] not in partitions)
+                self._conn.execute(f"copy (select {columns} limit 0) to "
+                                   f"{quote_path(os.path.join(empty_path, 'empty.parquet'))} "
+                                   f"(format parquet, compression zstd)")
+
+            physical = physical_name(table_name) if self.compact_schema else table_name
+            if physical in tables:
+                # Move rows loaded before the store had a lake
+                log.info(f'Moving {table_name} to {path}')
+                with self._transaction():
+                    # The table is dropped first as writing to the lake replaces its view
+                    self._conn.execute(f'create temp table _lake_migration as select * from {table_name}')
+                    if physical != table_name:
+                        self._conn.execute(f'drop view {table_name}')
+                    self._conn.execute(f'drop table {physical}')
+                    self._write_lake(table_name, 'select * from _lake_migration', [], uuid.uuid4().hex)
+                    self._conn.execute('drop table _lake_migration')
+
+            self._create_lake_view(table_name)
+
+    def _init_rollups(self):
+        tables = {x[0] for x in self._conn.sql('select table_name from duckdb_tables()').fetchall()}
+        missing = [name for name in ROLLUPS if name not in tables]
+        if missing:
+            # Also builds rollups of stores created before they existed
+            self._rebuild_rollups(missing)
+
+    def _rebuild_rollups(self, names: List[str]) -> None:
+        with self._transaction():
+            for name in names:
+                rollup = ROLLUPS[name]
+                log.info(f'Building {name} from {rollup.source}')
+                self._create_table(name, rollup.schema, 'create or replace table')
+                self._conn.execute(f'insert into {name} {rollup.select.format(rows=rollup.source)}')
+
+    def _update_rollups(self, table_name: str, rows: str, params: list, sign: int=1) -> None:
+        """
+        Merge rows added to or removed from a table into its rollups, within the current
+        transaction.
+
+        :param rows: table or parenthesised query of the rows, with all columns of the table
+        :param sign: 1 if the rows were added or -1 if they were removed
+
+        """
+        for name, rollup in rollups_of(table_name).items():
+            if sign < 0 and not rollup.removable:
+                # The caller rebuilds the groups of these rollups with _rebuild_rollup_groups
+                assert rollup.by_read_index, f'Rows cannot be removed from {name}'
+                continue
+
+            keys = ', '.join(rollup.keys)
+            match = ' and '.join(f'r.{k} is not distinct from d.{k}' for k in rollup.keys)
+            affected = f'exists (select 1 from _rollup_delta d where {match})'
+            merged = ', '.join(f'{rollup.merge.get(v, "sum")}({v}) as {v}' for v in rollup.values)
+            signed = ', '.join(f'{sign} * {v} as {v}' for v in rollup.values)
+            # Rows whose values have all been removed.  The aggregate is written out as duckdb
+            # 1.1 doesn't resolve the aliases of the select list in having
+            first = rollup.values[0]
+            having = f'having {rollup.merge.get(first, "sum")}({first}) != 0' if sign < 0 else ''
+
+            self._conn.execute(f'create or replace temp table _rollup_delta as {rollup.select.format(rows=rows)}', params)
+            self._conn.execute(f"""
+                create or replace temp table _rollup_merged as
+                select {keys}, {merged}
+                from (select * from {name} r where {affected}
+                      union all by name
+                      select {keys}, {signed} from _rollup_delta)
+                group by {keys}
+                {having}
+                """)
+            self._conn.execute(f'delete from {name} r where {affected}')
+            self._conn.execute(f'insert into {name} by name (select * from _rollup_merged)')
+
+        self._conn.execute('drop table if exists _rollup_delta')
+        self._conn.execute('drop table if exists _rollup_merged')
+
+    def _rebuild_rollup_groups(self, table_name: str, column: str, value: str, rows: str, params: list) -> None:
+        """
+        Rebuild the groups of the rollups of a table which can't have rows removed, after
+        rows were removed from it.
+
+        :param column: key column of the groups to rebuild
+        :param value: value of column in the groups to rebuild
+        :param rows: table or parenthesised query of all rows of the groups
+
+        """
+        for name, rollup in rollups_of(table_name).items():
+            if rollup.removable:
+                continue
+            self._conn.execute(f'delete from {name} where {column} = ?', [value])
+            self._conn.execute(f'insert into {name} {rollup.select.format(rows=rows)}', params)
+
+    def _init_samples(self, sample_size: Optional[int]) -> None:
+        stored = self._get_setting('sample_size')
+        self.sample_size = sample_size or int(stored or DEFAULT_SAMPLE_SIZE)
+
+        tables = {x[0] for x in self._conn.sql('select table_name from duckdb_tables()').fetchall()}
+        if stored is not None and int(stored) != self.sample_size:
+            log.info(f'Sample size changed from {stored} to {self.sample_size}')
+            self._rebuild_samples(list(SAMPLES))
+        elif missing := [name for name in SAMPLES if name not in tables]:
+            self._rebuild_samples(missing)
+        if stored != str(self.sample_size):
+            self._set_setting('sample_size', str(self.sample_size))
+
+    def _rebuild_samples(self, names: List[str]) -> None:
+        with self._transaction():
+            for name in names:
+                sample = SAMPLES[name]
+                log.info(f'Building {name} from {sample.source}')
+                self._create_table(name, sample_schema(self._schema(sample.source)), 'create or replace table')
+                self._conn.execute(f'insert into {name} by name ({self._sample_select(sample, sample.source)})')
+
+    def _sample_select(self, sample: Sample, rows: str) -> str:
+        """Query sampling every stratum of rows, a table or parenthesised query"""
+        key = sample.key_sql()
+        return f"""
+            select * exclude (_rank), least(stratum_rows, {self.sample_size}) / stratum_rows as sample_fraction
+            from (select *, {key} as sample_key,
+                         row_number() over (partition by {sample.stratum} order by {key}) as _rank,
+                         count(*) over (partition by {sample.stratum}) as stratum_rows
+                  from {rows})
+            where _rank <= {self.sample_size}
+            """
+
+    def _update_samples(self, table_name: str, rows: str) -> None:
+        """
+        Merge rows inserted into a table into its samples, within the current transaction.
+
+        """
+        for name, sample in samples_of(table_name).items():
+            stratum = sample.stratum
+            affected = f'exists (select 1 from _sample_delta d where r.{stratum} is not distinct from d.{stratum})'
+            self._conn.execute(f"""
+                create or replace temp table _sample_delta as
+                select d.{stratum}, d.rows + coalesce((select any_value(r.stratum_rows) from {name} r
+                                                       where r.{stratum} is not distinct from d.{stratum}), 0) as stratum_rows
+                from (select {stratum}, count(*) as rows from {rows} group by {stratum}) d
+                """)
+            # The new bottom-k of each stratum is among its sampled and inserted rows
+            self._conn.execute(f"""
+                create or replace temp table _sample_merged as
+                select c.* exclude (_rank), d.stratum_rows,
+                       least(d.stratum_rows, {self.sample_size}) / d.stratum_rows as sample_fraction
+                from (select *, row_number() over (partition by {stratum} order by sample_key) as _rank
+                      from (select * exclude (stratum_rows, sample_fraction) from {name} r where {affected}
+                            union all by name
+                            select *, {sample.key_sql()} as sample_key from {rows})) c
+                join _sample_delta d on c.{stratum} is not distinct from d.{stratum}
+                where _rank <= {self.sample_size}
+                """)
+            self._conn.execute(f'delete from {name} r where {affected}')
+            self._conn.execute(f'insert into {name} by name (select * from _sample_merged)')
+
+        self._conn.execute('drop table if exists _sample_delta')
+        self._conn.execute('drop table if exists _sample_merged')
+
+    def _resample(self, table_name: str, stratum: str, rows: str, params: list) -> None:
+        """
+        Replace the samples of one stratum of a table after rows were removed from it.
+
+        :param rows: table or parenthesised query of all rows of the stratum
+
+        """
+        for name, sample in samples_of(table_name).items():
+            self._conn.execute(f'delete from {name} where {sample.stratum} = ?', [stratum])
+            self._conn.execute(f'insert into {name} by name ({self._sample_select(sample, rows)})', params)
+
+    def _init_read_index(self):
+        tables = {x[0] for x in self._conn.sql('select table_name from duckdb_tables()').fetchall()}
+        if 'read_index' not in tables:
+            self._create_table('read_index', READ_INDEX_SCHEMA, 'create table')
+            self._conn.execute('insert into read_index select read_id, run_id, start_time from sequencing_summary order by read_id')
+        self._conn.execute('create index if not exists read_index_read_id on read_index (read_id)')
+
+    def _init_compact_schema(self):
+        if self._get_setting('schema') == 'compact':
+            # Stores compacted when these columns were ENUMs.  Tables kept in a lake are views.
+            for table_name, columns in WIDENED_COLUMNS.items():
+                for column in columns:
+                    type_ = self._conn.execute(
+                        'select data_type from duckdb_columns() where table_name = ? and column_name = ?',
+                        [physical_name(table_name), column]).fetchone()
+                    if type_ and type_[0] != 'VARCHAR':
+                        log.info(f'Widening {column} of {table_name} to VARCHAR')
+                        self._conn.execute(f'alter table {physical_name(table_name)} alter {column} type VARCHAR')
+            return
+
+        log.info('Migrating to the compact schema')
+        tables = {x[0] for x in self._conn.sql('select table_name from duckdb_tables()').fetchall()}
+        with self._transaction():
+            self._create_table('runs', RUNS_SCHEMA, 'create table if not exists')
+            for table_name, schema in itertools.chain(FC_SCHEMAS.items(), SEQ_SCHEMAS.items(),
+                                                      [(STATES_TABLE, STATES_SCHEMA)]):
+                # Tables kept in a lake, and pore_activity, are views
+                if table_name not in tables:
+                    continue
+                physical = physical_name(table_name)
+                self._create_table(f'_{physical}_compact', physical_schema(table_name, schema), 'create table')
+                self._insert_compact(table_name, table_name, f'_{physical}_compact')
+                self._conn.execute(f'drop table {table_name}')
+                self._conn.execute(f'alter table _{physical}_compact rename to {physical}')
+                if physical != table_name:
+                    self._conn.execute(f'create view {table_name} as {view_sql(table_name, schema)}')
+            self._set_setting('schema', 'compact')
+
+    def _physical_name(self, table_name: str) -> str:
+        """Name of the table holding the rows of a table stored in duckdb"""
+        if table_name == 'pore_activity':
+            return STATES_TABLE
+        return physical_name(table_name) if self.compact_schema else table_name
+
+    def _is_run_keyed(self, table_name: str) -> bool:
+        return self.compact_schema and table_name in RUN_KEYED_TABLES and not self._is_lake_table(table_name)
+
+    def _insert_compact(self, table_name: str, rows: str, target: str) -> int:
+        """
+        Insert rows with the columns of table_name into a compact physical table, adding
+        any new runs to the runs table.  Returns the number of rows inserted.
+
+        """
+        if table_name not in RUN_KEYED_TABLES:
+            return self._conn.execute(f'insert into {target} by name (select * from {rows})').fetchone()[0]
+
+        match = ' and '.join(f'r.{col} is not distinct from n.{col}' for col in RUN_COLUMNS)
+        columns = ', '.join(RUN_COLUMNS)
+        self._conn.execute(f"""
+            insert into runs
+            select (select coalesce(max(run_key), 0) from runs) + row_number() over () as run_key, {columns}
+            from (select distinct {columns} from {rows}) n
+            where not exists (select 1 from runs r where {match})
+            """)
+
+        return self._conn.execute(f"""
+            insert into {target} by name (
+                select r.run_key, n.* exclude ({columns})
+                from {rows} n join runs r on {match}
+            )
+            """).fetchone()[0]
+
+    def _locate_reads(self, read_ids: List[str]) -> List[Tuple[str, str, float]]:
+        """Return the (read_id, run_id, start_time) of those reads found in the read index"""
+        return self._select_reads('select read_id, run_id, start_time from read_index', read_ids)
+
+    def _select_reads(self, select: str, read_ids: List[str]) -> List[Tuple]:
+        """Return the rows of a select from a table indexed on read_id which have one of read_ids"""
+        rows = []
+        for i in range(0, len(read_ids), READ_LOOKUP_BATCH_SIZE):
+            batch = read_ids[i:i + READ_LOOKUP_BATCH_SIZE]
+            placeholders = ', '.join('?' for _ in batch)
+            rows += self._conn.execute(f'{select} where read_id in ({placeholders})', batch).fetchall()
+        return rows
+
+    def _rewrite_table(self, table_name: str, order: str) -> None:
+        """Replace a table with a copy ordered by an expression, within the current transaction"""
+        self._conn.execute(f'create table _{table_name}_sorted as select * from {table_name} order by {order}')
+        self._conn.execute(f'drop table {table_name}')
+        self._conn.execute(f'alter table _{table_name}_sorted rename to {table_name}')
+
+    def _sketch_rows(self, metric: str, by_run: bool, run_ids: Optional[Iterable[str]],
+                     experiment_ids: Optional[Iterable[str]], passes_filtering: Optional[bool],
+                     model: Optional[str]) -> List[Tuple]:
+        """Return the merged (bucket, count, total) rows of a metric's sketches, optionally preceded by run_id"""
+        if metric not in METRICS:
+            raise ValueError(f'No sketches of {metric}')
+        table_name = METRICS[metric]
+
+        conditions, params = ['metric = ?'], [metric]
+        if run_ids is not None:
+            conditions.append('run_id in (select unnest(?::VARCHAR[]))')
+            params.append(list(run_ids))
+        if experiment_ids is not None:
+            conditions.append('run_id in (select acquisition_run_id from final_summary '
+                              'where protocol_group_id in (select unnest(?::VARCHAR[])))')
+            params.append(list(experiment_ids))
+        for column, value in [('passes_filtering', passes_filtering), ('model', model)]:
+            if value is None:
+                continue
+            if column not in ROLLUPS[table_name].keys:
+                raise ValueError(f'Sketches of {metric} have no {column}')
+            conditions.append(f'{column} = ?')
+            params.append(value)
+
+        group = 'run_id, bucket' if by_run else 'bucket'
+        return self._conn.execute(f"""
+            select {group}, sum(count)::BIGINT, sum(total)
+            from {table_name}
+            where {' and '.join(conditions)}
+            group by {group}
+            order by {group}
+            """, params).fetchall()
+
+    def _select_columns(self, table_name: str, columns: Optional[List[str]]) -> str:
+        """Return the select list of columns of a table, checking they exist"""
+        if columns is None:
+            return '*'
+
+        names = [col[0] for col in self._schema(table_name)]
+        unknown = [x for x in columns if x not in names]
+        if unknown:
+            raise ValueError(f'No columns {unknown} in {table_name}')
+        return ', '.join(f'"{x}"' for x in columns)
+
+    def _schema(self, table_name):
+        return FC_SCHEMAS.get(table_name) or SEQ_SCHEMAS[table_name]
+
+    def _lake_scan(self, table_name: str, filename: bool=False, files: Optional[List[str]]=None) -> str:
+        """Return a read_parquet call over the given files of a lake table, or all its current files"""
+        if files is None:
+            files = [x[0] for x in self._conn.execute(
+                'select path from lake_files where table_name = ? order by path', [table_name]).fetchall()]
+            # The empty file lets the scan bind when the table has no rows
+            partitions = (f'{col}={EMPTY_PARTITION}' for col in LAKE_PARTITIONS[table_name])
+            files.insert(0, os.path.join(self.lake_path, table_name, *partitions, 'empty.parquet'))
+        path = '[' + ', '.join(quote_path(x) for x in files) + ']'
+        hive_types = ', '.join(f"'{col}': 'VARCHAR'" for col in LAKE_PARTITIONS[table_name])
+        return (f'read_parquet({path}, hive_partitioning=true, hive_types={{{hive_types}}}, '
+                f'filename={str(filename).lower()})')
+
+    def _lake_glob(self, table_name: str, pattern: str='*') -> str:
+        return os.path.join(self.lake_path, table_name, '**', f'{pattern}.parquet')
+
+    def _create_lake_view(self, table_name: str) -> None:
+        """(Re)create the view of a lake table over its current files"""
+        columns = ', '.join(col[0] for col in self._schema(table_name))
+        self._conn.execute(f'create or replace view {table_name} as select {columns} from {self._lake_scan(table_name)}')
+
+    def _get_setting(self, name: str) -> Optional[str]:
+        row = self._conn.execute('select value from store_settings where name = ?', [name]).fetchone()
+        return row[0] if row else None
+
+    def _set_setting(self, name: str, value: str) -> None:
+        self._conn.execute('delete from store_settings where name = ?', [name])
+        self._conn.execute('insert into store_settings values (?, ?)', [name, value])
+
+    def _create_table(self, table_name, schema, create_stmt):
+        col_expr = []
+        for col in schema:
+            # TODO : Add nullable option
+            col_expr.append(f'{col[0]} {col[1]}')
+        col_expr_str = ', '.join(col_expr)
+        sql = f'{create_stmt} {table_name} ({col_expr_str})'
+        log.info(f'Creating table {table_name}')
+        log.debug(sql)
+        self._conn.sql(sql)
+
+    def insert_flowcell(self, flowcell_dir: FlowcellDir, force: bool=False) -> None:
+        """
+        Insert or replace the tables of a flowcell in one transaction.
+
+        Source files recorded in the load manifest with the same ETag are skipped.
+        If any have changed, all rows of the run are replaced.
+
+        :param force: reload the flowcell even if its sources are unchanged
+
+        """
+        timer = IngestTimer(repr(flowcell_dir))
+        try:
+            load = self._flowcell_relations(flowcell_dir, self._conn, force, timer)
+            if load is not None:
+                self._write_flowcells([load])
+        finally:
+            flowcell_dir.release()
+            self._record_metrics([timer])
+
+    def insert_flowcells(self, flowcell_dirs: Iterable[FlowcellDir], workers: int=1,
+                         queue_size: Optional[int]=None, force: bool=False,
+                         commit_every: int=1) -> List[Tuple[FlowcellDir, Exception]]:
+        """
+        Insert many flowcells, optionally fetching and parsing them concurrently.
+
+        Each worker thread reads tables through its own cursor and materialises them
+        as arrow tables.  These are passed through a bounded queue to the calling
+        thread, which is the only one writing to the database.  A failure in one
+        flowcell is logged and does not abort the batch.
+
+        Each table file is scanned by its own ``read_csv``, which duckdb parallelises
+        within the file, rather than one multi-file scan per table: the columns of
+        sequencing_summary differ between MinKNOW versions, and a malformed file
+        must only fail its own flowcell.
+
+        :param flowcell_dirs: flowcells to insert
+        :param workers: number of concurrent reader threads
+        :param queue_size: maximum number of parsed flowcells waiting to be written.
+            Defaults to ``workers``.
+        :param force: reload flowcells even if their sources are unchanged
+        :param commit_every: number of flowcells to write per transaction.  If a
+            transaction fails its flowcells are retried one at a time.
+        :return: list of (flowcell_dir, exception) for flowcells which failed
+
+        """
+        failures = []
+        batch = []
+
+        for flowcell_dir, timer, load, error in self._prepare_flowcells(flowcell_dirs, workers, queue_size, force):
+            if load is not None:
+                batch.append((flowcell_dir, load))
+            else:
+                if error is not None:
+                    log.error(f'Failed to insert flowcell {flowcell_dir}: {error}')
+                    failures.append((flowcell_dir, error))
+                flowcell_dir.release()
+                self._record_metrics([timer])
+
+            if len(batch) >= commit_every:
+                failures.extend(self._write_batch(batch))
+                self._finish_batch(batch)
+                batch = []
+
+        failures.extend(self._write_batch(batch))
+        self._finish_batch(batch)
+
+        return failures
+
+    def insert_cramstats(self, cramstats_dir: CramStatsDir, force: bool=False) -> None:
+        """
+        Insert the alignment stats of a cram.stats file.
+
+        A file recorded in the load manifest with the same ETag is skipped.  A changed
+        file replaces the rows of the reads it contains.
+
+        :param force: reload the file even if it is unchanged
+
+        """
+        timer = IngestTimer(repr(cramstats_dir))
+        try:
+            self._insert_cramstats(cramstats_dir, force, timer)
+        finally:
+            cramstats_dir.release()
+            self._record_metrics([timer])
+
+    def tail_flowcell(self, flowcell_dir: FlowcellDir) -> TailResult:
+        """
+        Append the rows written to the tables of a live flowcell since they were last read.
+
+        The byte offset reached in each growing file is kept in tail_offsets, in the
+        same transaction as its rows, and only whole lines are loaded.  Once
+        final_summary appears the rest of each file is loaded with it, and the sources
+        are recorded in the load manifest as by insert_flowcell.
+
+        """
+        timer = IngestTimer(repr(flowcell_dir))
         try:
-            rel = flowcell_dir.make_table_relation('final_summary', self._conn)
+            return self._tail_flowcell(flowcell_dir, timer)
+        finally:
+            flowcell_dir.release()
+            self._record_metrics([timer])
+
+    def watch_flowcell(self, flowcell_dir: FlowcellDir, interval: float=60.0,
+                       stop: Optional[threading.Event]=None) -> bool:
+        """
+        Tail a flowcell every interval seconds until its run completes or stop is set.
+        A failed tick is logged and retried on the next.
+
+        :return: whether the run completed
+
+        """
+        stop = stop or threading.Event()
+        while True:
+            try:
+                result = self.tail_flowcell(flowcell_dir)
+                log.info(f'Tailed {flowcell_dir}: {result.rows}')
+                if result.complete:
+                    return True
+            except Exception as e:
+                log.error(f'Failed to tail flowcell {flowcell_dir}: {e}')
+            if stop.wait(interval):
+                return False
+
+    # --------
+
+    def _tail_flowcell(self, flowcell_dir: FlowcellDir, timer: IngestTimer) -> TailResult:
+        flowcell_dir.refresh()
+        with timer.stage('list'):
+            sources = {table_name: flowcell_dir.get_source_info(table_name) for table_name in FC_SCHEMAS}
+        present = [x for x in sources.values() if x]
+        loaded = self._loaded_etags(present, self._conn)
+        complete = sources['final_summary'] is not None
+        if complete and all(loaded.get(x.path) == x.etag for x in present):
+            return TailResult({}, True)
+        states = self._tail_states(present)
+
+        final_summary = None
+        if complete:
+            with timer.stage('open', 'final_summary', sources['final_summary'].size):
+                final_summary = flowcell_dir.make_table_relation('final_summary', self._conn).to_arrow_table()
+            row = final_summary.to_pylist()[0]
+            run_id, experiment_id = row['acquisition_run_id'], row['protocol_group_id']
+        elif states:
+            state = next(iter(states.values()))
+            run_id, experiment_id = state.run_id, state.experiment_id
+        else:
+            run_id, experiment_id = self._tail_run(flowcell_dir, sources['sequencing_summary'])
+            if run_id is None:
+                return TailResult({}, False)
+        timer.run_id = run_id
+
+        # A loaded file which changed without being tailed can't be appended to, so the
+        # run is deleted and its files read again from the start
+        reload = any(loaded.get(x.path) not in (None, x.etag) and x.path not in states for x in present)
+        if reload:
+            log.info(f'Reloading run {run_id} as its files changed since they were loaded')
+            loaded, states = {}, {}
+
+        # (source, state, header, start, rows data) per table, with data None to load a whole file
+        reads = {}
+        for table_name in TAILED_TABLES:
+            source = sources[table_name]
+            if source is None or loaded.get(source.path) == source.etag:
+                continue
+            state = states.get(source.path)
+            if state is None and complete:
+                # Files completed before they were tailed are loaded whole
+                reads[table_name] = (source, None, None, None, None)
+                continue
+            if compression_of(source.path):
+                log.warning(f'Cannot tail compressed file {source.path} until its run completes')
+                continue
+
+            start = state.bytes_read if state else 0
+            with timer.stage('fetch', table_name, max(source.size - start, 0)):
+                data = flowcell_dir.read_range(table_name, start, source.size)
+            header = state.header if state else None
+            if header is None:
+                newline = data.find(b'\n')
+                if newline < 0:
+                    continue
+                header, data, start = data[:newline + 1].decode(), data[newline + 1:], start + newline + 1
+            # Only whole lines until the run completes
+            end = len(data) if complete else data.rfind(b'\n') + 1
+            reads[table_name] = (source, state, header, start, data[:end])
+
+        rows = {}
+        with tempfile.TemporaryDirectory(prefix='pigeon-tail-') as tmp_dir, self._transaction([timer]):
+            if reload:
+                self._delete_run(run_id)
+            for table_name, (source, state, header, start, data) in reads.items():
+                columns = {'experiment_id': experiment_id, 'run_id': run_id} if table_name != 'sequencing_summary' else {}
+                with timer.stage('insert', table_name, source.size if data is None else len(data)) as stage:
+                    if data is None:
+                        rel = flowcell_dir.make_table_relation(table_name, self._conn)
+                    elif data:
+                        path = os.path.join(tmp_dir, f'{table_name}.txt')
+                        with open(path, 'wb') as f:
+                            f.write(header.encode() + data)
+                        rel = FlowcellDir._make_relation(table_name, path, self._conn)
+                    else:
+                        rel = None
+                    rows[table_name] = self._insert(table_name, rel, columns, uuid.uuid4().hex) if rel is not None else 0
+                    stage.rows = rows[table_name]
+                    stage.profile = self._last_profile if rel is not None else None
+                total = rows[table_name] + (state.rows if state else 0)
+                if data is not None:
+                    self._set_tail_state(source, table_name, _TailState(run_id, experiment_id, start + len(data),
+                                                                        header, total))
+                if complete:
+                    self._record_source(source, table_name, run_id, total)
+
+            if complete:
+                source = sources['final_summary']
+                with timer.stage('insert', 'final_summary', source.size) as stage:
+                    if loaded.get(source.path) is None:
+                        rows['final_summary'] = stage.rows = self._insert('final_summary', final_summary, {})
+                    self._record_source(source, 'final_summary', run_id, 1)
+
+        return TailResult(rows, complete)
+
+    def _tail_run(self, flowcell_dir: FlowcellDir, source: Optional[SourceInfo]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Return the run_id and experiment_id of a run without a final_summary from the
+        first row of its sequencing_summary, or None if none is written yet.
+
+        """
+        if source is None or compression_of(source.path):
+            return None, None
+
+        lines = flowcell_dir.read_range('sequencing_summary', 0, min(source.size, 1 << 16)).split(b'\n')
+        if len(lines) < 3:
+            return None, None
+
+        row = dict(zip(lines[0].decode().rstrip('\r').split('\t'), lines[1].decode().split('\t')))
+        return row['run_id'], row['experiment_id']
+
+    def _tail_states(self, sources: Iterable[SourceInfo]) -> Dict[str, _TailState]:
+        paths = [x.path for x in sources]
+        rows = self._conn.execute("""
+            select source, run_id, experiment_id, bytes_read, header, rows from tail_offsets
+            where source in (select unnest(?))
+            """, [paths]).fetchall()
+        return {row[0]: _TailState(*row[1:]) for row in rows}
+
+    def _set_tail_state(self, source: SourceInfo, table_name: str, state: _TailState) -> None:
+        self._conn.execute('delete from tail_offsets where source = ?', [source.path])
+        self._conn.execute('insert into tail_offsets values (?, ?, ?, ?, ?, ?, ?, now())',
+                           [source.path, table_name, *state])
+
+    def _insert_cramstats(self, cramstats_dir: CramStatsDir, force: bool, timer: IngestTimer) -> None:
+        with timer.stage('list', 'cramstats'):
+            model = cramstats_dir.get_model()
+            source = cramstats_dir.get_source_info()
+
+        loaded = self._loaded_etags([source], self._conn) if source else {}
+        if source and loaded.get(source.path) == source.etag and not force:
+            log.info(f'Skipping unchanged cramstats {cramstats_dir}')
+            return
+
+        log.info(f'Inserting cramstats for {model} {cramstats_dir}')
+        size = source.size if source else None
+        with timer.stage('open', 'cramstats', size):
+            rel = cramstats_dir.make_table_relation(self._conn)
+
+        with self._transaction([timer]), timer.stage('insert', 'cramstats', size) as stage:
+            replacing = source and source.path in loaded
+            if replacing:
+                log.info(f'Replacing changed cramstats {source.path}')
+            if self.lake_path is not None:
+                # Lake files of a source share a prefix so a changed source replaces them
+                if source:
+                    removed = self._remove_lake_files('cramstats', f'{_source_key(source)}-*')
+                    if removed:
+                        self._update_rollups('cramstats', self._lake_scan('cramstats', files=removed), [], -1)
+                    file_prefix = f'{_source_key(source)}-{uuid.uuid4().hex}'
+                else:
+                    file_prefix = uuid.uuid4().hex
+                rows = self._insert('cramstats', rel, {'model': model}, file_prefix)
+                current, current_params = f"(select * from {self._lake_scan('cramstats')} where model = ?)", [model]
+            elif replacing:
+                # cramstats has no run_id so replace by read name within the model
+                self._conn.execute('create or replace temp table _cramstats_staging as select ? as model, * from rel', [model])
+                replaced = 'cramstats where model = ? and name in (select name from _cramstats_staging)'
+                self._update_rollups('cramstats', f'(select * from {replaced})', [model], -1)
+                self._conn.execute(f'delete from {replaced}', [model])
+                rows = self._insert('cramstats', self._conn.table('_cramstats_staging'), {})
+                self._conn.execute('drop table _cramstats_staging')
+                current, current_params = '(select * from cramstats where model = ?)', [model]
+            else:
+                rows = self._insert('cramstats', rel, {'model': model})
+            if replacing:
+                self._resample('cramstats', model, current, current_params)
+                self._rebuild_rollup_groups('cramstats', 'model', model, current, current_params)
+            self._record_source(source, 'cramstats', None, rows)
+            stage.rows = rows
+            stage.profile = self._last_profile
+
+    def _flowcell_relations(self, flowcell_dir: FlowcellDir, conn: duckdb.DuckDBPyConnection,
+                            force: bool, timer: IngestTimer) -> Optional[_FlowcellLoad]:
+        """
+        Return the run_id, experiment_id, sources and a relation or arrow table per
+        table of a flowcell.
+
+        Returns None if the flowcell has no final_summary or hasn't changed since it
+        was loaded.
+
+        """
+        with timer.stage('list'):
+            sources = {table_name: flowcell_dir.get_source_info(table_name) for table_name in FC_SCHEMAS}
+        size = lambda table_name: sources[table_name].size if sources[table_name] else None
+        if not force and all(sources.values()):
+            loaded = self._loaded_etags(sources.values(), conn)
+            if all(loaded.get(x.path) == x.etag for x in sources.values()):
+                log.info(f'Skipping unchanged flowcell {flowcell_dir}')
+                return None
+
+        try:
+            with timer.stage('open', 'final_summary', size('final_summary')):
+                rel = flowcell_dir.make_table_relation('final_summary', conn)
+                # final_summary is a single row so materialise it rather than scanning it twice
+                rel = rel.to_arrow_table()
         except TableNotPresent:
             # TODO : should probably change return type and return failure here
             log.warning(f'No final-summary table for {flowcell_dir}')
-            return
+            return None
 
-        final_summary = {k: v for (k, v) in zip(rel.columns, rel.fetchone())}
+        final_summary = rel.to_pylist()[0]
+        rels = {'final_summary': rel}
+        timer.run_id = final_summary['acquisition_run_id']
+
+        for table_name in ['pore_activity', 'throughput', 'sequencing_summary']:
+            with timer.stage('open', table_name, size(table_name)):
+                rels[table_name] = flowcell_dir.make_table_relation(table_name, conn)
 
         # TODO : Resolve run_id vs acquisition_run_id
-        run_id = final_summary['acquisition_run_id']
+        return _FlowcellLoad(final_summary['acquisition_run_id'], final_summary['protocol_group_id'], rels, sources,
+                             timer, flowcell_dir)
+
+    def _prepare_flowcells(self, flowcell_dirs: Iterable[FlowcellDir], workers: int, queue_size: Optional[int],
+                           force: bool) -> Iterator[Tuple[FlowcellDir, IngestTimer, Optional[_FlowcellLoad],
+                                                          Optional[Exception]]]:
+        """
+        Yield (flowcell_dir, timer, load, error) for each flowcell, reading them on
+        worker threads if workers > 1.
+
+        """
+        if workers <= 1:
+            for flowcell_dir in flowcell_dirs:
+                timer = IngestTimer(repr(flowcell_dir))
+                try:
+                    yield flowcell_dir, timer, self._flowcell_relations(flowcell_dir, self._conn, force, timer), None
+                except Exception as e:
+                    yield flowcell_dir, timer, None, e
+            return
+
+        # With a resource profile the largest table is read by the writer rather than
+        # materialised in memory, where it would stay until the transaction commits
+        deferred = ['sequencing_summary'] if self.resources else []
+        results = queue.Queue(maxsize=queue_size or workers)
+        pending = iter(flowcell_dirs)
+        pending_lock = threading.Lock()
+        stop = threading.Event()
+
+        def put(item):
+            # Give up if the writer has stopped consuming
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=1.0)
+                    return
+                except queue.Full:
+                    pass
+
+        def worker():
+            cursor = self._conn.cursor()
+            try:
+                while not stop.is_set():
+                    with pending_lock:
+                        flowcell_dir = next(pending, None)
+                    if flowcell_dir is None:
+                        break
+                    timer = IngestTimer(repr(flowcell_dir))
+                    try:
+                        load = self._flowcell_relations(flowcell_dir, cursor, force, timer)
+                        if load is not None:
+                            load = load._replace(tables=self._fetch_tables(load, deferred))
+                        put((flowcell_dir, timer, load, None))
+                    except Exception as e:
+                        put((flowcell_dir, timer, None, e))
+            finally:
+                cursor.close()
+                put(None)
+
+        threads = [threading.Thread(target=worker, name=f'pigeon-ingest-{i}', daemon=True)
+                   for i in range(workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            running = len(threads)
+            while running:
+                item = results.get()
+                if item is None:
+                    running -= 1
+                else:
+                    yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    @staticmethod
+    def _fetch_tables(load: _FlowcellLoad, deferred: Sequence[str]=()) -> Dict[str, Optional[pa.Table]]:
+        """Materialise the relations of a flowcell as arrow tables, except deferred tables"""
+        tables = {}
+        for table_name, rel in load.tables.items():
+            if table_name in deferred:
+                tables[table_name] = None
+                continue
+            if isinstance(rel, pa.Table):
+                tables[table_name] = rel
+                continue
+            with load.timer.stage('fetch', table_name) as stage:
+                tables[table_name] = rel.to_arrow_table()
+                stage.rows = tables[table_name].num_rows
+
+        return tables
+
+    def _write_batch(self, batch: List[Tuple[FlowcellDir, _FlowcellLoad]]) -> List[Tuple[FlowcellDir, Exception]]:
+        """
+        Write flowcells in one transaction, falling back to one transaction each if
+        that fails.  Returns the flowcells which failed.
+
+        """
+        if not batch:
+            return []
+
+        try:
+            self._write_flowcells([load for (_, load) in batch])
+            return []
+        except Exception as e:
+            if len(batch) == 1:
+                log.error(f'Failed to insert flowcell {batch[0][0]}: {e}')
+                return [(batch[0][0], e)]
+
+        log.warning(f'Failed to insert batch of {len(batch)} flowcells, retrying individually')
+        failures = []
+        for item in batch:
+            failures.extend(self._write_batch([item]))
+
+        return failures
+
+    def _finish_batch(self, batch: List[Tuple[FlowcellDir, _FlowcellLoad]]) -> None:
+        """Release the files of a written batch and record its metrics"""
+        for flowcell_dir, _ in batch:
+            flowcell_dir.release()
+        self._record_metrics([load.timer for (_, load) in batch])
+
+    def _write_flowcells(self, loads: List[_FlowcellLoad]) -> None:
+        """
+        Insert the tables of flowcells in one transaction, replacing any previous
+        rows of their runs.
+
+        """
+        with self._transaction([load.timer for load in loads]):
+            for load in loads:
+                self._insert_flowcell_tables(load)
+
+    def _insert_flowcell_tables(self, load: _FlowcellLoad) -> None:
+        run_id = load.run_id
         log.info(f'Inserting flowcell run {run_id}')
 
-        log.info(f'Inserting final_summary for {run_id}')
-        self._conn.execute('insert into final_summary by name (select * from rel)')
+        with load.timer.stage('delete'):
+            self._delete_run(run_id)
+        for table_name, rel in load.tables.items():
+            log.info(f'Inserting {table_name} for {run_id}')
+            if table_name in ['pore_activity', 'throughput']:
+                # Join experiment_id and run_id
+                columns = {'experiment_id': load.experiment_id, 'run_id': run_id}
+            else:
+                columns = {}
+            source = load.sources.get(table_name)
+            if rel is None:
+                with load.timer.stage('open', table_name, source.size if source else None):
+                    rel = load.flowcell_dir.make_table_relation(table_name, self._conn)
+            with load.timer.stage('insert', table_name, source.size if source else None) as stage:
+                rows = self._insert(table_name, rel, columns, uuid.uuid4().hex)
+                self._record_source(source, table_name, run_id, rows)
+                stage.rows = rows
+                stage.profile = self._last_profile
 
-        log.info(f'Inserting pore_activity for {run_id}')
-        rel = flowcell_dir.make_table_relation('pore_activity', self._conn)
-        # Join experiment_id and run_id
-        rel = rel.project(f"""
-                '{final_summary['protocol_group_id']}' as experiment_id, 
-                '{final_summary['acquisition_run_id']}' as run_id, *
-                """)
-        self._conn.execute('insert into pore_activity by name (select * from rel)')
-
-        log.info(f'Inserting throughput for {run_id}')
-        rel = flowcell_dir.make_table_relation('throughput', self._conn)
-        # Join experiment_id and run_id
-        rel = rel.project(f"""
-                '{final_summary['protocol_group_id']}' as experiment_id, 
-                '{final_summary['acquisition_run_id']}' as run_id, *
-                """)
-        self._conn.execute('insert into throughput by name (select * from rel)')
+    def _delete_run(self, run_id: str) -> None:
+        """Delete all rows of a run, within the current transaction"""
+        # A run tailed while in progress has rows before its final_summary is loaded
+        exists = self._conn.execute("""
+            select (select count(*) from final_summary where acquisition_run_id = $1)
+                 + (select count(*) from tail_offsets where run_id = $1)
+                 + (select count(*) from load_manifest where run_id = $1)
+            """, [run_id]).fetchone()[0]
+        if not exists:
+            return
 
-        log.info(f'Inserting sequencing_summary for {run_id}')
-        rel = flowcell_dir.make_table_relation('sequencing_summary', self._conn)
-        self._conn.execute('insert into sequencing_summary by name (select * from rel)')
+        log.info(f'Replacing existing rows for {run_id}')
+        for table_name, column in RUN_ID_COLUMNS.items():
+            if self._is_lake_table(table_name):
+                sql = f'select distinct filename from {self._lake_scan(table_name, filename=True)} where {column} = ?'
+                self._drop_lake_files(table_name, [x[0] for x in self._conn.execute(sql, [run_id]).fetchall()])
+            elif self._is_run_keyed(table_name):
+                self._conn.execute(f'delete from {self._physical_name(table_name)} '
+                                   f'where run_key in (select run_key from runs where {column} = ?)', [run_id])
+            else:
+                self._conn.execute(f'delete from {self._physical_name(table_name)} where {column} = ?', [run_id])
+            for name in rollups_of(table_name):
+                self._conn.execute(f'delete from {name} where run_id = ?', [run_id])
+            for name, sample in samples_of(table_name).items():
+                self._conn.execute(f'delete from {name} where {sample.stratum} = ?', [run_id])
+        self._conn.execute('delete from read_index where run_id = ?', [run_id])
+        self._conn.execute('delete from load_manifest where run_id = ?', [run_id])
+        self._conn.execute('delete from tail_offsets where run_id = ?', [run_id])
 
-    def insert_cramstats(self, cramstats_dir: RemoteCramStatsDir) -> None:
-        model = cramstats_dir.get_model()
+    @contextlib.contextmanager
+    def _transaction(self, timers: Sequence[IngestTimer]=()):
+        """
+        Run a block in a transaction.  Lake files written by the block are removed if it
+        fails and files it made obsolete are removed once it commits, unless a published
+        snapshot reads them.  Should the process die first, the files are removed by
+        _init_lake when the store is next opened, as only those recorded in lake_files
+        are read.
 
-        log.info(f'Inserting cramstats for {model} {cramstats_dir}')
-        rel = cramstats_dir.make_table_relation(self._conn)
-        rel = rel.project(f"""
-                '{model}' as model, *
-                """)
+        :param timers: the commit is timed as a stage of each of these loads
+
+        """
+        written, obsolete = [], []
+        self._lake_files = (written, obsolete)
+        self._conn.begin()
+        try:
+            yield
+            with contextlib.ExitStack() as stack:
+                for timer in timers:
+                    stack.enter_context(timer.stage('commit'))
+                self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            _remove_files(written)
+            raise
+        finally:
+            self._lake_files = None
+
+        if obsolete:
+            kept = {x[0] for x in self._conn.execute(
+                'select distinct path from lake_snapshots where path in (select unnest(?::VARCHAR[]))',
+                [obsolete]).fetchall()}
+            _remove_files(x for x in obsolete if x not in kept)
+
+    def _is_lake_table(self, table_name: str) -> bool:
+        return self.lake_path is not None and table_name in LAKE_PARTITIONS
+
+    def _insert(self, table_name: str, data, columns: Dict[str, object], file_prefix: Optional[str]=None) -> int:
+        """
+        Insert a relation or arrow table by column name, within the current transaction.
+
+        :param columns: constant columns to add to every row
+        :param file_prefix: name prefix of the files written if the table is in the lake
+        :return: number of rows inserted
+
+        """
+        select = ', '.join([f'? as {name}' for name in columns] + ['*'])
+        params = list(columns.values())
+
+        self._conn.register('_pigeon_insert', data)
+        try:
+            staged = self._is_lake_table(table_name) or rollups_of(table_name) or samples_of(table_name)
+            if not staged:
+                sql = f'insert into {self._physical_name(table_name)} by name (select {select} from _pigeon_insert)'
+                return self._execute_profiled(sql, params)
+
+            # Stage in a temporary table so columns are matched and typed as for a table insert
+            # and the rows can be read again for the rollups, samples and read index
+            schema = self._schema(table_name)
+            if self.resources is not None:
+                # Rows are numbered to be processed in chunks, as rowids needn't be contiguous
+                self._conn.execute('create or replace temp sequence _pigeon_rows')
+                schema = schema + [('_pigeon_row', 'BIGINT', 'YES', None, None, None)]
+                select = f"nextval('_pigeon_rows') as _pigeon_row, {select}"
+            self._create_table('_pigeon_staging', schema, 'create or replace temp table')
+            self._execute_profiled(f'insert into _pigeon_staging by name (select {select} from _pigeon_insert)', params)
+        finally:
+            self._conn.unregister('_pigeon_insert')
+
+        file_prefix = file_prefix or uuid.uuid4().hex
+        if self.resources is None:
+            rows = self._insert_staged(table_name, '_pigeon_staging', file_prefix)
+        else:
+            # The staging table spills to disk, so only a chunk of it is worked on in memory
+            chunk_rows = self.resources.chunk_rows
+            staged_rows = self._conn.execute('select count(*) from _pigeon_staging').fetchone()[0]
+            rows = 0
+            for i, offset in enumerate(range(0, staged_rows, chunk_rows)):
+                # Sequences start at 1
+                self._conn.execute('create or replace temp table _pigeon_chunk as '
+                                   'select * exclude (_pigeon_row) from _pigeon_staging '
+                                   'where _pigeon_row > ? and _pigeon_row <= ?', [offset, offset + chunk_rows])
+                rows += self._insert_staged(table_name, '_pigeon_chunk', f'{file_prefix}-{i}')
+            self._conn.execute('drop table if exists _pigeon_chunk')
+            self._conn.execute('drop sequence _pigeon_rows')
+        self._conn.execute('drop table _pigeon_staging')
+        return rows
+
+    def _insert_staged(self, table_name: str, staging: str, file_prefix: str) -> int:
+        """Insert the rows of a staging table, updating the rollups, samples and read index"""
+        self._update_rollups(table_name, staging, [])
+        self._update_samples(table_name, staging)
+        if table_name == 'sequencing_summary':
+            self._conn.execute(f'insert into read_index select read_id, run_id, start_time from {staging}')
+        if self._is_lake_table(table_name):
+            select = f'select * from {staging}'
+            if table_name in CLUSTER_COLUMNS:
+                select += f" order by {', '.join(CLUSTER_COLUMNS[table_name])}"
+            return self._write_lake(table_name, select, [], file_prefix)
+        if self.compact_schema:
+            return self._insert_compact(table_name, staging, self._physical_name(table_name))
+        return self._conn.execute(f'insert into {table_name} select * from {staging}').fetchone()[0]
+
+    def _execute_profiled(self, sql: str, params: list) -> int:
+        """
+        Run an insert reading a source, keeping its query profile in _last_profile if
+        profile_ingest is set.  Returns the number of rows inserted.
+
+        """
+        self._last_profile = None
+        if not self.profile_ingest:
+            return self._conn.execute(sql, params).fetchone()[0]
+
+        # The profile is written to a file, as duckdb 1.1 has no get_profiling_information
+        with tempfile.TemporaryDirectory(prefix='pigeon-profile-') as tmp_dir:
+            path = os.path.join(tmp_dir, 'profile.json')
+            self._conn.execute("pragma enable_profiling='json'")
+            self._conn.execute(f'pragma profiling_output={quote_path(path)}')
+            try:
+                rows = self._conn.execute(sql, params).fetchone()[0]
+            finally:
+                self._conn.execute('pragma disable_profiling')
+                self._conn.execute('reset profiling_output')
+            if os.path.exists(path):
+                with open(path) as f:
+                    self._last_profile = f.read()
+
+        return rows
+
+    def _write_lake(self, table_name: str, select: str, params: list, file_prefix: str) -> int:
+        """Write the rows of a query to partitioned parquet files of a lake table"""
+        partitions = ', '.join(LAKE_PARTITIONS[table_name])
+        path = os.path.join(self.lake_path, table_name)
+        sql = (f"copy ({select}) to {quote_path(path)} (format parquet, compression zstd, "
+               f"partition_by ({partitions}), filename_pattern '{file_prefix}_{{i}}', "
+               f"overwrite_or_ignore true, return_files true)")
+        rows, files = self._conn.execute(sql, params).fetchone()
+        self._lake_files[0].extend(files)
+        self._conn.execute('insert into lake_files select ?, unnest(?::VARCHAR[])', [table_name, files])
+        self._create_lake_view(table_name)
+        return rows
+
+    def _remove_lake_files(self, table_name: str, pattern: str) -> List[str]:
+        """Drop the files of a lake table matching pattern from it, returning their paths"""
+        files = [x[0] for x in self._conn.execute('select path from lake_files where table_name = ? and path glob ?',
+                                                  [table_name, self._lake_glob(table_name, pattern)]).fetchall()]
+        self._drop_lake_files(table_name, files)
+        return files
+
+    def _remove_unreferenced_files(self) -> None:
+        """Remove the files of the lake which neither the store nor a kept snapshot reads"""
+        for table_name in LAKE_PARTITIONS:
+            unreferenced = [x[0] for x in self._conn.execute("""
+                select file from glob(?)
+                where file not like ?
+                and file not in (select path from lake_files where table_name = ?)
+                and file not in (select path from lake_snapshots)
+                """, [self._lake_glob(table_name), f'%={EMPTY_PARTITION}%', table_name]).fetchall()]
+            if unreferenced:
+                log.info(f'Removing {len(unreferenced)} unreferenced files of {table_name}')
+                _remove_files(unreferenced)
+
+    def _drop_lake_files(self, table_name: str, files: List[str]) -> None:
+        """Drop files from a lake table, removing them when the transaction commits"""
+        if not files:
+            return
+        self._conn.execute('delete from lake_files where table_name = ? and path in (select unnest(?::VARCHAR[]))',
+                           [table_name, files])
+        self._lake_files[1].extend(files)
+        self._create_lake_view(table_name)
 
-        self._conn.execute('insert into cramstats  by name (select * from rel)')
+    def _loaded_etags(self, sources: Iterable[SourceInfo], conn: duckdb.DuckDBPyConnection) -> Dict[str, str]:
+        """Return the ETag recorded in the load manifest for each source which has been loaded"""
+        paths = [x.path for x in sources]
+        rows = conn.execute('select source, etag from load_manifest where source in (select unnest(?))', [paths]).fetchall()
+        return dict(rows)
+
+    def _record_metrics(self, timers: Iterable[IngestTimer]) -> None:
+        """Store the metrics of loads in ingest_metrics and pass them to the hooks"""
+        for timer in timers:
+            metrics = timer.metrics
+            if not metrics:
+                continue
+            placeholders = ', '.join('?' for _ in INGEST_METRICS_SCHEMA)
+            self._conn.executemany(f'insert into ingest_metrics values ({placeholders})', [list(m) for m in metrics])
+            for hook in self._ingest_hooks:
+                try:
+                    hook(metrics)
+                except Exception as e:
+                    log.warning(f'Ingest hook {hook} failed: {e}')
+
+    def _record_source(self, source: Optional[SourceInfo], table_name: str, run_id: Optional[str], rows: int) -> None:
+        if source is None:
+            return
+
+        self._conn.execute('delete from load_manifest where source = ?', [source.path])
+        self._conn.execute(
+            'insert into load_manifest values (?, ?, ?, ?, ?, ?, now())',
+            [source.path, source.etag, source.size, table_name, run_id, rows]
+        )
+
+
+def _source_key(source: SourceInfo) -> str:
+    """A short name for a source file which is safe to use in file names"""
+    return hashlib.sha1(source.path.encode()).hexdigest()[:16]
+
+
+def _remove_files(paths: Iterable[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
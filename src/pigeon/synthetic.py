@@ -0,0 +1,204 @@
+"""
+Generators of synthetic MinKNOW output directories and cram.stats files.
+
+Files are written by duckdb so that flowcells of tens of millions of reads can be
+generated quickly.  Values are derived by hashing the row number with a seed, so the
+same arguments always produce the same files.
+
+"""
+
+import hashlib
+import pathlib as P
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import duckdb
+
+from .flowcell_dir import CHANNEL_STATES, FC_SCHEMAS
+from .schema import quote_path
+
+# Pseudo-random value in [0, 1) for row ``range`` and stream k
+UNIFORM = "((hash(range, {seed}, {k}) % 1000000007) / 1000000007.0)"
+
+# Standard normal value by the Box-Muller transform
+NORMAL = f"(sqrt(-2 * ln(1 - {UNIFORM.replace('{k}', '{k1}')})) * cos(2 * pi() * {UNIFORM.replace('{k}', '{k2}')}))"
+
+# Start of every synthetic run, which is named after it
+STARTED = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+
+END_REASONS = ['signal_positive', 'unblock_mux_change', 'data_service_unblock_mux_change', 'signal_negative']
+
+
+class Flowcell:
+    """
+    Names and identifiers of a synthetic flowcell, derived from a seed.
+    """
+    def __init__(self, seed: int, experiment_id: str='synthetic', sample_id: str='hg001'):
+        digest = hashlib.sha1(f'pigeon-synthetic-{seed}'.encode()).hexdigest()
+        self.seed = seed
+        self.run_id = digest
+        self.experiment_id = experiment_id
+        self.sample_id = sample_id
+        self.flow_cell_id = f'PAS{seed:05d}'
+        self.short_id = digest[:8]
+        self.name = f'20240101_1200_1A_{self.flow_cell_id}_{self.short_id}'
+
+    def file_name(self, table_name: str, suffix: str) -> str:
+        return f'{table_name}_{self.flow_cell_id}_{self.short_id}_{self.run_id[8:16]}.{suffix}'
+
+    def read_id_sql(self) -> str:
+        """Expression for the read id of row ``range``, shared by flowcells and cram.stats"""
+        return (f"printf('%08x-%04x-%04x-%04x-%012x', hash(range, {self.seed}, 'id1') % 4294967296, "
+                f"hash(range, {self.seed}, 'id2') % 65536, hash(range, {self.seed}, 'id3') % 65536, "
+                f"hash(range, {self.seed}, 'id4') % 65536, hash(range, {self.seed}, 'id5') % 281474976710656)")
+
+
+def write_flowcell(path: P.Path, flowcell: Flowcell, reads: int, hours: int=72,
+                   connection: Optional[duckdb.DuckDBPyConnection]=None) -> P.Path:
+    """
+    Write a MinKNOW output directory named after the flowcell in path.
+
+    :param reads: number of reads in sequencing_summary
+    :param hours: length of the run
+    :return: path of the flowcell directory
+
+    """
+    conn = connection or duckdb.connect()
+    fc_path = P.Path(path) / flowcell.name
+    fc_path.mkdir(parents=True, exist_ok=True)
+    seed = flowcell.seed
+
+    final_summary = {
+        'instrument': 'PC24B149', 'position': '1A', 'flow_cell_id': flowcell.flow_cell_id,
+        'sample_id': flowcell.sample_id, 'protocol_group_id': flowcell.experiment_id,
+        'protocol': 'sequencing/sequencing_PRO114_DNA_e8_2_400K', 'protocol_run_id': f'{flowcell.run_id[:8]}-protocol',
+        'acquisition_run_id': flowcell.run_id, 'started': STARTED.isoformat(timespec='microseconds'),
+        'acquisition_stopped': (STARTED + timedelta(hours=hours)).isoformat(timespec='microseconds'),
+        'processing_stopped': (STARTED + timedelta(hours=hours, minutes=1)).isoformat(timespec='microseconds'),
+        'basecalling_enabled': '1',
+        'sequencing_summary_file': flowcell.file_name('sequencing_summary', 'txt'),
+        'fast5_files_in_final_dest': '0', 'fast5_files_in_fallback': '0',
+        'fastq_files_in_final_dest': str(reads // 4000 + 1), 'fastq_files_in_fallback': '0',
+    }
+    (fc_path / flowcell.file_name('final_summary', 'txt')).write_text(
+        ''.join(f'{k}={v}\n' for (k, v) in final_summary.items()))
+
+    minutes = hours * 60
+    states = ', '.join(f"'{x}'" for x in CHANNEL_STATES)
+    conn.execute(f"""
+        copy (
+            select state as "Channel State", range + 1 as "Experiment Time (minutes)",
+                   (hash(range, state, {seed}) % 10000000)::BIGINT as "State Time (samples)"
+            from range({minutes}) cross join unnest([{states}]) as t(state)
+            order by range
+        ) to {quote_path(str(fc_path / flowcell.file_name('pore_activity', 'csv')))} (header, delimiter ',')
+        """)
+
+    # Cumulative counters growing through the run
+    per_minute = reads / minutes
+    conn.execute(f"""
+        copy (
+            select range + 1 as "Experiment Time (minutes)",
+                   round((range + 1) * {per_minute})::BIGINT as "Reads",
+                   round((range + 1) * {per_minute} * 0.85)::BIGINT as "Basecalled Reads Passed",
+                   round((range + 1) * {per_minute} * 0.15)::BIGINT as "Basecalled Reads Failed",
+                   0 as "Basecalled Reads Skipped",
+                   round((range + 1) * {per_minute} * 80000)::BIGINT as "Selected Raw Samples",
+                   round((range + 1) * {per_minute} * 16000)::BIGINT as "Selected Events",
+                   round((range + 1) * {per_minute} * 20000)::BIGINT as "Estimated Bases",
+                   round((range + 1) * {per_minute} * 18000)::BIGINT as "Basecalled Bases",
+                   round((range + 1) * {per_minute} * 75000)::BIGINT as "Basecalled Samples"
+            from range({minutes})
+        ) to {quote_path(str(fc_path / flowcell.file_name('throughput', 'csv')))} (header, delimiter ',')
+        """)
+
+    uniform = lambda k: UNIFORM.format(seed=seed, k=k)
+    normal = lambda k: NORMAL.format(seed=seed, k1=f"'{k}1'", k2=f"'{k}2'")
+    end_reasons = ', '.join(f"'{x}'" for x in END_REASONS)
+    seconds = hours * 3600
+    columns = {
+        'filename_fastq': f"'{flowcell.flow_cell_id}_pass_' || (range // 4000) || '.fastq.gz'",
+        'filename_fast5': 'null',
+        'filename_pod5': f"'{flowcell.flow_cell_id}_' || (range // 4000) || '.pod5'",
+        'parent_read_id': 'read_id',
+        'read_id': 'read_id',
+        'run_id': f"'{flowcell.run_id}'",
+        'channel': f"1 + hash(range, {seed}, 'channel') % 3000",
+        'mux': f"1 + hash(range, {seed}, 'mux') % 4",
+        'minknow_events': 'sequence_length_template * 2',
+        'start_time': f"round(range * {seconds / max(reads, 1)} + {uniform(1)} * 30, 4)",
+        'duration': 'round(sequence_length_template / 400.0, 4)',
+        'passes_filtering': "if(mean_qscore_template >= 10, 'TRUE', 'FALSE')",
+        'template_start': f"round(range * {seconds / max(reads, 1)} + {uniform(1)} * 30 + 0.1, 4)",
+        'num_events_template': 'sequence_length_template * 2',
+        'template_duration': 'round(sequence_length_template / 400.0 - 0.1, 4)',
+        'sequence_length_template': 'sequence_length_template',
+        'mean_qscore_template': 'mean_qscore_template',
+        'strand_score_template': '0',
+        'median_template': f"round(80 + 3 * {normal('median')}, 3)",
+        'mad_template': f"round(10 + {uniform(2)}, 3)",
+        'pore_type': "'not_set'",
+        'experiment_id': f"'{flowcell.experiment_id}'",
+        'sample_id': f"'{flowcell.sample_id}'",
+        'end_reason': f"[{end_reasons}][1 + (hash(range, {seed}, 'end') % 100 >= 90)::INTEGER + (hash(range, {seed}, 'end') % 100 >= 97)::INTEGER]",
+    }
+    assert list(columns) == [x[0] for x in FC_SCHEMAS['sequencing_summary']]
+    select = ', '.join(f'{expr} as {name}' for (name, expr) in columns.items())
+    conn.execute(f"""
+        copy (
+            select {select}
+            from (
+                select range, {flowcell.read_id_sql()} as read_id,
+                       -- Read lengths are roughly log-normal with a median of 15kbp
+                       greatest(50, round(exp(ln(15000) + 0.8 * {normal('length')})))::BIGINT as sequence_length_template,
+                       round(greatest(2, 18 + 4 * {normal('qscore')}), 3) as mean_qscore_template
+                from range({reads})
+            )
+            order by range
+        ) to {quote_path(str(fc_path / flowcell.file_name('sequencing_summary', 'txt')))} (header, delimiter '\t')
+        """)
+
+    return fc_path
+
+
+def write_cramstats(path: P.Path, flowcell: Flowcell, reads: int, model: str='hac',
+                    connection: Optional[duckdb.DuckDBPyConnection]=None) -> P.Path:
+    """
+    Write a cram.stats file with one alignment for each of the first ``reads`` reads of a flowcell.
+
+    :return: path of the file
+
+    """
+    conn = connection or duckdb.connect()
+    seed = flowcell.seed
+    file_path = P.Path(path) / f'{model}_{flowcell.flow_cell_id}.cram.stats'
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    normal = lambda k: NORMAL.format(seed=seed, k1=f"'{k}1'", k2=f"'{k}2'")
+    refs = ', '.join(f"'chr{x}'" for x in list(range(1, 23)) + ['X', 'Y', 'M'])
+
+    conn.execute(f"""
+        copy (
+            select name, ref, round(100.0 * length / read_length, 3) as coverage,
+                   round(100.0 * aligned_ref_len / 248956422, 6) as ref_coverage,
+                   0 as qstart, length as qend, rstart, rstart + aligned_ref_len as rend, aligned_ref_len,
+                   direction, length, read_length, length - ins - sub as match, ins, del, sub,
+                   round(100.0 * (length - ins - sub) / (length - ins), 2) as iden,
+                   round(100.0 * (length - ins - sub) / (length + del), 2) as acc
+            from (
+                select {flowcell.read_id_sql()} as name,
+                       [{refs}][1 + (hash(range, {seed}, 'ref') % 25)::BIGINT] as ref,
+                       greatest(50, round(exp(ln(15000) + 0.8 * {normal('length')})))::BIGINT as read_length,
+                       read_length - (hash(range, {seed}, 'clip') % 40)::BIGINT as length,
+                       (length * 0.004)::BIGINT as ins,
+                       (length * 0.005)::BIGINT as del,
+                       (length * 0.003)::BIGINT as sub,
+                       length - ins + del as aligned_ref_len,
+                       (hash(range, {seed}, 'rstart') % 200000000)::BIGINT as rstart,
+                       if(hash(range, {seed}, 'dir') % 2 = 0, '+', '-') as direction
+                from range({reads})
+            )
+            order by ref, rstart
+        ) to {quote_path(str(file_path))} (header, delimiter '\t')
+        """)
+
+    return file_path
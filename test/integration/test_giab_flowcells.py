@@ -117,7 +117,10 @@ def test_relation_columns(table_name: str, eg_flowcell_dir: RemoteFlowcellDir, s
     # Store will add extra columns from funal_summary before insertion.
     # Therefore remove these from the columns to consider.
     columns = {x[0] for x in pigeon.flowcell_dir.FC_SCHEMAS[table_name]}
-    if table_name in ['pore_activity', 'throughput']:
+    if table_name == 'pore_activity':
+        # Read in long form, a row per minute and channel state
+        columns = set(pigeon.flowcell_dir.PORE_ACTIVITY_COLUMNS)
+    elif table_name == 'throughput':
         columns = columns ^ {'experiment_id', 'run_id'}
 
     # TODO : consider if Store._conn should be public
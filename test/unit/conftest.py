@@ -0,0 +1,246 @@
+"""
+Shared fixtures for unit tests: small MinKNOW-like flowcell files and a fake S3 client.
+
+"""
+
+import hashlib
+import io
+import pathlib as P
+import random
+from typing import Dict
+
+import duckdb
+import pysam
+import pytest
+
+from pigeon.flowcell_dir import FC_SCHEMAS
+
+flowcell_name = '20230505_1857_1B_PAO99309_94e07fab'
+run_id = 'c3641428eb90f0d05daec16022cd0cb46c20eafd'
+experiment_id = 'r10p41_e8p2_human_runs_jkw'
+
+CHANNEL_STATES = ['adapter', 'disabled', 'locked', 'multiple', 'no_pore', 'pore', 'strand', 'unavailable', 'unblocking', 'zero']
+
+
+def minknow_files(run_id: str=run_id, experiment_id: str=experiment_id, reads: int=100,
+                  minutes: int=5, seed: int=1) -> Dict[str, bytes]:
+    """Return the table files of a small MinKNOW output directory keyed by filename"""
+    rng = random.Random(seed)
+    files = {}
+
+    final_summary = {
+        'instrument': 'PC24B149', 'position': '1B', 'flow_cell_id': 'PAO99309', 'sample_id': 'hg001',
+        'protocol_group_id': experiment_id, 'protocol': 'sequencing/sequencing_PRO114_DNA_e8_2_400K',
+        'protocol_run_id': 'b8e7f94c-51c8-4e53-a4e2-0c5a1e0f7d3b', 'acquisition_run_id': run_id,
+        'started': '2023-05-05T18:57:47.291349+01:00', 'acquisition_stopped': '2023-05-08T18:57:48.891340+01:00',
+        'processing_stopped': '2023-05-08T18:58:09.166491+01:00', 'basecalling_enabled': '1',
+        'sequencing_summary_file': f'sequencing_summary_PAO99309_94e07fab_0d5e3ac7.txt',
+        'fast5_files_in_final_dest': '0', 'fast5_files_in_fallback': '0', 'fastq_files_in_final_dest': '10',
+        'fastq_files_in_fallback': '0',
+    }
+    files['final_summary_PAO99309_94e07fab_0d5e3ac7.txt'] = ''.join(f'{k}={v}\n' for k, v in final_summary.items()).encode()
+
+    lines = ['Channel State,Experiment Time (minutes),State Time (samples)']
+    for minute in range(1, minutes + 1):
+        for state in CHANNEL_STATES:
+            lines.append(f'{state},{minute},{rng.randint(0, 10**7)}')
+    files['pore_activity_PAO99309_94e07fab_0d5e3ac7.csv'] = ('\n'.join(lines) + '\n').encode()
+
+    lines = ['Experiment Time (minutes),Reads,Basecalled Reads Passed,Basecalled Reads Failed,Basecalled Reads Skipped,'
+             'Selected Raw Samples,Selected Events,Estimated Bases,Basecalled Bases,Basecalled Samples']
+    for minute in range(1, minutes + 1):
+        lines.append(','.join(str(x) for x in [minute] + [rng.randint(0, 10**6) for _ in range(9)]))
+    files['throughput_PAO99309_94e07fab_0d5e3ac7.csv'] = ('\n'.join(lines) + '\n').encode()
+
+    columns = [x[0] for x in FC_SCHEMAS['sequencing_summary']]
+    lines = ['\t'.join(columns)]
+    for i in range(reads):
+        row = {
+            'filename_fastq': 'PAO99309_pass_0.fastq.gz', 'filename_fast5': '', 'filename_pod5': 'PAO99309_0.pod5',
+            'parent_read_id': f'{run_id[:8]}-{i:08d}', 'read_id': f'{run_id[:8]}-{i:08d}', 'run_id': run_id,
+            'channel': rng.randint(1, 3000), 'mux': rng.randint(1, 4), 'minknow_events': rng.randint(100, 10**5),
+            'start_time': round(i * 60.0 * minutes / reads, 4), 'duration': round(rng.uniform(0.1, 10), 4),
+            'passes_filtering': rng.choice(['TRUE', 'FALSE']), 'template_start': round(i * 0.3, 4),
+            'num_events_template': rng.randint(100, 10**5), 'template_duration': round(rng.uniform(0.1, 10), 4),
+            'sequence_length_template': rng.randint(50, 50000), 'mean_qscore_template': round(rng.uniform(3, 30), 3),
+            'strand_score_template': 0, 'median_template': round(rng.uniform(70, 90), 3),
+            'mad_template': round(rng.uniform(8, 12), 3), 'pore_type': 'not_set', 'experiment_id': experiment_id,
+            'sample_id': 'hg001', 'end_reason': rng.choice(['signal_positive', 'unblock_mux_change']),
+        }
+        lines.append('\t'.join(str(row[c]) for c in columns))
+    files['sequencing_summary_PAO99309_94e07fab_0d5e3ac7.txt'] = ('\n'.join(lines) + '\n').encode()
+
+    return files
+
+
+def cramstats_file(names, seed: int=1) -> bytes:
+    """Return the content of a cram.stats file with one alignment per read name"""
+    rng = random.Random(seed)
+    lines = ['name\tref\tcoverage\tref_coverage\tqstart\tqend\trstart\trend\taligned_ref_len\tdirection\tlength\t'
+             'read_length\tmatch\tins\tdel\tsub\tiden\tacc']
+    for name in names:
+        length = rng.randint(100, 10000)
+        sub, ins, dele = rng.randint(0, 50), rng.randint(0, 50), rng.randint(0, 50)
+        match = length - sub - ins
+        rstart = rng.randint(0, 10**6)
+        lines.append('\t'.join(str(x) for x in [
+            name, rng.choice(['chr1', 'chr2']), 99.0, 0.001, 0, length, rstart, rstart + length - ins + dele,
+            length - ins + dele, rng.choice('+-'), length, length, match, ins, dele, sub,
+            round(match / (match + sub), 6), round(match / (match + sub + ins + dele), 6)]))
+
+    return ('\n'.join(lines) + '\n').encode()
+
+
+# Soft clip, match, insertion, match, deletion, match
+CIGAR = [(4, 10), (0, 50), (1, 3), (0, 40), (2, 2), (0, 30)]
+SUBSTITUTIONS = 4
+REFERENCE_LENGTHS = {'chr1': 5000, 'chr2': 3000}
+
+
+def write_alignments(path: P.Path, reads: int=20, reference_path: P.Path=None, seed: int=1,
+                     without_nm: int=0) -> P.Path:
+    """
+    Write and index a sorted BAM, or CRAM if reference_path is given, with reads
+    alignments per contig of REFERENCE_LENGTHS.  The last alignment of each contig is
+    secondary, and the first without_nm have no NM tag.
+
+    """
+    rng = random.Random(seed)
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'},
+              'SQ': [{'SN': name, 'LN': length} for (name, length) in REFERENCE_LENGTHS.items()]}
+    if reference_path is not None:
+        reference_path.write_text(''.join(f'>{name}\n' + ''.join(rng.choice('ACGT') for _ in range(length)) + '\n'
+                                          for (name, length) in REFERENCE_LENGTHS.items()))
+        pysam.faidx(str(reference_path))
+
+    mode = 'wc' if reference_path is not None else 'wb'
+    with pysam.AlignmentFile(str(path), mode, header=header,
+                             reference_filename=str(reference_path) if reference_path else None) as bam:
+        for ref_id, ref_length in enumerate(REFERENCE_LENGTHS.values()):
+            for i, pos in enumerate(sorted(rng.randint(0, ref_length - 200) for _ in range(reads))):
+                rec = pysam.AlignedSegment(bam.header)
+                rec.query_name = f'read-{ref_id}-{i}'
+                rec.query_sequence = ''.join(rng.choice('ACGT') for _ in range(133))
+                rec.query_qualities = pysam.qualitystring_to_array('I' * 133)
+                rec.reference_id = ref_id
+                rec.reference_start = pos
+                rec.cigartuples = CIGAR
+                rec.mapping_quality = 60
+                rec.is_reverse = i % 2 == 1
+                rec.is_secondary = i == reads - 1
+                if i >= without_nm:
+                    rec.set_tag('NM', SUBSTITUTIONS + 3 + 2)
+                bam.write(rec)
+    pysam.index(str(path))
+
+    return path
+
+
+def read_profile(store, path: P.Path, f) -> str:
+    """The JSON profile of the last query run by f, written to path"""
+    store._conn.execute("pragma enable_profiling='json'")
+    store._conn.execute(f"pragma profiling_output='{path}'")
+    try:
+        f()
+    finally:
+        store._conn.execute('pragma disable_profiling')
+    return path.read_text()
+
+
+# duckdb 1.1 only looks up ART indexes for equality, not lists of values
+index_scans_lists = pytest.mark.skipif(tuple(int(x) for x in duckdb.__version__.split('.')[:2]) < (1, 2),
+                                       reason='duckdb 1.1 only looks up indexes for equality')
+
+
+# --------
+# Fake S3
+
+class FakePaginator:
+    def __init__(self, client):
+        self._client = client
+
+    def paginate(self, Bucket, Prefix, Delimiter=None):
+        self._client.calls.append((Prefix, Delimiter))
+        keys = sorted(k for k in self._client.objects if k.startswith(Prefix))
+        contents = []
+        prefixes = []
+        for key in keys:
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                p = Prefix + rest.split(Delimiter)[0] + Delimiter
+                if p not in prefixes:
+                    prefixes.append(p)
+            else:
+                contents.append({'Key': key, 'ETag': f'"{self._client.etag(key)}"', 'Size': len(self._client.objects[key])})
+
+        # Pages of 2 objects to exercise pagination
+        for i in range(0, max(len(contents), 1), 2):
+            yield {'Contents': contents[i:i+2], 'CommonPrefixes': [{'Prefix': p} for p in prefixes] if i == 0 else []}
+
+
+class FakeS3:
+    """Just enough of a boto3 S3 client, serving objects from a dictionary"""
+    def __init__(self, objects: Dict[str, bytes]):
+        self.objects = objects
+        self.calls = []
+        self.downloads = []
+
+    def etag(self, key: str) -> str:
+        return hashlib.md5(self.objects[key]).hexdigest()
+
+    def get_paginator(self, name):
+        assert name == 'list_objects_v2'
+        return FakePaginator(self)
+
+    def download_file(self, Bucket, Key, Filename):
+        self.downloads.append(Key)
+        P.Path(Filename).write_bytes(self.objects[Key])
+
+    def get_object(self, Bucket, Key, Range=None):
+        data = self.objects[Key]
+        if Range:
+            start, end = Range.removeprefix('bytes=').split('-')
+            data = data[int(start):int(end) + 1]
+        return {'Body': io.BytesIO(data)}
+
+
+@pytest.fixture
+def s3() -> FakeS3:
+    objects = {f'flowcells/hg001/{flowcell_name}/{name}': data for (name, data) in minknow_files().items()}
+    objects.update({f'flowcells/hg001/{flowcell_name}/pod5/file{i}.pod5': b'x' * 10 for i in range(3)})
+    objects['flowcells/hg002/20230506_1200_1A_PAO11111_aaaaaaaa/final_summary_PAO11111_aaaaaaaa_1.txt'] = b'a=b\n'
+    objects['stats/hac_PAO99309.cram.stats'] = cramstats_file(f'{run_id[:8]}-{i:08d}' for i in range(100))
+
+    return FakeS3(objects)
+
+
+# --------
+# Local flowcell directories
+
+@pytest.fixture
+def flowcell_path(tmp_path) -> P.Path:
+    path = tmp_path / 'flowcells' / flowcell_name
+    path.mkdir(parents=True)
+    for name, data in minknow_files().items():
+        (path / name).write_bytes(data)
+
+    return path
+
+
+@pytest.fixture
+def cramstats_path(tmp_path) -> P.Path:
+    path = tmp_path / 'hac_PAO99309.cram.stats'
+    path.write_bytes(cramstats_file(f'{run_id[:8]}-{i:08d}' for i in range(100)))
+
+    return path
+
+
+# --------
+# DuckDB
+
+@pytest.fixture
+def conn() -> duckdb.DuckDBPyConnection:
+    """A connection that outlives the relations a test makes on it"""
+    conn = duckdb.connect()
+    yield conn
+    conn.close()
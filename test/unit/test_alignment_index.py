@@ -0,0 +1,87 @@
+"""
+Unit tests for indexing alignment files and fetching records by read_id.
+
+"""
+
+import pathlib as P
+
+import pytest
+
+import pigeon.store
+
+import conftest
+
+# --------
+# Fixtures
+
+@pytest.fixture(params=['bam', 'cram'])
+def alignments(request, tmp_path):
+    """Path of an alignment file and the reference needed to read it"""
+    reference_path = tmp_path / 'ref.fa' if request.param == 'cram' else None
+    path = conftest.write_alignments(tmp_path / f'hac_PAO99309.{request.param}', reads=200,
+                                     reference_path=reference_path)
+
+    return str(path), str(reference_path) if reference_path else None
+
+
+@pytest.fixture
+def store(tmp_path) -> pigeon.store.Store:
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'))
+    yield store
+    store.close()
+
+# --------
+# Tests
+
+def test_index(store, alignments):
+    path, reference = alignments
+
+    store.index_alignments(path, reference)
+
+    rows = store._conn.sql('select count(*), count(distinct read_id), count(distinct ref) from alignment_index').fetchone()
+    assert rows == (400, 400, 2)
+
+
+def test_fetch(store, alignments):
+    path, reference = alignments
+    store.index_alignments(path, reference)
+    read_ids = ['read-0-5', 'read-0-6', 'read-0-150', 'read-1-199', 'read-1-3', 'not-a-read']
+
+    records = list(store.fetch_alignments(read_ids, reference))
+
+    assert sorted(x.query_name for x in records) == sorted(read_ids[:-1])
+    for rec in records:
+        assert rec.cigartuples == conftest.CIGAR
+
+
+@conftest.index_scans_lists
+def test_fetch_index_scan(store, alignments, tmp_path):
+    """Read ids are looked up in the index of alignment_index rather than by scanning it"""
+    path, reference = alignments
+    store.index_alignments(path, reference)
+
+    profile = conftest.read_profile(store, tmp_path / 'profile.json',
+                                    lambda: list(store.fetch_alignments(['read-0-5', 'read-1-199'], reference)))
+
+    assert 'Index Scan' in profile
+    assert 'Sequential Scan' not in profile
+
+
+def test_fetch_batches(store, alignments, monkeypatch):
+    path, reference = alignments
+    store.index_alignments(path, reference)
+    monkeypatch.setattr(pigeon.store, 'READ_LOOKUP_BATCH_SIZE', 3)
+    read_ids = [f'read-{i % 2}-{i}' for i in range(0, 200, 9)]
+
+    assert sorted(x.query_name for x in store.fetch_alignments(read_ids, reference)) == sorted(read_ids)
+
+
+def test_reindex(store, alignments):
+    path, reference = alignments
+    store.index_alignments(path, reference)
+    conftest.write_alignments(P.Path(path), reads=10, reference_path=P.Path(reference) if reference else None)
+
+    store.index_alignments(path, reference)
+
+    assert store._conn.sql('select count(*) from alignment_index').fetchone()[0] == 20
+    assert [x.query_name for x in store.fetch_alignments(['read-0-5'], reference)] == ['read-0-5']
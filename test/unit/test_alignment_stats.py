@@ -0,0 +1,62 @@
+"""
+Unit tests for computing cramstats from alignment files.
+
+"""
+
+import pytest
+
+import pigeon.store
+from pigeon.cramstats_dir import AlignmentCramStatsDir
+
+import conftest
+
+# --------
+# Fixtures
+
+@pytest.fixture
+def bam_path(tmp_path):
+    return conftest.write_alignments(tmp_path / 'hac_PAO99309.bam')
+
+# --------
+# Tests
+
+@pytest.mark.parametrize('processes,region_size', [(1, 10**7), (2, 1000)])
+def test_stats(bam_path, processes, region_size, conn):
+    cdir = AlignmentCramStatsDir(bam_path, processes=processes, region_size=region_size)
+    rel = cdir.make_table_relation(conn)
+
+    rows = rel.to_arrow_table().to_pylist()
+
+    assert cdir.get_model() == 'hac'
+    assert len(rows) == 38
+    assert len({row['name'] for row in rows}) == 38
+    row = rows[0]
+    assert row['length'] == 123
+    assert row['read_length'] == 133
+    assert row['aligned_ref_len'] == 122
+    assert (row['match'], row['ins'], row['del'], row['sub']) == (116, 3, 2, 4)
+    assert row['rend'] - row['rstart'] == 122
+    assert row['iden'] == round(100 * 116 / 120, 2)
+    assert row['acc'] == round(100 * 116 / 125, 2)
+    assert {row['direction'] for row in rows} == {'+', '-'}
+
+
+def test_missing_nm(tmp_path, caplog, conn):
+    """Alignments without an NM tag are skipped"""
+    bam_path = conftest.write_alignments(tmp_path / 'hac_PAO99309.bam', without_nm=2)
+    cdir = AlignmentCramStatsDir(bam_path, processes=1)
+
+    rows = cdir.make_table_relation(conn).to_arrow_table().to_pylist()
+
+    assert len(rows) == 34
+    assert 'Skipped 2 alignments without an NM tag' in caplog.text
+
+
+def test_store(bam_path, tmp_path):
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'))
+
+    store.insert_cramstats(AlignmentCramStatsDir(bam_path, processes=1))
+
+    rows = store._conn.sql('select model, ref, count(*) from cramstats group by all order by ref').fetchall()
+    assert rows == [('hac', 'chr1', 19), ('hac', 'chr2', 19)]
+    store.close()
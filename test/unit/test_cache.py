@@ -0,0 +1,134 @@
+"""
+Unit tests for the local disk cache of remote table files.
+
+"""
+
+import os
+
+import pytest
+
+import duckdb
+
+import pigeon.store
+from pigeon.cache import DiskCache
+from pigeon.cramstats_dir import RemoteCramStatsDir
+from pigeon.flowcell_dir import RemoteFlowcellDir
+
+import conftest
+
+bucket = 'test-bucket'
+flowcell_url = f's3://{bucket}/flowcells/hg001/{conftest.flowcell_name}'
+
+# --------
+# Tests
+
+def test_hit_and_miss(s3, tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=10**6)
+    key = 'stats/hac_PAO99309.cram.stats'
+
+    path1 = cache.get(s3, bucket, key, s3.etag(key))
+    path2 = cache.get(s3, bucket, key, s3.etag(key))
+
+    assert path1 == path2
+    assert path1.endswith('.cram.stats')
+    assert s3.downloads == [key]
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_etag_change(s3, tmp_path):
+    """A changed object is downloaded again"""
+    cache = DiskCache(tmp_path, max_bytes=10**6)
+    key = 'stats/hac_PAO99309.cram.stats'
+
+    cache.get(s3, bucket, key, 'etag1')
+    cache.get(s3, bucket, key, 'etag2')
+
+    assert s3.downloads == [key, key]
+
+
+def test_lru_eviction(tmp_path):
+    s3 = conftest.FakeS3({k: b'x' * 100 for k in ['a', 'b', 'c']})
+    cache = DiskCache(tmp_path, max_bytes=250)
+
+    cache.get(s3, bucket, 'a', 'etag')
+    cache.get(s3, bucket, 'b', 'etag')
+    cache.get(s3, bucket, 'a', 'etag')
+    # b is least recently used so is evicted to make room for c
+    cache.get(s3, bucket, 'c', 'etag')
+    cache.get(s3, bucket, 'a', 'etag')
+
+    assert cache.stats()['evictions'] == 1
+    assert cache.size == 200
+    assert s3.downloads == ['a', 'b', 'c']
+
+
+def test_pinned_not_evicted(tmp_path):
+    """Files pinned for a load outlive the size cap until released"""
+    s3 = conftest.FakeS3({k: b'x' * 100 for k in ['a', 'b', 'c']})
+    cache = DiskCache(tmp_path, max_bytes=150)
+
+    a = cache.get(s3, bucket, 'a', 'etag', pin=True)
+    b = cache.get(s3, bucket, 'b', 'etag', pin=True)
+    cache.get(s3, bucket, 'c', 'etag')
+
+    assert os.path.exists(a) and os.path.exists(b)
+    assert cache.stats()['evictions'] == 0
+
+    cache.release(a)
+    cache.release(b)
+
+    assert not os.path.exists(a)
+    assert cache.size == 100
+    assert cache._key_locks == {}
+
+
+def test_persistent(s3, tmp_path):
+    key = 'stats/hac_PAO99309.cram.stats'
+    DiskCache(tmp_path, max_bytes=10**6).get(s3, bucket, key, s3.etag(key))
+
+    cache = DiskCache(tmp_path, max_bytes=10**6)
+    cache.get(s3, bucket, key, s3.etag(key))
+
+    assert cache.stats()['hits'] == 1
+    assert s3.downloads == [key]
+
+
+@pytest.mark.parametrize('table_name', ['final_summary', 'pore_activity', 'throughput', 'sequencing_summary'])
+def test_flowcell_dir_read_through(table_name, s3, tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=10**7)
+    fdir = RemoteFlowcellDir(flowcell_url, s3_client=s3, cache=cache)
+    conn = duckdb.connect()
+
+    rel = fdir.make_table_relation(table_name, conn)
+
+    assert len(rel.fetchall()) > 0
+    assert len(s3.downloads) == 1
+
+
+def test_store_read_through(s3, tmp_path):
+    cache = DiskCache(tmp_path / 'cache', max_bytes=10**7)
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'))
+
+    store.insert_flowcell(RemoteFlowcellDir(flowcell_url, s3_client=s3, cache=cache))
+    store.insert_cramstats(RemoteCramStatsDir(f's3://{bucket}/stats/hac_PAO99309.cram.stats', s3_client=s3, cache=cache))
+
+    assert store._conn.sql('select count(*) from sequencing_summary').fetchone()[0] == 100
+    assert store._conn.sql('select count(*) from cramstats').fetchone()[0] == 100
+    assert cache.stats()['misses'] == 5
+    store.close()
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_store_cache_below_flowcell(s3, tmp_path, workers):
+    """A cache smaller than one flowcell still serves every table of it"""
+    cache = DiskCache(tmp_path / 'cache', max_bytes=1)
+    resources = pigeon.store.ResourceProfile(memory_limit='1GB', threads=1)
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'), resources=resources)
+
+    failures = store.insert_flowcells([RemoteFlowcellDir(flowcell_url, s3_client=s3, cache=cache)], workers=workers)
+
+    assert failures == []
+    assert store._conn.sql('select count(*) from sequencing_summary').fetchone()[0] == 100
+    assert cache.stats()['files'] == 0
+    store.close()
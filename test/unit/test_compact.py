@@ -0,0 +1,153 @@
+"""
+Unit tests for stores using the compact schema.
+
+"""
+
+import pytest
+
+import pigeon.store
+from pigeon.cramstats_dir import AlignmentCramStatsDir, LocalCramStatsDir
+from pigeon.flowcell_dir import LocalFlowcellDir
+from pigeon.rollups import ROLLUPS
+
+import conftest
+
+# --------
+# Fixtures
+
+@pytest.fixture(params=[False, True], ids=['tables', 'lake'])
+def store(request, tmp_path) -> pigeon.store.Store:
+    lake_path = str(tmp_path / 'lake') if request.param else None
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'), lake_path=lake_path, compact_schema=True)
+    yield store
+    store.close()
+
+
+def write_flowcell(path, **kwargs):
+    path.mkdir(parents=True, exist_ok=True)
+    for name, data in conftest.minknow_files(**kwargs).items():
+        (path / name).write_bytes(data)
+
+    return LocalFlowcellDir(path)
+
+
+def column_types(store, table_name):
+    return dict(store._conn.execute('select column_name, data_type from information_schema.columns '
+                                    'where table_name = ?', [table_name]).fetchall())
+
+def assert_rows_close(actual, expected):
+    """Rows are equal, except for the precision lost narrowing floats"""
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        assert a == pytest.approx(e, rel=1e-5)
+
+# --------
+# Tests
+
+def test_types(store):
+    types = column_types(store, 'pore_activity')
+    assert types['strand'] == 'BIGINT'
+    if store.lake_path is None:
+        assert column_types(store, 'sequencing_summary_data')['channel'] == 'USMALLINT'
+        assert 'run_id' not in column_types(store, 'sequencing_summary_data')
+        assert column_types(store, 'cramstats')['model'] == 'VARCHAR'
+        assert column_types(store, 'cramstats')['direction'].startswith('ENUM')
+
+
+def test_insert(store, tmp_path, cramstats_path):
+    for i in range(2):
+        store.insert_flowcell(write_flowcell(tmp_path / str(i) / conftest.flowcell_name, run_id=f'run{i}', seed=i))
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+
+    rows = store._conn.sql('select run_id, experiment_id, count(*) from sequencing_summary group by all order by 1').fetchall()
+    assert rows == [('run0', conftest.experiment_id, 100), ('run1', conftest.experiment_id, 100)]
+    assert store._conn.sql('select count(*) from cramstats').fetchone()[0] == 100
+    assert store.get_reads(['run1-00000007'])['read_id'].to_pylist() == ['run1-00000007']
+    assert store.reads_in_window('run0', 0, 60).num_rows == 20
+    # Rollups are aggregated before values are narrowed so compare them approximately
+    for name, rollup in ROLLUPS.items():
+        expected = store._conn.sql(rollup.select.format(rows=rollup.source)).fetchall()
+        actual = store._conn.sql(f'select * from {name}').fetchall()
+        assert_rows_close(sorted(actual, key=str), sorted(expected, key=str))
+
+
+def test_replace_and_compact(store, tmp_path):
+    path = tmp_path / conftest.flowcell_name
+    store.insert_flowcell(write_flowcell(path, run_id='run0', seed=1))
+    store.insert_flowcell(write_flowcell(tmp_path / '1' / conftest.flowcell_name, run_id='run1'))
+    store.insert_flowcell(write_flowcell(path, run_id='run0', reads=10, seed=2))
+
+    store.compact()
+
+    rows = store._conn.sql('select run_id, count(*) from sequencing_summary group by all order by 1').fetchall()
+    assert rows == [('run0', 10), ('run1', 100)]
+    if store.lake_path is None:
+        assert store._conn.sql('select count(*) from runs').fetchone()[0] == 2
+
+
+def test_unknown_end_reason(store, tmp_path):
+    """End reasons added by new versions of MinKNOW are stored"""
+    path = write_flowcell(tmp_path / conftest.flowcell_name)._path
+    summary = next(path.glob('sequencing_summary_*'))
+    summary.write_text(summary.read_text().replace('signal_positive', 'not_an_end_reason'))
+
+    store.insert_flowcell(LocalFlowcellDir(path))
+
+    rows = store._conn.sql("select count(*) from sequencing_summary where end_reason = 'not_an_end_reason'").fetchone()
+    assert rows[0] > 0
+
+
+def test_widen_end_reason(tmp_path, flowcell_path):
+    db_path = str(tmp_path / 'pigeon.duckdb')
+    store = pigeon.store.Store(db_path, compact_schema=True)
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    # As compacted by earlier versions
+    store._conn.execute("alter table sequencing_summary_data alter end_reason type "
+                        "ENUM('signal_positive', 'unblock_mux_change', 'data_service_unblock_mux_change', 'signal_negative')")
+    store.close()
+
+    store = pigeon.store.Store(db_path)
+
+    assert column_types(store, 'sequencing_summary_data')['end_reason'] == 'VARCHAR'
+    assert store._conn.sql('select count(*) from sequencing_summary').fetchone()[0] == 100
+    store.close()
+
+
+def test_widen_model(tmp_path, cramstats_path):
+    db_path = str(tmp_path / 'pigeon.duckdb')
+    store = pigeon.store.Store(db_path, compact_schema=True)
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+    # As compacted by earlier versions
+    store._conn.execute("alter table cramstats alter model type ENUM('fast', 'hac', 'sup')")
+    store.close()
+
+    store = pigeon.store.Store(db_path)
+    store.insert_cramstats(AlignmentCramStatsDir(str(conftest.write_alignments(tmp_path / 'sup.bam')), model='sup@v5'))
+
+    assert column_types(store, 'cramstats')['model'] == 'VARCHAR'
+    assert store._conn.sql("select count(*) from cramstats where model = 'sup@v5'").fetchone()[0] == 38
+    store.close()
+
+
+def test_migrate(tmp_path, flowcell_path, cramstats_path):
+    db_path = str(tmp_path / 'pigeon.duckdb')
+    store = pigeon.store.Store(db_path)
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+    before = {t: store._conn.sql(f'select * from {t} order by all').fetchall()
+              for t in ['final_summary', 'pore_activity', 'throughput', 'sequencing_summary', 'cramstats']}
+    store.close()
+
+    pigeon.store.Store(db_path, compact_schema=True).close()
+    store = pigeon.store.Store(db_path)
+
+    assert store.compact_schema
+    for table_name, rows in before.items():
+        after = store._conn.sql(f'select * from {table_name} order by all').fetchall()
+        assert_rows_close(after, rows)
+
+    # A compact store can later move its largest tables to a lake
+    store.close()
+    store = pigeon.store.Store(db_path, lake_path=str(tmp_path / 'lake'))
+    assert store._conn.sql('select count(distinct run_id) from sequencing_summary').fetchone()[0] == 1
+    store.close()
@@ -0,0 +1,164 @@
+"""
+Unit tests for reading compressed table files.
+
+"""
+
+import gzip
+import pathlib as P
+
+import pytest
+
+import duckdb
+import pysam
+
+import pigeon.store
+from pigeon.cache import DiskCache
+from pigeon.compression import CompressionError, compression_of, decompress_bgzf, is_bgzf, strip_compression
+from pigeon.cramstats_dir import LocalCramStatsDir, RemoteCramStatsDir
+from pigeon.flowcell_dir import FlowcellDir, LocalFlowcellDir, RemoteFlowcellDir
+
+import conftest
+
+SUFFIXES = {'gzip': '.gz', 'bgzip': '.bgz', 'zstd': '.zst'}
+
+bucket = 'test-bucket'
+
+# --------
+# Fixtures
+
+def compress(path: P.Path, data: bytes, compression: str) -> P.Path:
+    """Write data to path with the suffix of a compression"""
+    path = path.with_name(path.name + SUFFIXES[compression])
+    match compression:
+        case 'gzip':
+            path.write_bytes(gzip.compress(data))
+        case 'bgzip':
+            with pysam.BGZFile(str(path), 'wb') as f:
+                f.write(data)
+        case 'zstd':
+            plain = path.with_name(f'.{path.name}.plain')
+            plain.write_bytes(data)
+            duckdb.sql(f"copy (select rtrim(content, chr(10)) from read_text('{plain}')) to '{path}' "
+                       f"(format csv, header false, quote '', escape '', delimiter '{chr(1)}', compression zstd)")
+            plain.unlink()
+
+    return path
+
+
+@pytest.fixture
+def store(tmp_path) -> pigeon.store.Store:
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'))
+    yield store
+    store.close()
+
+
+def count_rows(store):
+    return {t: store._conn.sql(f'select count(*) from {t}').fetchone()[0]
+            for t in ['final_summary', 'pore_activity', 'throughput', 'sequencing_summary', 'cramstats']}
+
+# --------
+# Tests
+
+@pytest.mark.parametrize('suffix', ['', '.gz', '.bgz', '.zst'])
+def test_table_name(suffix):
+    path = f'flowcells/{conftest.flowcell_name}/sequencing_summary_PAO99309_94e07fab_0d5e3ac7.txt{suffix}'
+    assert FlowcellDir._table_name_from_path(path) == 'sequencing_summary'
+    assert strip_compression(path).endswith('.txt')
+
+
+def test_compression_of():
+    assert compression_of('a.txt.gz') == 'gzip'
+    assert compression_of('a.txt.bgz') == 'gzip'
+    assert compression_of('a.txt.zst') == 'zstd'
+    assert compression_of('a.txt') is None
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'bgzip', 'zstd'])
+def test_local(store, tmp_path, compression):
+    path = tmp_path / 'flowcells' / conftest.flowcell_name
+    path.mkdir(parents=True)
+    for name, data in conftest.minknow_files().items():
+        compress(path / name, data, compression)
+    stats = compress(tmp_path / 'hac_PAO99309.cram.stats',
+                     conftest.cramstats_file(f'{conftest.run_id[:8]}-{i:08d}' for i in range(100)), compression)
+
+    fdir = LocalFlowcellDir(path)
+    assert set(fdir.get_available_tables()) == {'final_summary', 'pore_activity', 'throughput', 'sequencing_summary'}
+    store.insert_flowcell(fdir)
+    store.insert_cramstats(LocalCramStatsDir(stats))
+
+    assert count_rows(store) == {'final_summary': 1, 'pore_activity': 5, 'throughput': 5, 'sequencing_summary': 100,
+                                 'cramstats': 100}
+    assert store._conn.sql('select distinct model from cramstats').fetchall() == [('hac',)]
+
+
+def test_decompress_bgzf(tmp_path):
+    data = b''.join(f'{i}\tread-{i}\t{i * 1.5}\n'.encode() for i in range(100_000))
+    path = compress(tmp_path / 'data.txt', data, 'bgzip')
+    assert is_bgzf(str(path))
+    assert not is_bgzf(str(compress(tmp_path / 'data.txt', data, 'gzip')))
+
+    size = decompress_bgzf(str(path), str(tmp_path / 'out.txt'), workers=3)
+
+    assert size == len(data)
+    assert (tmp_path / 'out.txt').read_bytes() == data
+
+    # Flip a bit of the CRC of the first block
+    corrupt = bytearray(path.read_bytes())
+    block_size = int.from_bytes(corrupt[16:18], 'little') + 1
+    corrupt[block_size - 8] ^= 1
+    (tmp_path / 'corrupt.bgz').write_bytes(bytes(corrupt))
+    with pytest.raises(CompressionError):
+        decompress_bgzf(str(tmp_path / 'corrupt.bgz'), str(tmp_path / 'corrupt.txt'), workers=2)
+
+
+def test_cache_decompresses_bgzip(store, tmp_path):
+    objects = {}
+    for name, data in conftest.minknow_files().items():
+        compressed = compress(tmp_path / name, data, 'bgzip' if name.startswith('sequencing') else 'gzip')
+        objects[f'flowcells/hg001/{conftest.flowcell_name}/{compressed.name}'] = compressed.read_bytes()
+    stats = conftest.cramstats_file(f'{conftest.run_id[:8]}-{i:08d}' for i in range(100))
+    objects['stats/hac_PAO99309.cram.stats.bgz'] = compress(tmp_path / 'hac_PAO99309.cram.stats', stats, 'bgzip').read_bytes()
+    s3 = conftest.FakeS3(objects)
+    cache = DiskCache(tmp_path / 'cache', max_bytes=10**7, decompress_workers=2)
+
+    fdir = RemoteFlowcellDir(f's3://{bucket}/flowcells/hg001/{conftest.flowcell_name}', s3, cache=cache)
+    store.insert_flowcell(fdir)
+    store.insert_cramstats(RemoteCramStatsDir(f's3://{bucket}/stats/hac_PAO99309.cram.stats.bgz', s3, cache=cache))
+
+    assert count_rows(store)['sequencing_summary'] == 100
+    assert count_rows(store)['cramstats'] == 100
+    # bgzip files are cached decompressed, gzip files as they are
+    key = 'stats/hac_PAO99309.cram.stats.bgz'
+    path = cache.get(s3, bucket, key, s3.etag(key))
+    assert path.endswith('.cram.stats')
+    assert P.Path(path).read_bytes() == stats
+    assert sorted(P.Path(x).suffix for x in (tmp_path / 'cache').iterdir()) == ['.gz', '.gz', '.gz', '.stats', '.txt']
+    assert cache.stats()['bytes_downloaded'] == sum(len(x) for x in objects.values())
+    assert s3.downloads.count(key) == 1
+
+
+def test_local_decompresses_bgzip(store, tmp_path):
+    path = tmp_path / 'flowcells' / conftest.flowcell_name
+    path.mkdir(parents=True)
+    for name, data in conftest.minknow_files().items():
+        compress(path / name, data, 'bgzip' if name.startswith('sequencing') else 'gzip')
+    stats = compress(tmp_path / 'hac_PAO99309.cram.stats',
+                     conftest.cramstats_file(f'{conftest.run_id[:8]}-{i:08d}' for i in range(100)), 'bgzip')
+    tmp_dir = tmp_path / 'inflated'
+    tmp_dir.mkdir()
+
+    fdir = LocalFlowcellDir(path, decompress_workers=2, tmp_dir=str(tmp_dir))
+    fdir.make_table_relation('sequencing_summary', store._conn)
+    fdir.make_table_relation('throughput', store._conn)
+    # Only the bgzip file is copied, without its compression suffix
+    assert [x.suffix for x in tmp_dir.iterdir()] == ['.txt']
+    fdir.release()
+    assert not list(tmp_dir.iterdir())
+
+    store.insert_flowcell(fdir)
+    store.insert_cramstats(LocalCramStatsDir(stats, decompress_workers=2, tmp_dir=str(tmp_dir)))
+
+    assert count_rows(store) == {'final_summary': 1, 'pore_activity': 5, 'throughput': 5, 'sequencing_summary': 100,
+                                 'cramstats': 100}
+    assert not list(tmp_dir.iterdir())
@@ -0,0 +1,168 @@
+"""
+Unit tests for querying shards of a store as one.
+
+"""
+
+import json
+
+import duckdb
+import pytest
+
+import pigeon.store
+from pigeon.cramstats_dir import LocalCramStatsDir
+from pigeon.federation import FederatedStore
+from pigeon.flowcell_dir import LocalFlowcellDir
+from pigeon.rollups import ROLLUPS
+from pigeon.samples import SAMPLES
+
+import conftest
+
+TABLES = ['final_summary', 'pore_activity', 'throughput', 'sequencing_summary', 'cramstats', 'read_index',
+          'load_manifest']
+
+# --------
+# Fixtures
+
+def write_flowcell(path, run_id, seed):
+    path = path / conftest.flowcell_name
+    path.mkdir(parents=True)
+    for name, data in conftest.minknow_files(run_id=run_id, seed=seed).items():
+        (path / name).write_bytes(data)
+
+    return LocalFlowcellDir(path)
+
+
+def write_cramstats(path, run_id):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(conftest.cramstats_file(f'{run_id[:8]}-{i:08d}' for i in range(0, 100, 2)))
+
+    return LocalCramStatsDir(path)
+
+
+@pytest.fixture
+def shards(tmp_path):
+    """Three shards, of different layouts, and a store of all their runs"""
+    whole = pigeon.store.Store(str(tmp_path / 'whole.duckdb'))
+    paths = []
+    for i, (runs, kwargs) in enumerate([(['run0'], {}),
+                                        (['run1', 'run2'], {'compact_schema': True}),
+                                        (['run3'], {'lake_path': str(tmp_path / 'lake3')})]):
+        store = pigeon.store.Store(str(tmp_path / f'shard{i}.duckdb'), **kwargs)
+        for run_id in runs:
+            fdir = write_flowcell(tmp_path / run_id, run_id, seed=int(run_id[-1]))
+            cdir = write_cramstats(tmp_path / run_id / f'hac_{run_id}.cram.stats', run_id)
+            for s in [store, whole]:
+                s.insert_flowcell(fdir)
+                s.insert_cramstats(cdir)
+        store.publish(str(tmp_path / f'published{i}.duckdb'))
+        store.close()
+        paths.append(str(tmp_path / f'published{i}.duckdb'))
+
+    yield paths, whole
+    whole.close()
+
+
+def rows(store, table_name):
+    return sorted(store._conn.sql(f'select * from {table_name}').fetchall(), key=str)
+
+
+def explain(store, sql):
+    """The (name, extra_info) of each operator of a query's plan"""
+    plan = json.loads(store._conn.sql(f'explain (format json) {sql}').fetchall()[0][1])
+    operators = []
+    while plan:
+        node = plan.pop()
+        operators.append((node['name'].strip(), node.get('extra_info', {})))
+        plan.extend(node.get('children', []))
+    return operators
+
+
+def skipped(operators):
+    """The number of shards skipped, and whether the files of lakes are all skipped"""
+    files = [info['Scanning Files'] for (name, info) in operators if name == 'READ_PARQUET']
+    return [name for (name, _) in operators].count('EMPTY_RESULT'), all(x.startswith('0/') for x in files)
+
+# --------
+# Tests
+
+def test_union(shards):
+    paths, whole = shards
+    store = FederatedStore(paths[:1] + paths[2:])
+    store.add_shard(paths[1])
+
+    for table_name in TABLES + list(SAMPLES):
+        assert len(rows(store, table_name)) == len(rows(whole, table_name)), table_name
+    for table_name in ['final_summary', 'pore_activity', 'throughput', 'read_index', 'sample_sequencing_summary']:
+        assert rows(store, table_name) == rows(whole, table_name), table_name
+    # The compact shard narrows values, so compare rollups approximately
+    for table_name in ROLLUPS:
+        for a, e in zip(rows(store, table_name), rows(whole, table_name)):
+            assert a == pytest.approx(e, rel=1e-5), table_name
+
+    assert store.sketch('sequence_length_template').count == whole.sketch('sequence_length_template').count == 400
+    assert store.sketch('iden', model='hac').count == 200
+    assert sorted(store.get_reads(['run2-00000007', 'run3-00000001'])['read_id'].to_pylist()) == \
+        ['run2-00000007', 'run3-00000001']
+    assert store.reads_in_window('run1', 0, 60).num_rows == 20
+    assert store.run_alignments('run0').read_all().num_rows == 50
+    store.close()
+
+
+def test_compact_shard(shards):
+    paths, _ = shards
+    store = FederatedStore(paths[1:2])
+    shard = duckdb.connect(paths[1], read_only=True)
+
+    # The views of the shard are created again over its tables
+    for table_name in ['sequencing_summary', 'pore_activity', 'pore_activity_states']:
+        sql = f'select * from {table_name} order by all'
+        assert store._conn.sql(sql).fetchall() == shard.sql(sql).fetchall(), table_name
+    shard.close()
+    store.close()
+
+
+def test_skips_shards(shards):
+    paths, _ = shards
+    store = FederatedStore(paths)
+
+    # Neither the table of shard 0 nor the files of the lake of shard 2 are read
+    assert skipped(explain(store, "select * from sequencing_summary where run_id = 'run1'")) == (1, True)
+    assert store.run_reads('run1').read_all().num_rows == 100
+    store.close()
+
+
+def test_skips_shards_by_experiment_and_model(shards):
+    paths, _ = shards
+    store = FederatedStore(paths)
+
+    assert skipped(explain(store, "select * from sequencing_summary where experiment_id = 'other'")) == (2, True)
+    assert skipped(explain(store, "select * from cramstats where model = 'sup'")) == (2, True)
+    assert store._conn.sql("select count(*) from cramstats where model = 'hac'").fetchone()[0] == 200
+    store.close()
+
+
+def test_read_only(shards, tmp_path):
+    paths, _ = shards
+    store = FederatedStore(paths)
+
+    with pytest.raises(ValueError, match='read-only'):
+        store.insert_flowcell(write_flowcell(tmp_path / 'run4', 'run4', seed=4))
+    store.close()
+
+
+def test_refresh(shards, tmp_path):
+    paths, _ = shards
+    store = FederatedStore(paths)
+    before = [open(x, 'rb').read() for x in paths]
+
+    shard = pigeon.store.Store(str(tmp_path / 'shard0.duckdb'))
+    shard.insert_flowcell(write_flowcell(tmp_path / 'run4', 'run4', seed=4))
+    shard.publish(paths[0])
+    shard.close()
+    assert store._conn.sql('select count(distinct run_id) from sequencing_summary').fetchone()[0] == 4
+
+    store.refresh()
+    assert store._conn.sql('select count(distinct run_id) from sequencing_summary').fetchone()[0] == 5
+    # Other shards are untouched
+    assert [open(x, 'rb').read() for x in paths[1:]] == before[1:]
+    store.close()
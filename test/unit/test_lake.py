@@ -0,0 +1,163 @@
+"""
+Unit tests for stores which keep their largest tables as partitioned parquet.
+
+"""
+
+import pytest
+
+import pigeon.store
+from pigeon.cramstats_dir import LocalCramStatsDir
+from pigeon.flowcell_dir import LocalFlowcellDir
+
+import conftest
+
+# --------
+# Fixtures
+
+@pytest.fixture
+def lake_path(tmp_path):
+    return tmp_path / 'lake'
+
+
+@pytest.fixture
+def store(tmp_path, lake_path) -> pigeon.store.Store:
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'), lake_path=str(lake_path))
+    yield store
+    store.close()
+
+
+def parquet_files(path):
+    return sorted(str(x.relative_to(path)) for x in path.rglob('*.parquet') if 'empty' not in x.name)
+
+# --------
+# Tests
+
+def test_empty_views(store):
+    for table_name in pigeon.store.LAKE_PARTITIONS:
+        assert store._conn.sql(f'select count(*) from {table_name}').fetchone()[0] == 0
+        schema = store._schema(table_name)
+        assert store._conn.sql(f'select * from {table_name}').columns == [x[0] for x in schema]
+
+
+def test_insert(store, lake_path, flowcell_path, cramstats_path):
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+
+    files = parquet_files(lake_path)
+    assert len(files) == 2
+    assert files[0].startswith('cramstats/model=hac/')
+    assert files[1].startswith(f'sequencing_summary/experiment_id={conftest.experiment_id}/run_id={conftest.run_id}/')
+
+    assert store._conn.sql('select count(*) from sequencing_summary').fetchone()[0] == 100
+    row = store._conn.sql('select distinct model from cramstats').fetchall()
+    assert row == [('hac',)]
+
+
+def test_replace_run(store, lake_path, flowcell_path):
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    before = parquet_files(lake_path)
+
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path), force=True)
+
+    after = parquet_files(lake_path)
+    assert len(after) == 1 and after != before
+    assert store._conn.sql('select count(*) from sequencing_summary').fetchone()[0] == 100
+
+
+def test_replace_cramstats(store, lake_path, cramstats_path):
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+    cramstats_path.write_bytes(conftest.cramstats_file(['read1', 'read2']))
+
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+
+    assert len(parquet_files(lake_path)) == 1
+    assert store._conn.sql('select count(*) from cramstats').fetchone()[0] == 2
+
+
+def test_rollback_removes_files(store, lake_path, flowcell_path, monkeypatch):
+    def fail(*args):
+        raise RuntimeError('simulated failure')
+    monkeypatch.setattr(store, '_record_source', fail)
+
+    with pytest.raises(RuntimeError):
+        store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+
+    assert parquet_files(lake_path) == []
+
+
+def test_interrupted_transaction(tmp_path, lake_path, flowcell_path, monkeypatch):
+    """Files left by a transaction which never committed are not read, and are removed on reopening"""
+    db_path = str(tmp_path / 'pigeon.duckdb')
+    store = pigeon.store.Store(db_path, lake_path=str(lake_path))
+    record_source = store._record_source
+    def fail(source, table_name, *args):
+        if table_name == 'sequencing_summary':
+            raise RuntimeError('simulated failure')
+        record_source(source, table_name, *args)
+    monkeypatch.setattr(store, '_record_source', fail)
+    # As if the process died before cleaning up
+    monkeypatch.setattr(pigeon.store, '_remove_files', lambda paths: None)
+
+    with pytest.raises(RuntimeError):
+        store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    monkeypatch.undo()
+
+    assert len(parquet_files(lake_path)) == 1
+    assert store._conn.sql('select count(*) from sequencing_summary').fetchone()[0] == 0
+    store.close()
+
+    store = pigeon.store.Store(db_path)
+    assert parquet_files(lake_path) == []
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    assert store._conn.sql('select count(*) from sequencing_summary').fetchone()[0] == 100
+    store.close()
+
+
+def test_partition_pruning(store, tmp_path):
+    for i in range(3):
+        path = tmp_path / str(i) / conftest.flowcell_name
+        path.mkdir(parents=True)
+        for name, data in conftest.minknow_files(run_id=f'run{i}').items():
+            (path / name).write_bytes(data)
+        store.insert_flowcell(LocalFlowcellDir(path))
+
+    plan = store._conn.sql("explain (format json) select count(*) from sequencing_summary where run_id = 'run1'").fetchall()
+
+    assert store._conn.sql("select count(*) from sequencing_summary where run_id = 'run1'").fetchone()[0] == 100
+    assert '"Scanning Files": "1/' in plan[0][1]
+
+
+def test_reopen_and_migrate(tmp_path, lake_path, flowcell_path):
+    db_path = str(tmp_path / 'pigeon.duckdb')
+    store = pigeon.store.Store(db_path)
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    store.close()
+
+    # Existing rows move to the lake, which is remembered by the database
+    pigeon.store.Store(db_path, lake_path=str(lake_path)).close()
+    store = pigeon.store.Store(db_path)
+
+    assert store.lake_path == str(lake_path)
+    assert store._conn.sql('select count(*) from sequencing_summary').fetchone()[0] == 100
+    assert len(parquet_files(lake_path)) == 1
+    store.close()
+
+    with pytest.raises(ValueError):
+        pigeon.store.Store(db_path, lake_path=str(tmp_path / 'other'))
+
+
+def test_compact(store, lake_path, flowcell_path):
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    # Split the run across two files
+    with store._transaction():
+        scan = store._lake_scan('sequencing_summary')
+        store._write_lake('sequencing_summary', f'select * from {scan} where start_time >= 150', [], 'second')
+        store._write_lake('sequencing_summary', f'select * from {scan} where start_time < 150', [], 'first')
+        store._drop_lake_files('sequencing_summary', [str(lake_path / x) for x in parquet_files(lake_path)
+                                                       if 'second' not in x and 'first' not in x])
+
+    store.compact()
+
+    assert len(parquet_files(lake_path)) == 1
+    rows = store._conn.sql('select start_time from sequencing_summary').fetchall()
+    assert len(rows) == 100 and rows == sorted(rows)
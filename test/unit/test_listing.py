@@ -0,0 +1,54 @@
+"""
+Unit tests for cached S3 listings using a fake S3 client.
+
+"""
+
+from pigeon.listing import S3Listing
+from pigeon.flowcell_dir import RemoteFlowcellDir
+
+import conftest
+
+bucket = 'test-bucket'
+flowcell = f'flowcells/hg001/{conftest.flowcell_name}'
+
+# --------
+# Tests
+
+def test_pagination(s3):
+    listing = S3Listing(s3).list(bucket, f'{flowcell}/')
+
+    assert len(listing.objects) == 4
+    assert listing.prefixes == [f'{flowcell}/pod5/']
+
+
+def test_cached(s3):
+    fdir = RemoteFlowcellDir(f's3://{bucket}/{flowcell}', s3_client=s3)
+
+    tables1 = fdir.get_available_tables()
+    tables2 = fdir.get_available_tables()
+
+    assert tables1 == tables2
+    assert set(tables1) == {'final_summary', 'pore_activity', 'throughput', 'sequencing_summary'}
+    assert len(s3.calls) == 1
+
+
+def test_ttl_expiry(s3):
+    listing = S3Listing(s3, ttl=0.0)
+
+    listing.list(bucket, f'{flowcell}/')
+    listing.list(bucket, f'{flowcell}/')
+
+    assert len(s3.calls) == 2
+
+
+def test_derived_from_parent(s3):
+    listing = S3Listing(s3)
+    listing.list(bucket, 'flowcells/', recursive=True)
+
+    genomes = listing.list(bucket, 'flowcells/')
+    fdir = RemoteFlowcellDir(f's3://{bucket}/{flowcell}', s3_client=s3, listing=listing)
+
+    assert genomes.prefixes == ['flowcells/hg001/', 'flowcells/hg002/']
+    assert 'sequencing_summary' in fdir.get_available_tables()
+    assert listing.head(bucket, f'{flowcell}/pod5/file1.pod5').size == 10
+    assert s3.calls == [('flowcells/', None)]
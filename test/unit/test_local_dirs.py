@@ -0,0 +1,109 @@
+"""
+Unit tests for flowcell directories and cram.stats files on a local filesystem.
+
+"""
+
+import pytest
+
+import duckdb
+
+import pigeon.flowcell_dir
+import pigeon.store
+from pigeon.cramstats_dir import LocalCramStatsDir
+from pigeon.flowcell_dir import LocalFlowcellDir, TableNotPresent
+from pigeon.schema import SchemaMismatch
+
+import conftest
+
+# --------
+# Fixtures
+
+@pytest.fixture
+def store(tmp_path) -> pigeon.store.Store:
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'))
+    yield store
+    store.close()
+
+# --------
+# Tests
+
+def test_available_tables(flowcell_path):
+    (flowcell_path / 'other_notes.txt').write_text('ignored')
+    (flowcell_path / 'pod5').mkdir()
+
+    tables = LocalFlowcellDir(flowcell_path).get_available_tables()
+
+    assert set(tables) == {'final_summary', 'pore_activity', 'throughput', 'sequencing_summary'}
+    assert str(tables['final_summary']).startswith('final_summary')
+
+
+@pytest.mark.parametrize('table_name', pigeon.flowcell_dir.FC_SCHEMAS.keys())
+def test_relation_columns(table_name, flowcell_path, conn):
+    """LocalFlowcellDir can create a relation for each table with the correct columns"""
+    columns = {x[0] for x in pigeon.flowcell_dir.FC_SCHEMAS[table_name]}
+    if table_name == 'pore_activity':
+        columns = set(pigeon.flowcell_dir.PORE_ACTIVITY_COLUMNS)
+    elif table_name == 'throughput':
+        columns = columns ^ {'experiment_id', 'run_id'}
+
+    rel = LocalFlowcellDir(flowcell_path).make_table_relation(table_name, conn)
+
+    assert set(rel.columns) == columns
+
+
+def test_schema_mismatch(flowcell_path, conn):
+    path = flowcell_path / 'sequencing_summary_PAO99309_94e07fab_0d5e3ac7.txt'
+    path.write_text(path.read_text().replace('mean_qscore_template', 'mean_qscore'))
+
+    with pytest.raises(SchemaMismatch, match='mean_qscore'):
+        LocalFlowcellDir(flowcell_path).make_table_relation('sequencing_summary', conn)
+
+
+def test_unknown_channel_state(store, flowcell_path):
+    """States added by newer versions of MinKNOW are kept, though not in the pore_activity view"""
+    path = flowcell_path / 'pore_activity_PAO99309_94e07fab_0d5e3ac7.csv'
+    path.write_text(path.read_text() + 'new_state,5,100\n')
+
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+
+    assert store._conn.sql("select state_time from pore_activity_states where channel_state = 'new_state'").fetchall() == \
+        [(100,)]
+    assert store._conn.sql('select count(*) from pore_activity').fetchone()[0] == 5
+
+
+def test_bad_value(flowcell_path, conn):
+    path = flowcell_path / 'throughput_PAO99309_94e07fab_0d5e3ac7.csv'
+    path.write_text(path.read_text() + '6,1,1,1,1,1,1,1,1,x\n')
+
+    rel = LocalFlowcellDir(flowcell_path).make_table_relation('throughput', conn)
+    with pytest.raises(duckdb.ConversionException):
+        rel.fetchall()
+
+
+def test_missing_table(flowcell_path, conn):
+    (flowcell_path / 'final_summary_PAO99309_94e07fab_0d5e3ac7.txt').unlink()
+
+    with pytest.raises(TableNotPresent):
+        LocalFlowcellDir(flowcell_path).make_table_relation('final_summary', conn)
+
+
+def test_source_info_changes(flowcell_path):
+    fdir = LocalFlowcellDir(flowcell_path)
+    info1 = fdir.get_source_info('throughput')
+
+    path = flowcell_path / 'throughput_PAO99309_94e07fab_0d5e3ac7.csv'
+    path.write_bytes(path.read_bytes() + b'6,1,1,1,1,1,1,1,1,1\n')
+    info2 = fdir.get_source_info('throughput')
+
+    assert info1.path == info2.path == str(path)
+    assert info1.etag != info2.etag
+
+
+def test_store(flowcell_path, cramstats_path, store):
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+
+    assert store._conn.sql('select count(*) from sequencing_summary').fetchone()[0] == 100
+    assert store._conn.sql('select distinct model from cramstats').fetchall() == [('hac',)]
+    assert store._conn.sql('select count(*) from load_manifest').fetchone()[0] == 5
@@ -0,0 +1,100 @@
+"""
+Unit tests for incremental ingest using the load manifest.
+
+"""
+
+import pytest
+
+import pigeon.store
+from pigeon.cache import DiskCache
+from pigeon.cramstats_dir import RemoteCramStatsDir
+from pigeon.flowcell_dir import RemoteFlowcellDir
+
+import conftest
+
+bucket = 'test-bucket'
+flowcell_prefix = f'flowcells/hg001/{conftest.flowcell_name}'
+cramstats_key = 'stats/hac_PAO99309.cram.stats'
+
+# --------
+# Fixtures
+
+@pytest.fixture
+def cache(tmp_path) -> DiskCache:
+    return DiskCache(tmp_path / 'cache', max_bytes=10**8)
+
+
+@pytest.fixture
+def store(tmp_path) -> pigeon.store.Store:
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'))
+    yield store
+    store.close()
+
+
+def flowcell_dir(s3, cache) -> RemoteFlowcellDir:
+    # A new directory each time so listings aren't cached between ingests
+    return RemoteFlowcellDir(f's3://{bucket}/{flowcell_prefix}', s3_client=s3, cache=cache)
+
+
+def count(store, table_name):
+    return store._conn.sql(f'select count(*) from {table_name}').fetchone()[0]
+
+# --------
+# Tests
+
+def test_manifest_recorded(s3, cache, store):
+    store.insert_flowcell(flowcell_dir(s3, cache))
+
+    rows = store._conn.sql('select table_name, run_id, rows from load_manifest order by table_name').fetchall()
+
+    assert rows == [
+        ('final_summary', conftest.run_id, 1),
+        ('pore_activity', conftest.run_id, 50),
+        ('sequencing_summary', conftest.run_id, 100),
+        ('throughput', conftest.run_id, 5),
+    ]
+
+
+def test_skip_unchanged(s3, cache, store):
+    store.insert_flowcell(flowcell_dir(s3, cache))
+    store.insert_flowcell(flowcell_dir(s3, cache))
+
+    assert count(store, 'sequencing_summary') == 100
+    assert cache.stats()['misses'] == 4
+    assert cache.stats()['hits'] == 0
+
+
+def test_replace_changed(s3, cache, store):
+    store.insert_flowcell(flowcell_dir(s3, cache))
+
+    key = f'{flowcell_prefix}/sequencing_summary_PAO99309_94e07fab_0d5e3ac7.txt'
+    s3.objects[key] = conftest.minknow_files(reads=150)['sequencing_summary_PAO99309_94e07fab_0d5e3ac7.txt']
+    store.insert_flowcell(flowcell_dir(s3, cache))
+
+    assert count(store, 'final_summary') == 1
+    assert count(store, 'throughput') == 5
+    assert count(store, 'sequencing_summary') == 150
+    assert count(store, 'load_manifest') == 4
+
+
+def test_force(s3, cache, store):
+    store.insert_flowcell(flowcell_dir(s3, cache))
+    store.insert_flowcell(flowcell_dir(s3, cache), force=True)
+
+    assert count(store, 'sequencing_summary') == 100
+    assert cache.stats()['hits'] == 4
+
+
+def test_cramstats_manifest(s3, cache, store):
+    def cramstats_dir():
+        return RemoteCramStatsDir(f's3://{bucket}/{cramstats_key}', s3_client=s3, cache=cache)
+
+    store.insert_cramstats(cramstats_dir())
+    store.insert_cramstats(cramstats_dir())
+    assert count(store, 'cramstats') == 100
+
+    s3.objects[cramstats_key] = conftest.cramstats_file([f'{conftest.run_id[:8]}-{i:08d}' for i in range(120)], seed=2)
+    store.insert_cramstats(cramstats_dir())
+
+    assert count(store, 'cramstats') == 120
+    assert store._conn.sql("select rows from load_manifest where table_name = 'cramstats'").fetchall() == [(120,)]
@@ -0,0 +1,89 @@
+"""
+Unit tests for the ingest metrics recorded by Store.
+
+"""
+
+import json
+
+import pytest
+
+import pigeon.store
+from pigeon.cramstats_dir import LocalCramStatsDir
+from pigeon.flowcell_dir import LocalFlowcellDir
+
+import conftest
+
+# --------
+# Fixtures
+
+@pytest.fixture
+def store(tmp_path) -> pigeon.store.Store:
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'))
+    yield store
+    store.close()
+
+# --------
+# Tests
+
+def test_flowcell_stages(store, flowcell_path):
+    hooked = []
+    store.add_ingest_hook(hooked.append)
+
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+
+    rows = store._conn.sql("""
+        select stage, table_name, rows, bytes, run_id, error from ingest_metrics order by started_at
+        """).fetchall()
+    stages = [(stage, table_name) for (stage, table_name, *_) in rows]
+    assert stages[:2] == [('list', None), ('open', 'final_summary')]
+    assert ('delete', None) in stages and stages[-1] == ('commit', None)
+    inserts = {table_name: (rows, size) for (stage, table_name, rows, size, *_) in rows if stage == 'insert'}
+    assert inserts['sequencing_summary'][0] == 100
+    assert inserts['sequencing_summary'][1] == next(flowcell_path.glob('sequencing_summary_*')).stat().st_size
+    assert {x[4] for x in rows} == {conftest.run_id}
+    assert all(x[5] is None for x in rows)
+
+    assert len(hooked) == 1 and len(hooked[0]) == len(rows)
+
+
+def test_parallel_fetch(store, tmp_path):
+    paths = []
+    for i in range(2):
+        path = tmp_path / str(i) / conftest.flowcell_name
+        path.mkdir(parents=True)
+        for name, data in conftest.minknow_files(run_id=f'run{i}', seed=i).items():
+            (path / name).write_bytes(data)
+        paths.append(LocalFlowcellDir(path))
+
+    store.insert_flowcells(paths, workers=2)
+
+    rows = store._conn.sql("""
+        select run_id, rows from ingest_metrics where stage = 'fetch' and table_name = 'sequencing_summary'
+        """).fetchall()
+    assert sorted(rows) == [('run0', 100), ('run1', 100)]
+    assert store._conn.sql('select count(distinct load_id) from ingest_metrics').fetchone()[0] == 2
+
+
+def test_cramstats_profile(tmp_path, cramstats_path):
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'), profile_ingest=True)
+
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+
+    rows, profile = store._conn.sql("select rows, profile from ingest_metrics where stage = 'insert'").fetchone()
+    assert rows == 100
+    assert 'cpu_time' in json.loads(profile)
+    store.close()
+
+
+def test_failure_recorded(store, tmp_path):
+    path = tmp_path / conftest.flowcell_name
+    path.mkdir()
+    for name, data in conftest.minknow_files().items():
+        (path / name).write_bytes(b'not,a\nvalid"' if name.startswith('sequencing_summary') else data)
+
+    failures = store.insert_flowcells([LocalFlowcellDir(path)])
+
+    assert len(failures) == 1
+    # The file's header is checked when it is opened
+    error = store._conn.sql('select stage, table_name from ingest_metrics where error is not null').fetchall()
+    assert error == [('open', 'sequencing_summary')]
@@ -0,0 +1,92 @@
+"""
+Unit tests for publishing snapshots of a store to read-only readers.
+
+"""
+
+import pytest
+
+import pigeon.store
+from pigeon.flowcell_dir import LocalFlowcellDir
+
+import conftest
+
+# --------
+# Fixtures
+
+@pytest.fixture(params=[False, True], ids=['tables', 'lake'])
+def store(request, tmp_path) -> pigeon.store.Store:
+    lake_path = str(tmp_path / 'lake') if request.param else None
+    store = pigeon.store.Store(str(tmp_path / 'staging.duckdb'), lake_path=lake_path)
+    yield store
+    store.close()
+
+
+def write_flowcell(path, **kwargs):
+    path.mkdir(parents=True, exist_ok=True)
+    for name, data in conftest.minknow_files(**kwargs).items():
+        (path / name).write_bytes(data)
+
+    return LocalFlowcellDir(path)
+
+
+def lake_files(path):
+    return [x for x in path.rglob('*.parquet') if x.name != 'empty.parquet']
+
+
+def count_reads(store):
+    return store._conn.sql('select count(*) from sequencing_summary').fetchone()[0]
+
+# --------
+# Tests
+
+def test_publish(store, tmp_path):
+    published = str(tmp_path / 'pigeon.duckdb')
+    store.insert_flowcell(write_flowcell(tmp_path / '0' / conftest.flowcell_name, run_id='run0', seed=0))
+    store.publish(published)
+    reader = pigeon.store.Store(published, read_only=True)
+
+    # The staging store can be written while the snapshot is read
+    store.insert_flowcell(write_flowcell(tmp_path / '1' / conftest.flowcell_name, run_id='run1', seed=1))
+    assert count_reads(reader) == 100
+
+    store.publish(published)
+    assert count_reads(reader) == 100
+    reader.close()
+
+    reader = pigeon.store.Store(published, read_only=True)
+    assert count_reads(reader) == 200
+    assert len(reader.get_reads([f'{conftest.run_id[:8]}-00000001'])) == 0
+    reader.close()
+
+
+def test_publish_replaced_run(store, tmp_path):
+    """Snapshots keep reading the rows of a run replaced after they were published"""
+    published = str(tmp_path / 'pigeon.duckdb')
+    path = tmp_path / conftest.flowcell_name
+    store.insert_flowcell(write_flowcell(path, run_id='run0', seed=0))
+    store.publish(published)
+    reader = pigeon.store.Store(published, read_only=True)
+
+    store.insert_flowcell(write_flowcell(path, run_id='run0', reads=10, seed=1))
+    assert count_reads(reader) == 100
+    assert count_reads(store) == 10
+
+    # Readers connected to the previous snapshot can still read it
+    store.publish(published)
+    assert count_reads(reader) == 100
+    reader.close()
+    if store.lake_path:
+        assert len(lake_files(tmp_path / 'lake')) == 2
+
+    # Until it is no longer one of the latest two
+    store.publish(published)
+    reader = pigeon.store.Store(published, read_only=True)
+    assert count_reads(reader) == 10
+    reader.close()
+    if store.lake_path:
+        assert len(lake_files(tmp_path / 'lake')) == 1
+
+
+def test_publish_over_itself(store):
+    with pytest.raises(ValueError):
+        store.publish(store.path)
@@ -0,0 +1,92 @@
+"""
+Unit tests for the streaming query API of Store.
+
+"""
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+import pigeon.store
+from pigeon.cramstats_dir import LocalCramStatsDir
+from pigeon.flowcell_dir import LocalFlowcellDir
+from pigeon.query import iter_numpy, numpy_columns
+
+import conftest
+
+# --------
+# Fixtures
+
+@pytest.fixture
+def store(tmp_path, flowcell_path, cramstats_path) -> pigeon.store.Store:
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'))
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+    yield store
+    store.close()
+
+# --------
+# Tests
+
+def test_query_batches(store):
+    reader = store.query('select * from sequencing_summary where passes_filtering = ?', [True], batch_size=7)
+
+    batches = list(reader)
+
+    assert all(b.num_rows <= 7 for b in batches)
+    assert sum(b.num_rows for b in batches) == \
+        store._conn.sql('select count(*) from sequencing_summary where passes_filtering').fetchone()[0]
+    assert batches[0].schema == reader.schema
+
+
+def test_query_while_writing(store, tmp_path):
+    reader = store.query('select read_id from sequencing_summary', batch_size=10)
+    first = reader.read_next_batch()
+
+    store._conn.execute('create table other as select 1 as x')
+
+    assert first.num_rows + sum(b.num_rows for b in reader) == 100
+
+
+@pytest.mark.parametrize('ordered', [False, True])
+def test_run_reads(store, ordered):
+    reader = store.run_reads(conftest.run_id, ['start_time', 'sequence_length_template'], batch_size=30,
+                             ordered=ordered)
+
+    table = reader.read_all()
+
+    assert table.column_names == ['start_time', 'sequence_length_template']
+    assert table.num_rows == 100
+    if ordered:
+        assert table['start_time'].to_pylist() == sorted(table['start_time'].to_pylist())
+
+
+def test_run_reads_unknown_column(store):
+    with pytest.raises(ValueError):
+        store.run_reads(conftest.run_id, ['start_time; drop table sequencing_summary'])
+
+
+def test_run_alignments(store):
+    assert store.run_alignments(conftest.run_id, 'hac', ['name', 'iden']).read_all().num_rows == 100
+    assert store.run_alignments(conftest.run_id, 'sup').read_all().num_rows == 0
+    assert store.run_alignments('other').read_all().num_rows == 0
+
+
+def test_numpy_zero_copy(store):
+    batch = store.query('select start_time, read_id from sequencing_summary').read_next_batch()
+
+    arrays = numpy_columns(batch, ['start_time'])
+
+    # A view of the arrow buffer rather than a copy
+    buffer = batch.column('start_time').buffers()[1]
+    assert arrays['start_time'].ctypes.data == buffer.address + batch.column('start_time').offset * 8
+    with pytest.raises(pa.ArrowInvalid):
+        numpy_columns(batch, ['read_id'])
+    assert numpy_columns(batch, ['read_id'], zero_copy_only=False)['read_id'].dtype == object
+
+
+def test_iter_numpy(store):
+    total = sum(cols['sequence_length_template'].sum()
+                for cols in iter_numpy(store.run_reads(conftest.run_id, batch_size=16), ['sequence_length_template']))
+
+    assert total == store._conn.sql('select sum(sequence_length_template) from sequencing_summary').fetchone()[0]
@@ -0,0 +1,97 @@
+"""
+Unit tests for looking up reads by read_id and time window.
+
+"""
+
+import pytest
+
+import pigeon.store
+from pigeon.flowcell_dir import LocalFlowcellDir
+
+import conftest
+
+# --------
+# Fixtures
+
+@pytest.fixture(params=[False, True], ids=['tables', 'lake'])
+def store(request, tmp_path) -> pigeon.store.Store:
+    lake_path = str(tmp_path / 'lake') if request.param else None
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'), lake_path=lake_path)
+    for i in range(3):
+        path = tmp_path / str(i) / conftest.flowcell_name
+        path.mkdir(parents=True)
+        for name, data in conftest.minknow_files(run_id=f'run{i}', seed=i).items():
+            (path / name).write_bytes(data)
+        store.insert_flowcell(LocalFlowcellDir(path))
+    yield store
+    store.close()
+
+
+def read_id(run: int, i: int) -> str:
+    return f'run{run}-{i:08d}'
+
+# --------
+# Tests
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_get_reads(store, compact):
+    if compact:
+        store.compact()
+    read_ids = [read_id(0, 5), read_id(2, 99), read_id(2, 0), 'not-a-read']
+
+    table = store.get_reads(read_ids)
+
+    assert sorted(table['read_id'].to_pylist()) == sorted(read_ids[:3])
+    assert table.column_names == [x[0] for x in store._schema('sequencing_summary')]
+
+
+@conftest.index_scans_lists
+def test_get_reads_index_scan(store, tmp_path):
+    """Read ids are looked up in the index of read_index rather than by scanning it"""
+    store.compact()
+    profile = conftest.read_profile(store, tmp_path / 'profile.json',
+                                    lambda: store._locate_reads([read_id(0, 5), read_id(2, 99)]))
+
+    assert 'Index Scan' in profile
+    assert 'Sequential Scan' not in profile
+
+
+def test_get_reads_none(store):
+    table = store.get_reads([])
+
+    assert table.num_rows == 0
+    assert 'read_id' in table.column_names
+
+
+def test_get_reads_replaced_run(store, tmp_path):
+    path = tmp_path / '0' / conftest.flowcell_name
+    for name, data in conftest.minknow_files(run_id='run0', reads=10).items():
+        (path / name).write_bytes(data)
+    store.insert_flowcell(LocalFlowcellDir(path))
+
+    assert store.get_reads([read_id(0, 5)]).num_rows == 1
+    assert store.get_reads([read_id(0, 50)]).num_rows == 0
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_reads_in_window(store, compact):
+    if compact:
+        store.compact()
+
+    table = store.reads_in_window('run1', 60.0, 120.0)
+
+    start_times = table['start_time'].to_pylist()
+    assert len(start_times) == 20
+    assert start_times == sorted(start_times)
+    assert set(table['run_id'].to_pylist()) == {'run1'}
+
+
+def test_compact_order(store):
+    store.compact()
+
+    if store.lake_path is None:
+        rows = store._conn.sql('select run_id, start_time from sequencing_summary').fetchall()
+        assert rows == sorted(rows)
+    rows = store._conn.sql('select read_id from read_index').fetchall()
+    assert rows == sorted(rows)
+    assert len(rows) == 300
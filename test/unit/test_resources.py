@@ -0,0 +1,132 @@
+"""
+Unit tests for loading with a resource profile.
+
+"""
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+import pigeon.store
+from pigeon.cramstats_dir import LocalCramStatsDir
+from pigeon.flowcell_dir import LocalFlowcellDir
+from pigeon.synthetic import Flowcell, write_cramstats, write_flowcell
+
+from test_rollups import assert_rollups_match
+
+# Loads a flowcell in a fresh process, after a small one to leave out the memory of
+# loading anything once, and prints its RSS before the load and its peak RSS during it.
+# ru_maxrss is kept across exec, so would include the peak of pytest.
+LOAD_SCRIPT = """
+import json, sys
+import pigeon.store
+from pigeon.flowcell_dir import LocalFlowcellDir
+
+def rss(field):
+    return next(int(x.split()[1]) * 1024 for x in open('/proc/self/status') if x.startswith(field + ':'))
+
+first_path, path, db_path, memory_limit = sys.argv[1:]
+resources = pigeon.store.ResourceProfile(memory_limit=memory_limit, threads=1, preserve_insertion_order=False,
+                                         chunk_rows=100_000, allocator_flush_threshold='16MB')
+store = pigeon.store.Store(db_path, resources=resources)
+store.insert_flowcell(LocalFlowcellDir(first_path))
+# Reset the peak to the current RSS
+with open('/proc/self/clear_refs', 'w') as f:
+    f.write('5')
+base = rss('VmRSS')
+store.insert_flowcell(LocalFlowcellDir(path))
+rows = store._conn.sql('select count(*) from sequencing_summary').fetchone()[0] - 2000
+print(json.dumps({'base': base, 'peak': rss('VmHWM'), 'rows': rows}))
+"""
+
+MEMORY_LIMIT = 128 * 2**20
+
+# Memory used by a load besides that within duckdb's memory limit, such as the buffers
+# of the CSV reader and the allocations of python and pyarrow
+MEMORY_OVERHEAD = 96 * 2**20
+
+# --------
+# Fixtures
+
+@pytest.fixture
+def flowcell_path(tmp_path):
+    return write_flowcell(tmp_path / 'flowcells', Flowcell(1), reads=2000, hours=2)
+
+
+def peak_rss(first_path, path, db_path, memory_limit):
+    """
+    Load a flowcell of 2000 reads then another in a subprocess, and return the growth of
+    its peak RSS during the second load and the rows loaded
+
+    """
+    result = subprocess.run([sys.executable, '-c', LOAD_SCRIPT, str(first_path), str(path), str(db_path), memory_limit],
+                            check=True, capture_output=True, text=True)
+    usage = json.loads(result.stdout.splitlines()[-1])
+    return usage['peak'] - usage['base'], usage['rows']
+
+# --------
+# Tests
+
+def test_config(tmp_path):
+    resources = pigeon.store.ResourceProfile(memory_limit='256MB', threads=1, temp_directory=str(tmp_path / 'spill'))
+    assert resources.config() == {'memory_limit': '256MB', 'threads': 1, 'temp_directory': str(tmp_path / 'spill')}
+
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'), resources=resources)
+    assert store._conn.sql("select current_setting('threads'), current_setting('temp_directory')").fetchone() == \
+        (1, str(tmp_path / 'spill'))
+    store.close()
+
+    resources = pigeon.store.ResourceProfile(allocator_flush_threshold='16MB')
+    assert resources.config() == {'allocator_flush_threshold': '16MB',
+                                  'allocator_bulk_deallocation_flush_threshold': '16MB'}
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('lake', [False, True])
+def test_chunked_load(tmp_path, flowcell_path, workers, lake):
+    """Loading in chunks gives the same tables, rollups and samples"""
+    cramstats_path = write_cramstats(tmp_path / 'cramstats', Flowcell(1), reads=500)
+    stores = []
+    for name, resources in [('whole', None), ('chunked', pigeon.store.ResourceProfile(chunk_rows=300))]:
+        lake_path = str(tmp_path / f'{name}-lake') if lake else None
+        store = pigeon.store.Store(str(tmp_path / f'{name}.duckdb'), lake_path=lake_path, resources=resources,
+                                   sample_size=100)
+        assert store.insert_flowcells([LocalFlowcellDir(flowcell_path)], workers=workers) == []
+        store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+        # A changed file replaces the rows of its reads
+        write_cramstats(tmp_path / 'cramstats', Flowcell(1), reads=400)
+        store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+        write_cramstats(tmp_path / 'cramstats', Flowcell(1), reads=500)
+        stores.append(store)
+
+    whole, chunked = stores
+    for table_name in ['sequencing_summary', 'read_index', 'cramstats', 'sample_sequencing_summary',
+                       'sample_cramstats']:
+        sql = f'select * from {table_name} order by all'
+        assert chunked._conn.sql(sql).fetchall() == whole._conn.sql(sql).fetchall(), table_name
+    assert chunked._conn.sql('select count(*) from sequencing_summary').fetchone()[0] == 2000
+    assert_rollups_match(chunked)
+    for store in stores:
+        store.close()
+
+
+def test_memory_bound(tmp_path):
+    """Peak memory doesn't grow with the size of the source"""
+    first = write_flowcell(tmp_path / 'first', Flowcell(3), reads=2000, hours=2)
+    small = write_flowcell(tmp_path / 'small', Flowcell(1), reads=200_000, hours=2)
+    large = write_flowcell(tmp_path / 'large', Flowcell(2), reads=400_000, hours=2)
+    size = lambda path: sum(x.stat().st_size for x in path.iterdir())
+    assert size(large) > 100 * 2**20
+
+    small_peak, rows = peak_rss(first, small, tmp_path / 'small.duckdb', f'{MEMORY_LIMIT}B')
+    assert rows == 200_000
+    large_peak, rows = peak_rss(first, large, tmp_path / 'large.duckdb', f'{MEMORY_LIMIT}B')
+    assert rows == 400_000
+
+    # The load stays within the memory limit of duckdb, and the large source, twice the
+    # size of the small one, needs little more
+    assert small_peak < MEMORY_LIMIT + MEMORY_OVERHEAD
+    assert large_peak < MEMORY_LIMIT + MEMORY_OVERHEAD
+    assert large_peak < small_peak + 64 * 2**20
@@ -0,0 +1,104 @@
+"""
+Unit tests for the rollup tables maintained by Store.
+
+"""
+
+import pytest
+
+import pigeon.store
+from pigeon.cramstats_dir import LocalCramStatsDir
+from pigeon.flowcell_dir import LocalFlowcellDir
+from pigeon.rollups import ROLLUPS
+
+import conftest
+
+# --------
+# Fixtures
+
+@pytest.fixture(params=[False, True], ids=['tables', 'lake'])
+def store(request, tmp_path) -> pigeon.store.Store:
+    lake_path = str(tmp_path / 'lake') if request.param else None
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'), lake_path=lake_path)
+    yield store
+    store.close()
+
+
+def write_flowcell(path, **kwargs):
+    path.mkdir(parents=True, exist_ok=True)
+    for name, data in conftest.minknow_files(**kwargs).items():
+        (path / name).write_bytes(data)
+
+    return LocalFlowcellDir(path)
+
+
+def assert_rollups_match(store):
+    """Each rollup has the same rows as aggregating its source table from scratch"""
+    for name, rollup in ROLLUPS.items():
+        expected = store._conn.sql(rollup.select.format(rows=rollup.source)).fetchall()
+        actual = store._conn.sql(f'select * from {name}').fetchall()
+        # Sums of floats depend on the order rows were added in
+        key = lambda row: [x if isinstance(x, str) else str(x) for x in row if not isinstance(x, float)]
+        assert len(actual) == len(expected), name
+        for a, e in zip(sorted(actual, key=key), sorted(expected, key=key)):
+            assert a == pytest.approx(e), name
+
+# --------
+# Tests
+
+def test_insert(store, tmp_path, cramstats_path):
+    for i in range(2):
+        store.insert_flowcell(write_flowcell(tmp_path / str(i) / conftest.flowcell_name, run_id=f'run{i}', seed=i))
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+
+    assert store._conn.sql('select sum(reads) from rollup_reads_hourly').fetchone()[0] == 200
+    assert store._conn.sql('select sum(reads) from rollup_cramstats').fetchone()[0] == 100
+    assert_rollups_match(store)
+
+
+def test_replace_run(store, tmp_path):
+    path = tmp_path / conftest.flowcell_name
+    store.insert_flowcell(write_flowcell(path, seed=1))
+    store.insert_flowcell(write_flowcell(path, reads=50, seed=2))
+
+    assert store._conn.sql('select sum(reads) from rollup_read_lengths').fetchone()[0] == 50
+    assert_rollups_match(store)
+
+
+def test_replace_cramstats(store, tmp_path, cramstats_path):
+    other_path = tmp_path / 'sup_PAO99309.cram.stats'
+    other_path.write_bytes(conftest.cramstats_file(['other1', 'other2'], seed=2))
+    store.insert_cramstats(LocalCramStatsDir(other_path))
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+
+    # The same reads realigned
+    cramstats_path.write_bytes(conftest.cramstats_file((f'{conftest.run_id[:8]}-{i:08d}' for i in range(100)), seed=3))
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+
+    rows = dict(store._conn.sql('select model, sum(reads) from rollup_cramstats group by model').fetchall())
+    assert rows == {'hac': 100, 'sup': 2}
+    assert_rollups_match(store)
+
+
+def test_rebuild(store, flowcell_path):
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    store._conn.execute('delete from rollup_reads_hourly')
+
+    store.rebuild_rollups()
+
+    assert_rollups_match(store)
+
+
+def test_existing_store(tmp_path, flowcell_path):
+    """Rollups are built when a store created before they existed is opened"""
+    db_path = str(tmp_path / 'pigeon.duckdb')
+    store = pigeon.store.Store(db_path)
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    for name in ROLLUPS:
+        store._conn.execute(f'drop table {name}')
+    store.close()
+
+    store = pigeon.store.Store(db_path)
+
+    assert store._conn.sql('select sum(reads) from rollup_reads_hourly').fetchone()[0] == 100
+    assert_rollups_match(store)
+    store.close()
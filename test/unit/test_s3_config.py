@@ -0,0 +1,120 @@
+"""
+Unit tests for the S3 configuration shared by boto3 and duckdb.
+
+"""
+
+import pytest
+
+import boto3
+import duckdb
+
+import pigeon
+import pigeon.store
+from pigeon.cache import DiskCache
+from pigeon.cramstats_dir import RemoteCramStatsDir
+from pigeon.flowcell_dir import RemoteFlowcellDir
+from pigeon.local_s3 import LocalS3
+from pigeon.s3_config import S3Config
+from pigeon.synthetic import Flowcell, write_cramstats, write_flowcell
+
+# --------
+# Fixtures
+
+@pytest.fixture
+def s3(tmp_path):
+    root = tmp_path / 's3'
+    write_flowcell(root / 'bucket' / 'flowcells', Flowcell(1), reads=500)
+    write_cramstats(root / 'bucket' / 'cramstats', Flowcell(1), reads=100)
+    with LocalS3(str(root)) as s3:
+        yield s3
+
+
+def has_httpfs() -> bool:
+    try:
+        duckdb.connect().execute('load httpfs')
+        return True
+    except duckdb.Error:
+        return False
+
+# --------
+# Tests
+
+def test_client():
+    config = S3Config(endpoint_url='http://127.0.0.1:9000', unsigned=True, path_style=True, max_connections=8)
+    client = config.client()
+
+    assert client.meta.endpoint_url == 'http://127.0.0.1:9000'
+    assert client.meta.config.max_pool_connections == 8
+    assert client.meta.config.s3['addressing_style'] == 'path'
+    # Equal configurations share a client and its connections
+    assert S3Config(endpoint_url='http://127.0.0.1:9000', unsigned=True, path_style=True,
+                    max_connections=8).client() is client
+    assert config._replace(max_connections=9).client() is not client
+    assert pigeon.make_unsigned_s3() is S3Config(unsigned=True).client()
+
+
+def test_secret_sql():
+    sql = S3Config.local('http://127.0.0.1:9000').secret_sql()
+
+    assert "endpoint '127.0.0.1:9000'" in sql
+    assert 'use_ssl false' in sql
+    assert "url_style 'path'" in sql
+    assert "region 'us-east-1'" in sql
+    assert 'key_id' not in sql
+
+    sql = S3Config(endpoint_url='https://s3.example.org', region="it's").secret_sql()
+    assert 'use_ssl true' in sql
+    assert "region 'it''s'" in sql
+
+
+def test_secret_sql_credentials():
+    session = boto3.Session(aws_access_key_id='AKIDEXAMPLE', aws_secret_access_key='secret', region_name='eu-west-2')
+
+    # Credentials are found and refreshed by duckdb
+    sql = S3Config().secret_sql(session)
+    assert "provider 'credential_chain'" in sql
+    assert "refresh 'auto'" in sql
+    assert 'AKIDEXAMPLE' not in sql
+
+    sql = S3Config().secret_sql(session, credential_chain=False)
+    assert "provider 'config'" in sql
+    assert "key_id 'AKIDEXAMPLE'" in sql
+
+
+def test_for_workers():
+    assert S3Config().for_workers(1).max_connections == 32
+    assert S3Config().for_workers(8).max_connections == 80
+
+
+def test_store_settings(tmp_path):
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'), s3_config=S3Config(unsigned=True))
+
+    settings = S3Config().duckdb_settings()
+    # Settings added in later versions of duckdb are skipped
+    known = {x[0] for x in store._conn.execute('select name from duckdb_settings()').fetchall()}
+    assert 'enable_http_metadata_cache' in known
+    assert known & {'parquet_metadata_cache', 'enable_object_cache'}
+    for name, value in settings.items():
+        if name not in known:
+            continue
+        assert store._conn.execute(f"select current_setting('{name}')").fetchone()[0] == value
+    # Settings apply to the cursors of ingest workers
+    cursor = store._conn.cursor()
+    assert cursor.execute("select current_setting('enable_http_metadata_cache')").fetchone()[0]
+    store.close()
+
+
+def test_load(s3, tmp_path):
+    """Dirs and the store all take the configuration of the endpoint"""
+    flowcell = Flowcell(1)
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'), s3_config=s3.config)
+    cache = None if has_httpfs() else DiskCache(str(tmp_path / 'cache'), max_bytes=1 << 30)
+
+    store.insert_flowcell(RemoteFlowcellDir(f's3://bucket/flowcells/{flowcell.name}', cache=cache,
+                                            s3_config=s3.config))
+    store.insert_cramstats(RemoteCramStatsDir(f's3://bucket/cramstats/hac_{flowcell.flow_cell_id}.cram.stats',
+                                              cache=cache, s3_config=s3.config))
+
+    assert store._conn.sql('select count(*) from sequencing_summary').fetchone()[0] == 500
+    assert store._conn.sql('select count(*) from cramstats').fetchone()[0] == 100
+    store.close()
@@ -0,0 +1,111 @@
+"""
+Unit tests for the stratified sample tables maintained by Store.
+
+"""
+
+import pytest
+
+import pigeon.store
+from pigeon.cramstats_dir import LocalCramStatsDir
+from pigeon.flowcell_dir import LocalFlowcellDir
+from pigeon.samples import SAMPLES
+
+import conftest
+
+# --------
+# Fixtures
+
+@pytest.fixture(params=[False, True], ids=['tables', 'lake'])
+def store(request, tmp_path) -> pigeon.store.Store:
+    lake_path = str(tmp_path / 'lake') if request.param else None
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'), lake_path=lake_path, sample_size=30)
+    yield store
+    store.close()
+
+
+def write_flowcell(path, **kwargs):
+    path.mkdir(parents=True, exist_ok=True)
+    for name, data in conftest.minknow_files(**kwargs).items():
+        (path / name).write_bytes(data)
+
+    return LocalFlowcellDir(path)
+
+
+def sampled(store, name):
+    return sorted(store._conn.sql(f'select * from {name}').fetchall(), key=str)
+
+
+def assert_samples_match(store):
+    """Each sample has the same rows as sampling its source from scratch"""
+    actual = {name: sampled(store, name) for name in SAMPLES}
+    store.rebuild_samples()
+    for name in SAMPLES:
+        assert actual[name] == sampled(store, name), name
+
+# --------
+# Tests
+
+def test_insert(store, tmp_path, cramstats_path):
+    for i in range(2):
+        store.insert_flowcell(write_flowcell(tmp_path / str(i) / conftest.flowcell_name, run_id=f'run{i}', seed=i))
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+
+    rows = store._conn.sql("""
+        select run_id, count(*), any_value(stratum_rows), any_value(sample_fraction)
+        from sample_sequencing_summary group by run_id order by run_id
+        """).fetchall()
+    assert rows == [('run0', 30, 100, 0.3), ('run1', 30, 100, 0.3)]
+    assert store._conn.sql('select count(*) from sample_cramstats').fetchone()[0] == 30
+    assert_samples_match(store)
+
+
+def test_reproducible(tmp_path):
+    """The same reads are sampled whatever order they are loaded in"""
+    flowcells = [write_flowcell(tmp_path / str(i) / conftest.flowcell_name, run_id='run', seed=i, reads=50)
+                 for i in range(2)]
+    samples = []
+    for order in [flowcells, flowcells[::-1]]:
+        store = pigeon.store.Store(str(tmp_path / f'{len(samples)}.duckdb'), sample_size=10)
+        # Load the reads of one run in two parts
+        for fdir in order:
+            rel = fdir.make_table_relation('sequencing_summary', store._conn)
+            with store._transaction():
+                store._insert('sequencing_summary', rel, {})
+        samples.append(store._conn.sql('select read_id from sample_sequencing_summary order by read_id').fetchall())
+        store.close()
+
+    assert len(samples[0]) == 10
+    assert samples[0] == samples[1]
+
+
+def test_replace_run(store, tmp_path):
+    path = tmp_path / conftest.flowcell_name
+    store.insert_flowcell(write_flowcell(path, seed=1))
+    store.insert_flowcell(write_flowcell(path, reads=20, seed=2))
+
+    assert store._conn.sql('select count(*), any_value(sample_fraction) from sample_sequencing_summary').fetchone() == (20, 1.0)
+    assert_samples_match(store)
+
+
+def test_replace_cramstats(store, tmp_path, cramstats_path):
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+
+    cramstats_path.write_bytes(conftest.cramstats_file((f'{conftest.run_id[:8]}-{i:08d}' for i in range(50)), seed=3))
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+
+    assert_samples_match(store)
+
+
+def test_sample_size_changed(tmp_path, flowcell_path):
+    db_path = str(tmp_path / 'pigeon.duckdb')
+    store = pigeon.store.Store(db_path, sample_size=10)
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    store.close()
+
+    store = pigeon.store.Store(db_path, sample_size=25)
+    assert store._conn.sql('select count(*) from sample_sequencing_summary').fetchone()[0] == 25
+    store.close()
+
+    store = pigeon.store.Store(db_path)
+    assert store.sample_size == 25
+    store.close()
@@ -0,0 +1,104 @@
+"""
+Unit tests for quantile sketches and the sketch rollups of Store.
+
+"""
+
+import duckdb
+import numpy as np
+import pytest
+
+import pigeon.store
+from pigeon.cramstats_dir import LocalCramStatsDir
+from pigeon.flowcell_dir import LocalFlowcellDir
+from pigeon.sketches import ALPHA, Sketch, bucket_sql
+
+import conftest
+
+# --------
+# Fixtures
+
+@pytest.fixture
+def store(tmp_path) -> pigeon.store.Store:
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'))
+    yield store
+    store.close()
+
+
+def make_sketch(values) -> Sketch:
+    """Sketch values with the bucketing used by the store"""
+    conn = duckdb.connect()
+    rows = conn.execute(f"""
+        select bucket, count(*), sum(value) from (select {bucket_sql('value')} as bucket, value
+                                                  from (select unnest(?) as value))
+        group by bucket
+        """, [list(values)]).fetchall()
+    return Sketch.from_rows(rows)
+
+
+def write_flowcell(path, **kwargs):
+    path.mkdir(parents=True, exist_ok=True)
+    for name, data in conftest.minknow_files(**kwargs).items():
+        (path / name).write_bytes(data)
+
+    return LocalFlowcellDir(path)
+
+# --------
+# Tests
+
+def test_quantiles():
+    values = np.random.default_rng(1).lognormal(9, 1, 10_000)
+
+    sketch = make_sketch(values)
+
+    for q, estimate in zip([0.01, 0.5, 0.99], sketch.quantiles([0.01, 0.5, 0.99])):
+        exact = np.quantile(values, q, method='inverted_cdf')
+        assert estimate == pytest.approx(exact, rel=ALPHA)
+    assert sketch.count == 10_000
+    assert sketch.mean() == pytest.approx(values.mean())
+
+
+def test_n50():
+    values = np.random.default_rng(2).lognormal(9, 1, 10_000)
+    ordered = np.sort(values)[::-1]
+    exact = ordered[np.searchsorted(np.cumsum(ordered), values.sum() / 2)]
+
+    assert make_sketch(values).n50() == pytest.approx(exact, rel=ALPHA)
+
+
+def test_merge():
+    a, b = [1.0, 2.0, 3.0, 0.0], [2.0, 50.0]
+
+    merged = make_sketch(a).merge(make_sketch(b))
+
+    assert merged.buckets == make_sketch(a + b).buckets
+    assert merged.quantile(0) == 0.0
+    assert [x.count for x in merged.histogram()] == [1, 1, 2, 1, 1]
+
+
+def test_store_sketch(store, tmp_path):
+    for i in range(2):
+        store.insert_flowcell(write_flowcell(tmp_path / str(i) / conftest.flowcell_name, run_id=f'run{i}',
+                                             experiment_id=f'exp{i}', seed=i))
+    lengths = [x[0] for x in store._conn.sql("select sequence_length_template from sequencing_summary where run_id = 'run1'").fetchall()]
+
+    sketch = store.sketch('sequence_length_template', experiment_ids=['exp1'])
+
+    assert sketch.count == 100
+    assert sketch.quantile(0.5) == pytest.approx(np.quantile(lengths, 0.5, method='inverted_cdf'), rel=ALPHA)
+    assert sorted(store.run_sketches('mean_qscore_template')) == ['run0', 'run1']
+    assert store.sketch('mean_qscore_template', run_ids=['run0'], passes_filtering=True).count == \
+        store._conn.sql("select count(*) from sequencing_summary where run_id = 'run0' and passes_filtering").fetchone()[0]
+    with pytest.raises(ValueError):
+        store.sketch('sequence_length_template', model='hac')
+
+
+def test_alignments_by_run(store, flowcell_path, cramstats_path):
+    # Alignments loaded before their reads aren't matched to the run until rebuilt
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    assert store.sketch('iden', run_ids=[conftest.run_id]).count == 0
+
+    store.rebuild_rollups()
+
+    assert store.sketch('iden', run_ids=[conftest.run_id], model='hac').count == 100
+    assert store.sketch('acc').count == 100
@@ -0,0 +1,164 @@
+"""
+Unit tests for Store which do not need access to S3.
+
+"""
+
+import pytest
+
+import duckdb
+
+import pigeon.store
+from pigeon.flowcell_dir import FlowcellDir, LocalFlowcellDir, TableNotPresent
+
+import conftest
+
+# --------
+# Fixtures
+
+class FakeFlowcellDir(FlowcellDir):
+    """A flowcell with a handful of generated rows in each table"""
+    def __init__(self, run_id: str, experiment_id: str='exp1', reads: int=10):
+        self.run_id = run_id
+        self.experiment_id = experiment_id
+        self.reads = reads
+
+    def __repr__(self):
+        return f"FakeFlowcellDir('{self.run_id}')"
+
+    def get_available_tables(self):
+        return {}
+
+    def make_table_relation(self, table_name: str, connection: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+        match table_name:
+            case 'final_summary':
+                return connection.sql(f"""
+                    select '{self.run_id}' as acquisition_run_id, '{self.experiment_id}' as protocol_group_id,
+                           'FC001' as flow_cell_id
+                    """)
+            case 'pore_activity':
+                return connection.sql("""
+                    select range * 60 as experiment_time, channel_state, state_time
+                    from range(3), (values ('pore', 100), ('strand', 20)) s(channel_state, state_time)
+                    """)
+            case 'throughput':
+                return connection.sql("""
+                    select range * 60 as experiment_time, range * 10 as reads from range(3)
+                    """)
+            case 'sequencing_summary':
+                return connection.sql(f"""
+                    select 'read-{self.run_id}-' || range as read_id, '{self.run_id}' as run_id,
+                           '{self.experiment_id}' as experiment_id, range * 1.5 as start_time,
+                           1000 + range as sequence_length_template, range % 2 = 0 as passes_filtering
+                    from range({self.reads})
+                    """)
+            case _:
+                raise TableNotPresent(table_name)
+
+
+class BrokenFlowcellDir(FakeFlowcellDir):
+    def make_table_relation(self, table_name: str, connection: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+        if table_name == 'throughput':
+            raise OSError('simulated S3 failure')
+        return super().make_table_relation(table_name, connection)
+
+
+class UninsertableFlowcellDir(FakeFlowcellDir):
+    """Fails when inserted rather than when read"""
+    def make_table_relation(self, table_name: str, connection: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+        rel = super().make_table_relation(table_name, connection)
+        if table_name == 'sequencing_summary':
+            rel = rel.project('*, 1 as not_a_column')
+        return rel
+
+
+class MissingFlowcellDir(FakeFlowcellDir):
+    def make_table_relation(self, table_name: str, connection: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyRelation:
+        raise TableNotPresent(table_name)
+
+
+@pytest.fixture
+def store(tmp_path) -> pigeon.store.Store:
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'))
+    yield store
+    store.close()
+
+# --------
+# Tests
+
+def test_insert_flowcell(store):
+    store.insert_flowcell(FakeFlowcellDir('run1'))
+
+    counts = {t: store._conn.sql(f'select count(*) from {t}').fetchone()[0]
+              for t in ['final_summary', 'pore_activity', 'throughput', 'sequencing_summary']}
+
+    assert counts == {'final_summary': 1, 'pore_activity': 3, 'throughput': 3, 'sequencing_summary': 10}
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_insert_flowcells(store, workers):
+    fdirs = [FakeFlowcellDir(f'run{i}') for i in range(10)]
+
+    failures = store.insert_flowcells(fdirs, workers=workers)
+
+    assert failures == []
+    runs = store._conn.sql('select run_id, count(*) from sequencing_summary group by run_id').fetchall()
+    assert sorted(runs) == sorted((f'run{i}', 10) for i in range(10))
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_insert_flowcells_isolates_errors(store, workers):
+    broken = BrokenFlowcellDir('bad')
+    fdirs = [FakeFlowcellDir('run1'), broken, MissingFlowcellDir('missing'), FakeFlowcellDir('run2')]
+
+    failures = store.insert_flowcells(fdirs, workers=workers)
+
+    assert [f for (f, e) in failures] == [broken]
+    assert isinstance(failures[0][1], OSError)
+    runs = {x[0] for x in store._conn.sql('select acquisition_run_id from final_summary').fetchall()}
+    assert runs == {'run1', 'run2'}
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_batch_commits(store, workers):
+    """A flowcell failing to insert in a batch doesn't lose the rest of the batch"""
+    bad = UninsertableFlowcellDir('bad')
+    fdirs = [FakeFlowcellDir('run1'), bad, FakeFlowcellDir('run2'), FakeFlowcellDir('run3'), FakeFlowcellDir('run4')]
+
+    failures = store.insert_flowcells(fdirs, workers=workers, commit_every=3)
+
+    assert [f for (f, e) in failures] == [bad]
+    for table_name, column in pigeon.store.RUN_ID_COLUMNS.items():
+        runs = {x[0] for x in store._conn.sql(f'select distinct {column} from {table_name}').fetchall()}
+        assert runs == {'run1', 'run2', 'run3', 'run4'}
+
+
+def test_run_columns_bound(store, tmp_path):
+    """run and experiment ids are inserted as values, whatever characters they contain"""
+    path = tmp_path / conftest.flowcell_name
+    path.mkdir()
+    for name, data in conftest.minknow_files(experiment_id="o'brien").items():
+        (path / name).write_bytes(data)
+
+    store.insert_flowcell(LocalFlowcellDir(path))
+
+    rows = store._conn.sql('select distinct experiment_id, run_id from throughput').fetchall()
+    assert rows == [("o'brien", conftest.run_id)]
+
+
+def test_migrate_pore_activity(tmp_path, flowcell_path):
+    """pore_activity stored in the wide layout is moved to pore_activity_states"""
+    db_path = str(tmp_path / 'pigeon.duckdb')
+    store = pigeon.store.Store(db_path)
+    store.insert_flowcell(LocalFlowcellDir(flowcell_path))
+    before = store._conn.sql('select * from pore_activity order by all').fetchall()
+    store._conn.execute('create table _wide as select * from pore_activity')
+    store._conn.execute('drop view pore_activity')
+    store._conn.execute('drop table pore_activity_states')
+    store._conn.execute('alter table _wide rename to pore_activity')
+    store.close()
+
+    store = pigeon.store.Store(db_path)
+
+    assert store._conn.sql('select * from pore_activity order by all').fetchall() == before
+    assert store._conn.sql('select count(*) from pore_activity_states').fetchone()[0] == 50
+    store.close()
@@ -0,0 +1,103 @@
+"""
+Unit tests for the synthetic data generator and the local S3 stand-in.
+
+"""
+
+import pytest
+
+import pigeon.store
+from pigeon.cache import DiskCache
+from pigeon.cramstats_dir import LocalCramStatsDir, RemoteCramStatsDir
+from pigeon.flowcell_dir import LocalFlowcellDir, RemoteFlowcellDir
+from pigeon.local_s3 import LocalS3
+from pigeon.synthetic import Flowcell, write_cramstats, write_flowcell
+
+# --------
+# Fixtures
+
+@pytest.fixture
+def store(tmp_path) -> pigeon.store.Store:
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def s3(tmp_path):
+    root = tmp_path / 's3'
+    flowcell = Flowcell(1)
+    write_flowcell(root / 'bucket' / 'flowcells', flowcell, reads=500)
+    write_cramstats(root / 'bucket' / 'cramstats', flowcell, reads=100)
+    with LocalS3(str(root)) as s3:
+        yield s3
+
+# --------
+# Tests
+
+def test_load(store, tmp_path):
+    flowcell = Flowcell(1)
+    fc_path = write_flowcell(tmp_path, flowcell, reads=1000)
+    cramstats_path = write_cramstats(tmp_path, flowcell, reads=200)
+
+    store.insert_flowcell(LocalFlowcellDir(fc_path))
+    store.insert_cramstats(LocalCramStatsDir(cramstats_path))
+
+    conn = store._conn
+    assert conn.sql('select count(distinct read_id), any_value(run_id) from sequencing_summary').fetchone() == \
+        (1000, flowcell.run_id)
+    assert conn.sql('select count(*) from throughput').fetchone()[0] == 72 * 60
+    # cram.stats names are reads of the flowcell
+    assert conn.sql('select count(*) from cramstats join sequencing_summary on name = read_id').fetchone()[0] == 200
+
+
+def test_long_run(store, tmp_path):
+    """Runs of more than nine days end on valid dates"""
+    store.insert_flowcell(LocalFlowcellDir(write_flowcell(tmp_path, Flowcell(2), reads=100, hours=240)))
+
+    row = store._conn.sql("select acquisition_stopped, acquisition_stopped::TIMESTAMPTZ - started::TIMESTAMPTZ "
+                          "from final_summary").fetchone()
+    assert row[0] == '2024-01-11T12:00:00.000000+00:00'
+    assert row[1].days == 10
+
+
+def test_deterministic(tmp_path):
+    paths = [write_flowcell(tmp_path / str(i), Flowcell(3), reads=100, hours=1) for i in range(2)]
+
+    for a, b in zip(*(sorted(p.iterdir()) for p in paths)):
+        assert a.read_bytes() == b.read_bytes()
+
+
+def test_s3_listing(s3):
+    client = s3.client()
+
+    page = client.list_objects_v2(Bucket='bucket', Prefix='', Delimiter='/')
+    keys = client.list_objects_v2(Bucket='bucket', Prefix='flowcells/', MaxKeys=2)
+    rest = client.list_objects_v2(Bucket='bucket', Prefix='flowcells/', ContinuationToken=keys['NextContinuationToken'])
+
+    assert [x['Prefix'] for x in page['CommonPrefixes']] == ['cramstats/', 'flowcells/']
+    assert keys['IsTruncated'] and len(keys['Contents']) == 2
+    assert len(rest['Contents']) == 2 and not rest['IsTruncated']
+
+
+def test_s3_range(s3):
+    client = s3.client()
+    key = f'cramstats/hac_{Flowcell(1).flow_cell_id}.cram.stats'
+
+    head = client.head_object(Bucket='bucket', Key=key)
+    part = client.get_object(Bucket='bucket', Key=key, Range='bytes=0-3')
+
+    assert part['Body'].read() == b'name'
+    assert part['ETag'] == head['ETag']
+
+
+def test_s3_load(s3, store, tmp_path):
+    flowcell = Flowcell(1)
+    client = s3.client()
+    cache = DiskCache(str(tmp_path / 'cache'), max_bytes=1 << 30)
+
+    store.insert_flowcell(RemoteFlowcellDir(f's3://bucket/flowcells/{flowcell.name}', client, cache=cache))
+    store.insert_cramstats(RemoteCramStatsDir(f's3://bucket/cramstats/hac_{flowcell.flow_cell_id}.cram.stats',
+                                              client, cache=cache))
+
+    assert store._conn.sql('select count(*) from sequencing_summary').fetchone()[0] == 500
+    assert store._conn.sql('select count(*) from cramstats').fetchone()[0] == 100
@@ -0,0 +1,142 @@
+"""
+Unit tests for tailing the tables of a flowcell while its run is in progress.
+
+"""
+
+import os
+import threading
+
+import pytest
+
+import pigeon.store
+from pigeon.cache import DiskCache
+from pigeon.flowcell_dir import LocalFlowcellDir, RemoteFlowcellDir
+
+import conftest
+
+bucket = 'test-bucket'
+flowcell_prefix = f'flowcells/hg001/{conftest.flowcell_name}'
+
+FILES = conftest.minknow_files()
+FINAL_SUMMARY = 'final_summary_PAO99309_94e07fab_0d5e3ac7.txt'
+SEQUENCING_SUMMARY = 'sequencing_summary_PAO99309_94e07fab_0d5e3ac7.txt'
+
+# --------
+# Fixtures
+
+@pytest.fixture
+def store(tmp_path) -> pigeon.store.Store:
+    store = pigeon.store.Store(str(tmp_path / 'pigeon.duckdb'))
+    yield store
+    store.close()
+
+
+def written(fraction: float):
+    """The files of a run part way through, cut mid-line, without its final_summary"""
+    return {name: data[:int(len(data) * fraction)] for (name, data) in FILES.items() if name != FINAL_SUMMARY}
+
+
+def count(store, table_name):
+    return store._conn.sql(f'select count(*) from {table_name}').fetchone()[0]
+
+# --------
+# Tests
+
+def test_tail_local(tmp_path, store):
+    path = tmp_path / conftest.flowcell_name
+    path.mkdir()
+    fdir = LocalFlowcellDir(path)
+
+    # Nothing to identify the run yet
+    (path / SEQUENCING_SUMMARY).write_bytes(FILES[SEQUENCING_SUMMARY].split(b'\n')[0])
+    assert store.tail_flowcell(fdir) == pigeon.store.TailResult({}, False)
+
+    for name, data in written(0.6).items():
+        (path / name).write_bytes(data)
+    first = store.tail_flowcell(fdir)
+    assert first == pigeon.store.TailResult({'sequencing_summary': 59, 'throughput': 1, 'pore_activity': 28}, False)
+
+    for name, data in written(1.0).items():
+        (path / name).write_bytes(data)
+    second = store.tail_flowcell(fdir)
+    assert second == pigeon.store.TailResult({'sequencing_summary': 41, 'throughput': 4, 'pore_activity': 22}, False)
+    assert count(store, 'final_summary') == 0
+
+    (path / FINAL_SUMMARY).write_bytes(FILES[FINAL_SUMMARY])
+    third = store.tail_flowcell(fdir)
+    assert third == pigeon.store.TailResult({'sequencing_summary': 0, 'throughput': 0, 'pore_activity': 0,
+                                             'final_summary': 1}, True)
+    assert store.tail_flowcell(fdir) == pigeon.store.TailResult({}, True)
+
+    # The same as loading the completed run
+    whole = pigeon.store.Store(str(tmp_path / 'whole.duckdb'))
+    whole.insert_flowcell(fdir)
+    for table_name in ['final_summary', 'pore_activity', 'pore_activity_states', 'throughput', 'sequencing_summary', 'read_index',
+                       'sample_sequencing_summary']:
+        sql = f'select * from {table_name} order by all'
+        assert store._conn.sql(sql).fetchall() == whole._conn.sql(sql).fetchall(), table_name
+    sql = 'select source, etag, rows from load_manifest order by all'
+    assert store._conn.sql(sql).fetchall() == whole._conn.sql(sql).fetchall()
+    whole.close()
+
+    # Already loaded, so skipped
+    store.insert_flowcell(fdir)
+    assert count(store, 'sequencing_summary') == 100
+
+
+def test_watch_remote(tmp_path, store):
+    objects = {f'{flowcell_prefix}/{name}': data for (name, data) in written(0.5).items()}
+    s3 = conftest.FakeS3(objects)
+    fdir = RemoteFlowcellDir(f's3://{bucket}/{flowcell_prefix}', s3, cache=DiskCache(tmp_path / 'cache', 10**8))
+    stop = threading.Event()
+    stop.set()
+
+    assert not store.watch_flowcell(fdir, interval=0, stop=stop)
+    assert 0 < count(store, 'sequencing_summary') < 50
+    # Growing files are read by range rather than downloaded
+    assert s3.downloads == []
+
+    objects.update({f'{flowcell_prefix}/{name}': data for (name, data) in FILES.items()})
+    assert store.watch_flowcell(fdir, interval=0)
+    assert count(store, 'final_summary') == 1
+    assert count(store, 'pore_activity') == 5
+    assert count(store, 'sequencing_summary') == 100
+    assert count(store, 'tail_offsets') == 3
+    assert s3.downloads == [f'{flowcell_prefix}/{FINAL_SUMMARY}']
+
+
+def test_tail_then_insert(tmp_path, store):
+    path = tmp_path / conftest.flowcell_name
+    path.mkdir()
+    fdir = LocalFlowcellDir(path)
+
+    for name, data in written(0.6).items():
+        (path / name).write_bytes(data)
+    assert store.tail_flowcell(fdir).rows['sequencing_summary'] == 59
+
+    # The run completes without being tailed again, then is loaded whole
+    for name, data in FILES.items():
+        (path / name).write_bytes(data)
+    store.insert_flowcell(fdir)
+    assert count(store, 'sequencing_summary') == 100
+    assert store._conn.sql('select count(distinct read_id) from sequencing_summary').fetchone()[0] == 100
+    assert count(store, 'pore_activity') == 5
+    assert count(store, 'tail_offsets') == 0
+
+
+def test_tail_changed_file(tmp_path, store):
+    path = tmp_path / conftest.flowcell_name
+    path.mkdir()
+    for name, data in FILES.items():
+        (path / name).write_bytes(data)
+    fdir = LocalFlowcellDir(path)
+    store.insert_flowcell(fdir)
+
+    # A loaded file rewritten, which has no tail offset to continue from
+    (path / SEQUENCING_SUMMARY).write_bytes(FILES[SEQUENCING_SUMMARY])
+    os.utime(path / SEQUENCING_SUMMARY, ns=(0, 0))
+    assert store.tail_flowcell(fdir).complete
+    assert count(store, 'sequencing_summary') == 100
+    assert count(store, 'final_summary') == 1
+    assert count(store, 'pore_activity') == 5
+    assert store.tail_flowcell(fdir) == pigeon.store.TailResult({}, True)